@@ -0,0 +1,342 @@
+"""Contains sharded broadcast of the day's holidays over a shared work queue"""
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+import zlib
+from typing import Optional
+
+from aiogram import Bot
+
+from database import Database
+from date import DATE_TIME_INFO
+from logger import LOGGER
+from poster import Poster
+from rate_limiter import SHARED_BUCKETS_SCHEMA, SharedTokenBucket
+from settings import SETTINGS_MANAGER
+from storage import STORAGE
+
+
+SCHEMA = (
+    """
+CREATE TABLE IF NOT EXISTS shards (
+    day TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    shards INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT NOT NULL DEFAULT '',
+    lease_until REAL NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, shard)
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    day TEXT NOT NULL,
+    tg_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    file_id TEXT NOT NULL DEFAULT '',
+    delivered_at REAL NOT NULL,
+    PRIMARY KEY (day, tg_id, title)
+);
+"""
+    + SHARED_BUCKETS_SCHEMA
+)
+
+
+def get_shard(tg_id: int, shards: int) -> int:
+    """Returns the shard of the subscriber. Unlike hash(), crc32 is the same
+    in every process, so all the workers agree on the partitioning
+
+    Args:
+        tg_id (int): subscriber telegram id
+        shards (int): shards number
+
+    Returns:
+        int: shard index
+    """
+    return zlib.crc32(str(tg_id).encode()) % shards
+
+
+class BroadcastQueue:
+    """Work queue of broadcast shards shared by the poster workers.
+    A day is published as shards that workers claim with a lease. A shard
+    of a dead worker is claimed again when its lease expires. Deliveries are
+    recorded next to the shards, so the next claimer skips them even when
+    the bot database is disabled"""
+
+    def __init__(
+        self, path: str = os.path.join(".", "storage", "broadcast.db")
+    ) -> None:
+        self.database = Database(path, schema=SCHEMA)
+
+    def publish(self, day: str, shards: int) -> bool:
+        """Publishes the day's shards. Delivered shards of an already published
+        day are made pending again, so a re-post reaches the new subscribers,
+        while the recorded deliveries are skipped. Claimed shards are left
+        to their workers
+
+        Args:
+            day (str): day in dd-mm-yy format
+            shards (int): shards number
+
+        Returns:
+            bool: True if delivered shards were made pending again, otherwise False
+        """
+        with self.database.transaction() as connection:
+            connection.execute(
+                "DELETE FROM shards WHERE day <> ? AND state = 'done'", (day,)
+            )
+            republished = (
+                connection.execute(
+                    "UPDATE shards SET state = 'pending', worker = '' "
+                    "WHERE day = ? AND state = 'done'",
+                    (day,),
+                ).rowcount
+                > 0
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO shards (day, shard, shards) VALUES (?, ?, ?)",
+                [(day, shard, shards) for shard in range(shards)],
+            )
+            connection.execute(
+                "DELETE FROM deliveries WHERE day NOT IN (SELECT day FROM shards)"
+            )
+        return republished
+
+    def is_published(self, day: str) -> bool:
+        """Checks that the day's shards are published
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            bool: True if published, otherwise False
+        """
+        return (
+            len(self.database.execute("SELECT 1 FROM shards WHERE day = ?", (day,))) > 0
+        )
+
+    def claim(
+        self, day: str, worker: str, lease_seconds: float
+    ) -> Optional[tuple[int, int]]:
+        """Claims a pending shard of the day, or one whose lease has expired
+
+        Args:
+            day (str): day in dd-mm-yy format
+            worker (str): worker id
+            lease_seconds (float): lease duration
+
+        Returns:
+            Optional[tuple[int, int]]: (shard, shards), None if nothing is left
+        """
+        now = time.time()
+        lease_until = now + lease_seconds
+        with self.database.transaction() as connection:
+            # single statement, so two workers can not claim the same shard
+            connection.execute(
+                "UPDATE shards SET state = 'claimed', worker = ?, lease_until = ? "
+                "WHERE rowid = (SELECT rowid FROM shards WHERE day = ? AND "
+                "(state = 'pending' OR (state = 'claimed' AND lease_until < ?)) "
+                "ORDER BY shard LIMIT 1)",
+                (worker, lease_until, day, now),
+            )
+            row = connection.execute(
+                "SELECT shard, shards FROM shards WHERE day = ? AND worker = ? "
+                "AND state = 'claimed' AND lease_until = ?",
+                (day, worker, lease_until),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def renew(
+        self,
+        day: str,
+        shard: int,
+        worker: str,
+        lease_seconds: float,
+        progress: tuple[int, int],
+    ) -> bool:
+        """Extends the lease of the claimed shard and records its progress
+
+        Args:
+            day (str): day in dd-mm-yy format
+            shard (int): shard index
+            worker (str): worker id
+            lease_seconds (float): lease duration
+            progress (tuple[int, int]): (done, total) receivers
+
+        Returns:
+            bool: True if the shard is still held by the worker, otherwise False
+        """
+        with self.database.transaction() as connection:
+            return (
+                connection.execute(
+                    "UPDATE shards SET lease_until = ?, done = ?, total = ? "
+                    "WHERE day = ? AND shard = ? AND worker = ? AND state = 'claimed'",
+                    (time.time() + lease_seconds, *progress, day, shard, worker),
+                ).rowcount
+                == 1
+            )
+
+    def complete(self, day: str, shard: int, worker: str, progress: tuple[int, int]):
+        """Marks the shard delivered
+
+        Args:
+            day (str): day in dd-mm-yy format
+            shard (int): shard index
+            worker (str): worker id
+            progress (tuple[int, int]): (done, total) receivers
+        """
+        self.database.execute(
+            "UPDATE shards SET state = 'done', done = ?, total = ? "
+            "WHERE day = ? AND shard = ? AND worker = ?",
+            (*progress, day, shard, worker),
+        )
+
+    def get_progress(self, day: str) -> tuple[int, int]:
+        """Returns progress of the day's broadcast over all the shards
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            tuple[int, int]: (done, total) receivers of the started shards
+        """
+        rows = self.database.execute(
+            "SELECT SUM(done), SUM(total) FROM shards WHERE day = ?", (day,)
+        )
+        return rows[0][0] or 0, rows[0][1] or 0
+
+    def get_report(self, day: str) -> str:
+        """Returns per-shard progress of the day's broadcast
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            str: one line per shard
+        """
+        rows = self.database.execute(
+            "SELECT shard, state, worker, done, total FROM shards "
+            "WHERE day = ? ORDER BY shard",
+            (day,),
+        )
+        if len(rows) == 0:
+            return f"No broadcast for {day}"
+        return "\n".join(
+            f"shard {shard}: {state}, {done}/{total} receivers"
+            + (f", {worker}" if state == "claimed" else "")
+            for shard, state, worker, done, total in rows
+        )
+
+
+BROADCAST_QUEUE = BroadcastQueue()
+
+
+class BroadcastWorker:
+    """Claims broadcast shards and delivers them. Every worker process has its
+    own bot connection, and all of them share the rate limiter, so adding
+    workers raises the broadcast rate up to broadcast.messages_per_second"""
+
+    def __init__(self, bot: Bot, queue: BroadcastQueue = BROADCAST_QUEUE) -> None:
+        self.queue = queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.poster = Poster(
+            bot,
+            rate_limiter=SharedTokenBucket(
+                queue.database,
+                "telegram",
+                SETTINGS_MANAGER.broadcast.messages_per_second,
+                capacity=SETTINGS_MANAGER.broadcast.messages_per_second,
+            ),
+            delivery_database=queue.database,
+        )
+
+    def _get_progress(self) -> tuple[int, int]:
+        return self.poster.progress_done, self.poster.progress_total
+
+    async def _keep_lease(
+        self, day: str, shard: int, delivery: asyncio.Task, lost: asyncio.Event
+    ):
+        lease_seconds = SETTINGS_MANAGER.broadcast.lease_seconds
+        while not delivery.done():
+            await asyncio.sleep(lease_seconds / 3)
+            owned = await asyncio.to_thread(
+                self.queue.renew,
+                day,
+                shard,
+                self.worker_id,
+                lease_seconds,
+                self._get_progress(),
+            )
+            if not owned:
+                LOGGER.log(f"Broadcast shard {shard} of {day} is lost", "Warning")
+                lost.set()
+                delivery.cancel()
+                return
+
+    async def _deliver_shard(self, day: str, shard: int, shards: int):
+        bundle = await STORAGE.get_day_bundle_async(day)
+        receivers = [
+            receiver
+            for receiver in SETTINGS_MANAGER.get_subscribers_as_receivers()
+            if get_shard(receiver.tg_id, shards) == shard
+        ]
+        await self.poster.post_shard(bundle, receivers)
+
+    async def deliver(self, day: str) -> int:
+        """Delivers shards of the day until there is nothing left to claim
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            int: delivered shards number
+        """
+        delivered = 0
+        while True:
+            claimed = await asyncio.to_thread(
+                self.queue.claim,
+                day,
+                self.worker_id,
+                SETTINGS_MANAGER.broadcast.lease_seconds,
+            )
+            if claimed is None:
+                return delivered
+
+            shard, shards = claimed
+            LOGGER.log(f"Delivering broadcast shard {shard}/{shards} of {day}")
+            lost = asyncio.Event()
+            delivery = asyncio.create_task(self._deliver_shard(day, shard, shards))
+            keeper = asyncio.create_task(self._keep_lease(day, shard, delivery, lost))
+            try:
+                await delivery
+            except asyncio.CancelledError:
+                if not lost.is_set():
+                    raise
+                continue
+            finally:
+                keeper.cancel()
+
+            await asyncio.to_thread(
+                self.queue.complete, day, shard, self.worker_id, self._get_progress()
+            )
+            delivered += 1
+
+    async def run_forever(self, poll_seconds: float = 5):
+        """Delivers today's shards as soon as they are published
+
+        Args:
+            poll_seconds (float, optional): queue polling period. Defaults to 5.
+        """
+        while True:
+            try:
+                # subscribers are managed by the bot process
+                await asyncio.to_thread(SETTINGS_MANAGER.reload)
+                await self.deliver(DATE_TIME_INFO.get_day_name())
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:  # pylint: disable=W0718
+                LOGGER.log(f"Broadcast worker failed: {e}", "Error")
+            await asyncio.sleep(poll_seconds)
@@ -0,0 +1,348 @@
+"""Contains BudgetManager that tracks image generation quotas"""
+
+import asyncio
+import json
+import math
+import os
+import sqlite3
+
+from database import Database
+from date import DATE_TIME_INFO
+from logger import LOGGER
+from settings import SETTINGS_MANAGER
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    provider TEXT PRIMARY KEY,
+    hour_key TEXT NOT NULL,
+    day_key TEXT NOT NULL,
+    hour_requests INTEGER NOT NULL DEFAULT 0,
+    hour_failures INTEGER NOT NULL DEFAULT 0,
+    day_requests INTEGER NOT NULL DEFAULT 0,
+    day_failures INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class BudgetCounter:
+    """Requests and failures of a single provider in the current hour and day"""
+
+    def __init__(
+        self,
+        hour_key: str = "",
+        day_key: str = "",
+        hour_requests: int = 0,
+        hour_failures: int = 0,
+        day_requests: int = 0,
+        day_failures: int = 0,
+    ) -> None:
+        self.hour_key = hour_key
+        self.day_key = day_key
+        self.hour_requests = hour_requests
+        self.hour_failures = hour_failures
+        self.day_requests = day_requests
+        self.day_failures = day_failures
+
+    def roll(self, hour_key: str, day_key: str):
+        """Resets the counters whose window has passed
+
+        Args:
+            hour_key (str): current hour window key
+            day_key (str): current day window key
+        """
+        if self.hour_key != hour_key:
+            self.hour_key = hour_key
+            self.hour_requests = 0
+            self.hour_failures = 0
+        if self.day_key != day_key:
+            self.day_key = day_key
+            self.day_requests = 0
+            self.day_failures = 0
+
+
+class BudgetManager:
+    """Tracks requests and failures per provider per hour and day.
+    Limits are taken from image_generator.budgets settings, 0 means unlimited.
+    A provider with "paced": true may spend in an hour only its share of
+    the daily budget left, so generation is spread across the day.
+    Counters are kept in a SQLite file and changed by increments in
+    transactions, so restarts do not reset the spent budget, and the bot and
+    scrap worker processes spending at the same time are all counted"""
+
+    @staticmethod
+    def _get_window_keys() -> tuple[str, str]:
+        now = DATE_TIME_INFO.get_datetime_now()
+        return now.strftime("%Y-%m-%d %H"), now.strftime("%Y-%m-%d")
+
+    @staticmethod
+    def _get_seconds_to_next_hour() -> float:
+        now = DATE_TIME_INFO.get_datetime_now()
+        return 3600 - (now.minute * 60 + now.second + now.microsecond / 1e6)
+
+    def _import_json(self, json_path: str):
+        # counters of the versions that kept them in budget.json
+        if not os.path.isfile(json_path):
+            return
+        try:
+            with open(json_path, encoding="utf8") as json_file:
+                counters: dict = json.load(json_file)
+            with self.database.transaction() as connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO counters VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            provider,
+                            counter["hour_key"],
+                            counter["day_key"],
+                            counter["hour_requests"],
+                            counter["hour_failures"],
+                            counter["day_requests"],
+                            counter["day_failures"],
+                        )
+                        for provider, counter in counters.items()
+                    ],
+                )
+            os.replace(json_path, f"{json_path}.imported")
+        except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+            LOGGER.log(f"Failed to import budget counters: {e}", "Error")
+
+    def _get_counter(
+        self, connection: sqlite3.Connection, provider: str
+    ) -> BudgetCounter:
+        hour_key, day_key = BudgetManager._get_window_keys()
+        connection.execute(
+            "INSERT OR IGNORE INTO counters (provider, hour_key, day_key) "
+            "VALUES (?, ?, ?)",
+            (provider, hour_key, day_key),
+        )
+        row = connection.execute(
+            "SELECT hour_key, day_key, hour_requests, hour_failures, "
+            "day_requests, day_failures FROM counters WHERE provider = ?",
+            (provider,),
+        ).fetchone()
+        counter = BudgetCounter(*row)
+        counter.roll(hour_key, day_key)
+        if (counter.hour_key, counter.day_key) != (row[0], row[1]):
+            connection.execute(
+                "UPDATE counters SET hour_key = ?, day_key = ?, "
+                "hour_requests = ?, hour_failures = ?, "
+                "day_requests = ?, day_failures = ? WHERE provider = ?",
+                (
+                    counter.hour_key,
+                    counter.day_key,
+                    counter.hour_requests,
+                    counter.hour_failures,
+                    counter.day_requests,
+                    counter.day_failures,
+                    provider,
+                ),
+            )
+        return counter
+
+    def _add(self, provider: str, column: str, amount: int):
+        with self.database.transaction() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._get_counter(connection, provider)
+            connection.execute(
+                f"UPDATE counters SET hour_{column} = hour_{column} + ?, "
+                f"day_{column} = day_{column} + ? WHERE provider = ?",
+                (amount, amount, provider),
+            )
+
+    def _get_limits(self, provider: str) -> tuple[int, int, bool]:
+        limits: dict = SETTINGS_MANAGER.image_generator.budgets.get(provider, {})
+        return (
+            limits.get("hourly", 0),
+            limits.get("daily", 0),
+            limits.get("paced", False),
+        )
+
+    @staticmethod
+    def _get_paced_hour_left(counter: BudgetCounter, daily_limit: int) -> float:
+        # the budget left at the start of the hour is shared by the hours left
+        hours_left = 24 - DATE_TIME_INFO.get_datetime_now().hour
+        hour_start_left = daily_limit - (counter.day_requests - counter.hour_requests)
+        return math.ceil(max(0, hour_start_left) / hours_left) - counter.hour_requests
+
+    def _get_available(
+        self, counter: BudgetCounter, provider: str
+    ) -> tuple[float, float]:
+        hourly_limit, daily_limit, paced = self._get_limits(provider)
+        hour_left = (
+            hourly_limit - counter.hour_requests if hourly_limit > 0 else float("inf")
+        )
+        day_left = (
+            daily_limit - counter.day_requests if daily_limit > 0 else float("inf")
+        )
+        if paced and daily_limit > 0:
+            hour_left = min(
+                hour_left, BudgetManager._get_paced_hour_left(counter, daily_limit)
+            )
+        return max(0, hour_left), max(0, day_left)
+
+    def __init__(
+        self,
+        path: str = os.path.join(".", "storage", "budget.db"),
+        json_path: str = os.path.join(".", "storage", "budget.json"),
+    ) -> None:
+        self.database = Database(path, schema=SCHEMA)
+        self._import_json(json_path)
+
+    def _read_counter(self, provider: str) -> tuple[BudgetCounter, float, float]:
+        with self.database.transaction() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            counter = self._get_counter(connection, provider)
+        return counter, *self._get_available(counter, provider)
+
+    def try_spend(self, provider: str) -> bool:
+        """Spends one request of the provider budget if it is available
+
+        Args:
+            provider (str): provider name
+
+        Returns:
+            bool: True if the request may be made, otherwise False
+        """
+        with self.database.transaction() as connection:
+            # the check and the increment are one write transaction,
+            # so processes spending at the same time can not overspend
+            connection.execute("BEGIN IMMEDIATE")
+            counter = self._get_counter(connection, provider)
+            if min(self._get_available(counter, provider)) < 1:
+                return False
+            connection.execute(
+                "UPDATE counters SET hour_requests = hour_requests + 1, "
+                "day_requests = day_requests + 1 WHERE provider = ?",
+                (provider,),
+            )
+            return True
+
+    async def try_spend_async(self, provider: str) -> bool:
+        """Spends one request of the provider budget if it is available,
+        the counters are saved without blocking the event loop
+
+        Args:
+            provider (str): provider name
+
+        Returns:
+            bool: True if the request may be made, otherwise False
+        """
+        return await asyncio.to_thread(self.try_spend, provider)
+
+    def record_failure(self, provider: str, amount: int = 1):
+        """Records failed requests
+
+        Args:
+            provider (str): provider name
+            amount (int, optional): failed requests number. Defaults to 1.
+        """
+        self._add(provider, "failures", amount)
+
+    async def record_failure_async(self, provider: str, amount: int = 1):
+        """Records failed requests without blocking the event loop
+
+        Args:
+            provider (str): provider name
+            amount (int, optional): failed requests number. Defaults to 1.
+        """
+        await asyncio.to_thread(self.record_failure, provider, amount)
+
+    async def wait_for_budget(self, provider: str, max_wait_seconds: float) -> bool:
+        """Defers the work until the hourly (or the paced) budget is renewed.
+        Refuses right away if the daily budget is exhausted
+
+        Args:
+            provider (str): provider name
+            max_wait_seconds (float): maximal time to wait
+
+        Returns:
+            bool: True if there is budget now, otherwise False
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait_seconds
+
+        while True:
+            _, hour_left, day_left = await asyncio.to_thread(
+                self._read_counter, provider
+            )
+            if day_left <= 0:
+                return False
+            if hour_left > 0:
+                return True
+
+            wait_seconds = BudgetManager._get_seconds_to_next_hour() + 1
+            if loop.time() + wait_seconds > deadline:
+                return False
+            LOGGER.log(
+                f"{provider} budget of the hour is exhausted, "
+                f"waiting {wait_seconds:.0f}s"
+            )
+            await asyncio.sleep(wait_seconds)
+
+    def is_limited(self, provider: str) -> bool:
+        """Checks that the provider has an hourly or a daily budget
+
+        Args:
+            provider (str): provider name
+
+        Returns:
+            bool: True if any limit is set, otherwise False
+        """
+        hourly_limit, daily_limit, _ = self._get_limits(provider)
+        return hourly_limit > 0 or daily_limit > 0
+
+    def get_remaining(self, provider: str) -> dict:
+        """Returns the remaining and spent budget of the provider
+
+        Args:
+            provider (str): provider name
+
+        Returns:
+            dict: remaining requests and failures in the current hour and day
+        """
+        counter, hour_left, day_left = self._read_counter(provider)
+        return {
+            "hour_left": hour_left,
+            "day_left": day_left,
+            "hour_requests": counter.hour_requests,
+            "hour_failures": counter.hour_failures,
+            "day_requests": counter.day_requests,
+            "day_failures": counter.day_failures,
+        }
+
+    def get_report(self) -> str:
+        """Returns human readable budget of every configured provider
+
+        Returns:
+            str: one block per provider
+        """
+        providers = sorted(
+            set(SETTINGS_MANAGER.image_generator.budgets)
+            | set(
+                provider
+                for (provider,) in self.database.execute(
+                    "SELECT provider FROM counters"
+                )
+            )
+        )
+        lines = []
+        for provider in providers:
+            remaining = self.get_remaining(provider)
+            hour_left, day_left = [
+                "unlimited" if left == float("inf") else int(left)
+                for left in (remaining["hour_left"], remaining["day_left"])
+            ]
+            lines.append(
+                f"{provider}\n"
+                f"hour: {hour_left} left, "
+                f"{remaining['hour_requests']} spent, "
+                f"{remaining['hour_failures']} failed\n"
+                f"day: {day_left} left, "
+                f"{remaining['day_requests']} spent, "
+                f"{remaining['day_failures']} failed"
+            )
+        return "\n\n".join(lines) if lines else "No budgets configured"
+
+
+BUDGET_MANAGER = BudgetManager()
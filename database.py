@@ -0,0 +1,133 @@
+"""Contains Database that keeps bot data in a single SQLite file"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS days (
+    day TEXT PRIMARY KEY,
+    saved_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS holidays (
+    day TEXT NOT NULL REFERENCES days(day) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    image_path TEXT NOT NULL,
+    PRIMARY KEY (day, idx)
+);
+CREATE INDEX IF NOT EXISTS holidays_title ON holidays(title);
+CREATE TABLE IF NOT EXISTS images (
+    blob_name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_last_used ON images(last_used);
+CREATE TABLE IF NOT EXISTS subscribers (
+    tg_id INTEGER PRIMARY KEY,
+    tg_alias TEXT NOT NULL,
+    subscribe_date TEXT NOT NULL,
+    timezone TEXT,
+    preferred_hour INTEGER
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    day TEXT NOT NULL,
+    tg_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    file_id TEXT NOT NULL DEFAULT '',
+    delivered_at REAL NOT NULL,
+    PRIMARY KEY (day, tg_id, title)
+);
+CREATE INDEX IF NOT EXISTS deliveries_tg_id ON deliveries(tg_id, day);
+"""
+
+# columns added to existing tables, (table, column, type)
+MIGRATIONS = (
+    ("subscribers", "timezone", "TEXT"),
+    ("subscribers", "preferred_hour", "INTEGER"),
+)
+
+
+class Database:
+    """SQLite database in WAL mode shared by Storage, Gallery and SettingsManager.
+    The connection is opened on the first use, so the file is not created
+    unless the database is enabled"""
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            # readers do not block the writer and the other way round
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(self.schema)
+            self._migrate(connection)
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _migrate(self, connection: sqlite3.Connection):
+        for table, column, column_type in self.migrations:
+            columns = [
+                row[1] for row in connection.execute(f"PRAGMA table_info({table})")
+            ]
+            # tables of another schema are left alone
+            if columns and column not in columns:
+                connection.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+                )
+
+    def __init__(
+        self,
+        path: str = os.path.join(".", "storage", "holidays.db"),
+        timeout=30,
+        schema: str = SCHEMA,
+        migrations: Iterable[tuple[str, str, str]] = MIGRATIONS,
+    ) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.schema = schema
+        self.migrations = migrations
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Runs the statements atomically, rolls back on errors
+
+        Yields:
+            sqlite3.Connection: connection to execute with
+        """
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                yield connection
+
+    def execute(self, sql: str, parameters: Iterable = ()) -> list[tuple]:
+        """Executes single statement in its own transaction
+
+        Args:
+            sql (str): statement
+            parameters (Iterable, optional): statement parameters. Defaults to ().
+
+        Returns:
+            list[tuple]: fetched rows
+        """
+        with self.transaction() as connection:
+            return connection.execute(sql, tuple(parameters)).fetchall()
+
+    def close(self):
+        """Closes the connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+DATABASE = Database()
@@ -1,5 +1,5 @@
 """Contains date and time management class"""
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 
 
@@ -26,5 +26,27 @@ class DateTimeInfo:
         """
         return datetime.now(tz=self.tz).strftime(format_string)
 
+    def get_datetime_after_days(self, days: int) -> datetime:
+        """Returns datetime.now() with timezone shifted by the days number
+
+        Args:
+            days (int): days to shift by
+
+        Returns:
+            datetime: the shifted datetime
+        """
+        return self.get_datetime_now() + timedelta(days=days)
+
+    def get_day_name(self, days_ahead: int = 0) -> str:
+        """Returns the dd-mm-yy name Storage and Gallery address days by
+
+        Args:
+            days_ahead (int, optional): days after today. Defaults to 0.
+
+        Returns:
+            str: day name
+        """
+        return self.get_datetime_after_days(days_ahead).strftime("%d-%m-%y")
+
 
 DATE_TIME_INFO = DateTimeInfo()
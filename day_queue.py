@@ -0,0 +1,165 @@
+"""Contains DayQueue that passes day bundles from the producer service
+to the delivery service"""
+
+import json
+import os
+import time
+from typing import Optional
+
+from database import Database
+from gallery import GALLERY
+from holiday import Holiday
+from settings import SETTINGS_MANAGER
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS days (
+    day TEXT PRIMARY KEY,
+    holidays TEXT NOT NULL,
+    published_at REAL NOT NULL,
+    consumed_at REAL
+);
+CREATE TABLE IF NOT EXISTS images (
+    day TEXT NOT NULL,
+    blob_name TEXT NOT NULL,
+    content BLOB NOT NULL,
+    PRIMARY KEY (day, blob_name)
+);
+"""
+
+
+class DayQueue:
+    """Durable queue of day bundles kept in a SQLite file.
+    The producer publishes every built day, the delivery service takes
+    the unconsumed ones and acknowledges them once they are stored.
+    A republished day replaces the previous version and is consumed again.
+    Images travel with the bundle, keyed by their gallery blob name, so the
+    services do not have to share the gallery"""
+
+    @staticmethod
+    def _read_images(holidays: list[Holiday]) -> dict[str, bytes]:
+        images: dict[str, bytes] = {}
+        for holiday in holidays:
+            if not holiday.has_image():
+                continue
+            blob_name = os.path.basename(holiday.image_path)
+            if blob_name in images:
+                continue
+            image = GALLERY.read_image(holiday.image_path)
+            if image is not None:
+                images[blob_name] = image
+        return images
+
+    def __init__(
+        self, path: str = os.path.join(".", "storage", "day_queue.db")
+    ) -> None:
+        self.database = Database(path, schema=SCHEMA)
+
+    def publish(self, day: str, holidays: list[Holiday]):
+        """Publishes the day bundle with its images
+
+        Args:
+            day (str): day in dd-mm-yy format
+            holidays (list[Holiday]): the day's holidays
+        """
+        images = DayQueue._read_images(holidays)
+        now = time.time()
+        max_age_seconds = SETTINGS_MANAGER.retention.storage_max_days * 24 * 60 * 60
+        with self.database.transaction() as connection:
+            connection.execute(
+                "DELETE FROM days WHERE consumed_at IS NOT NULL AND published_at < ?",
+                (now - max_age_seconds,),
+            )
+            connection.execute(
+                "DELETE FROM images WHERE day = ? OR day NOT IN (SELECT day FROM days)",
+                (day,),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO days VALUES (?, ?, ?, NULL)",
+                (
+                    day,
+                    json.dumps(
+                        [
+                            (
+                                holiday.title,
+                                os.path.basename(holiday.image_path)
+                                if os.path.basename(holiday.image_path) in images
+                                else "",
+                            )
+                            for holiday in holidays
+                        ]
+                    ),
+                    now,
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO images VALUES (?, ?, ?)",
+                [(day, blob_name, image) for blob_name, image in images.items()],
+            )
+
+    def get_pending(self) -> list[tuple[str, list[tuple[str, str]], float]]:
+        """Returns the published day bundles that are not consumed yet
+
+        Returns:
+            list[tuple[str, list[tuple[str, str]], float]]: (day,
+            [(title, image blob name or "")], publish time), the oldest first
+        """
+        return [
+            (day, [tuple(row) for row in json.loads(holidays)], published_at)
+            for day, holidays, published_at in self.database.execute(
+                "SELECT day, holidays, published_at FROM days "
+                "WHERE consumed_at IS NULL ORDER BY published_at"
+            )
+        ]
+
+    def get_image(self, day: str, blob_name: str) -> Optional[bytes]:
+        """Returns the image published with the day bundle
+
+        Args:
+            day (str): day in dd-mm-yy format
+            blob_name (str): gallery blob name of the image
+
+        Returns:
+            Optional[bytes]: image content, None if it is not in the queue
+        """
+        rows = self.database.execute(
+            "SELECT content FROM images WHERE day = ? AND blob_name = ?",
+            (day, blob_name),
+        )
+        return rows[0][0] if rows else None
+
+    def ack(self, day: str, published_at: float):
+        """Marks the day bundle consumed and drops its images, they are
+        in the delivery service gallery now. A newer version published
+        in the meantime stays pending
+
+        Args:
+            day (str): day in dd-mm-yy format
+            published_at (float): publish time of the consumed version
+        """
+        with self.database.transaction() as connection:
+            acked = connection.execute(
+                "UPDATE days SET consumed_at = ? WHERE day = ? AND published_at = ?",
+                (time.time(), day, published_at),
+            ).rowcount
+            if acked == 1:
+                connection.execute("DELETE FROM images WHERE day = ?", (day,))
+
+    def get_report(self) -> str:
+        """Returns the queued days and their states
+
+        Returns:
+            str: one line per day
+        """
+        rows = self.database.execute(
+            "SELECT day, consumed_at FROM days ORDER BY published_at"
+        )
+        if len(rows) == 0:
+            return "No day bundles published"
+        return "\n".join(
+            f"{day}: {'consumed' if consumed_at is not None else 'pending'}"
+            for day, consumed_at in rows
+        )
+
+
+DAY_QUEUE = DayQueue()
@@ -1,16 +1,36 @@
 """Contains Gallery implementations"""
+import asyncio
 import base64
+import hashlib
+import json
 import os
 import shutil
-import requests
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Union
+import aiofiles
+import aiohttp
 
 
+from database import DATABASE
 from date import DATE_TIME_INFO
 from logger import LOGGER
+from settings import SETTINGS_MANAGER
+
+
+ImageBytes = Union[bytes, memoryview]
 
 
 class Gallery:
-    """Persistent image storage implementation"""
+    """Persistent content-addressed image storage implementation.
+    Images are stored once as blobs named by their sha256 hash, and every day
+    (including the coming ones) has a manifest of the blobs saved for it.
+    Blob sizes and last use times are kept in an index, the images table
+    if the database is enabled, so cleanup evicts unreferenced and then least
+    recently used blobs without scanning the gallery"""
 
     @staticmethod
     def _soft_mkdir(path: str):
@@ -18,58 +38,374 @@ class Gallery:
             os.mkdir(path)
 
     def _generate_today_folder_name(self) -> str:
-        return DATE_TIME_INFO.get_datetime_now_formatted("%d-%m-%y")
+        return DATE_TIME_INFO.get_day_name()
+
+    def _get_manifest_path(self, day: str) -> str:
+        return os.path.join(self.manifests_path, f"{day}.json")
+
+    def _load_manifest(self, day: str) -> dict[str, list[str]]:
+        manifest_path = self._get_manifest_path(day)
+        if not os.path.isfile(manifest_path):
+            return {}
+        try:
+            with open(manifest_path, encoding="utf8") as manifest_file:
+                return json.load(manifest_file)
+        except BaseException as e:  # pylint: disable=W0718
+            LOGGER.log(f"Failed to load gallery manifest {day}: {e}", "Error")
+            return {}
+
+    def _save_manifest(self, day: str, manifest: dict[str, list[str]]):
+        manifest_path = self._get_manifest_path(day)
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def _add_reference(self, blob_name: str, reference: str, day: Optional[str]):
+        day = day or self._generate_today_folder_name()
+        manifest = self._manifests.get(day, None)
+        if manifest is None:
+            manifest = self._load_manifest(day)
+            self._manifests[day] = manifest
+
+        references = manifest.setdefault(blob_name, [])
+        if reference in references:
+            return
+        references.append(reference)
+        self._save_manifest(day, manifest)
 
-    def _create_today_folder(self):
-        Gallery._soft_mkdir(
-            os.path.join(
-                self.path,
-                self._generate_today_folder_name(),
+    @staticmethod
+    def _get_day_age(day: str) -> Optional[int]:
+        try:
+            date = datetime.strptime(day, "%d-%m-%y").date()
+        except ValueError:
+            return None
+        return (DATE_TIME_INFO.get_datetime_now().date() - date).days
+
+    def _replay_index_journal(self):
+        if not os.path.isfile(self.index_journal_path):
+            return
+        with open(self.index_journal_path, encoding="utf8") as journal_file:
+            for line in journal_file:
+                try:
+                    self._index.update(json.loads(line))
+                except ValueError:
+                    # the last line may be cut by a crash
+                    continue
+
+    def _load_index(self):
+        self._dirty_blobs.clear()
+        self._evicted_blobs.clear()
+        if SETTINGS_MANAGER.database.enabled:
+            self._index = {
+                blob_name: {"size": size, "last_used": last_used}
+                for blob_name, size, last_used in DATABASE.execute(
+                    "SELECT blob_name, size, last_used FROM images"
+                )
+            }
+            if len(self._index) > 0:
+                return
+        elif os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path, encoding="utf8") as index_file:
+                    self._index = json.load(index_file)
+                self._replay_index_journal()
+                return
+            except BaseException as e:  # pylint: disable=W0718
+                LOGGER.log(f"Failed to load gallery index: {e}", "Error")
+
+        # the only full scan, needed once when there is no index yet
+        self._index = {}
+        for root, _, filenames in os.walk(self.blobs_path):
+            if root == self.blobs_path:
+                continue
+            for blob_name in filenames:
+                blob_path = os.path.join(root, blob_name)
+                self._index[blob_name] = {
+                    "size": os.path.getsize(blob_path),
+                    "last_used": os.path.getmtime(blob_path),
+                }
+        self._dirty_blobs.update(self._index)
+        self._save_index()
+
+    def _save_index(self):
+        if self._index_detached:
+            return
+        if SETTINGS_MANAGER.database.enabled:
+            # only the changed rows are written
+            with DATABASE.transaction() as connection:
+                connection.executemany(
+                    "DELETE FROM images WHERE blob_name = ?",
+                    [(blob_name,) for blob_name in self._evicted_blobs],
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?)",
+                    [
+                        (blob_name, entry["size"], entry["last_used"])
+                        for blob_name, entry in self._index.items()
+                        if blob_name in self._dirty_blobs
+                    ],
+                )
+        else:
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as index_file:
+                json.dump(self._index, index_file)
+            os.replace(tmp_path, self.index_path)
+            # the journal is contained in the rewritten index
+            if os.path.isfile(self.index_journal_path):
+                os.remove(self.index_journal_path)
+
+        self._dirty_blobs.clear()
+        self._evicted_blobs.clear()
+        self._index_saved_at = time.monotonic()
+
+    def _save_index_entry(self, blob_name: str):
+        if self._index_detached:
+            self._dirty_blobs.add(blob_name)
+            return
+        entry = self._index[blob_name]
+        if SETTINGS_MANAGER.database.enabled:
+            DATABASE.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?)",
+                (blob_name, entry["size"], entry["last_used"]),
             )
-        )
+        else:
+            with open(self.index_journal_path, "a", encoding="utf8") as journal_file:
+                journal_file.write(json.dumps({blob_name: entry}) + "\n")
+        self._dirty_blobs.discard(blob_name)
+
+    def _touch_blob(self, blob_name: str, size: Optional[int] = None):
+        entry = self._index.get(blob_name, None)
+        if entry is None:
+            if size is None:
+                return
+            entry = {"size": size, "last_used": time.time()}
+            self._index[blob_name] = entry
+            # new blobs are saved at once, so none of them is leaked by a crash
+            self._save_index_entry(blob_name)
+            return
+        entry["last_used"] = time.time()
+        self._dirty_blobs.add(blob_name)
+
+        if time.monotonic() - self._index_saved_at > self._index_save_period_seconds:
+            self._save_index()
+
+    def _generate_blob_name(self, digest: str, extension: Optional[str]) -> str:
+        return f"{digest}.{extension or self.extension}"
+
+    def _generate_blob_path(self, blob_name: str) -> str:
+        # fan out by the hash prefix to keep directories small
+        return os.path.join(self.blobs_path, blob_name[:2], blob_name)
+
+    def _commit_blob(
+        self,
+        tmp_path: str,
+        digest: str,
+        extension: Optional[str],
+        reference: str,
+        day: Optional[str] = None,
+    ) -> str:
+        blob_name = self._generate_blob_name(digest, extension)
+        blob_path = self._generate_blob_path(blob_name)
+
+        # clean must not see a stored blob before its reference
+        with self._lock:
+            if os.path.isfile(blob_path):
+                # the same image is already stored
+                os.remove(tmp_path)
+            else:
+                Gallery._soft_mkdir(os.path.dirname(blob_path))
+                os.replace(tmp_path, blob_path)
+
+            self._add_reference(blob_name, reference, day)
+            self._touch_blob(blob_name, os.path.getsize(blob_path))
+        return blob_path
+
+    def _generate_tmp_path(self) -> str:
+        return os.path.join(self.blobs_path, f"{uuid.uuid4().hex}.tmp")
+
+    async def _save_image(
+        self, image_idx: int, image_url: str, session: aiohttp.ClientSession
+    ) -> str:
+        if not image_url:
+            return ""
 
-    def _generate_image_filename(self, image_idx: int) -> str:
-        return f"{image_idx}.{self.extension}"
+        tmp_path = self._generate_tmp_path()
+        image_hash = hashlib.sha256()
+        try:
+            async with session.get(
+                image_url, timeout=aiohttp.ClientTimeout(total=self.download_timeout)
+            ) as response:
+                if not response.ok:
+                    return ""
+                # stream the body straight to disk instead of buffering it
+                async with aiofiles.open(tmp_path, "wb") as image_file:
+                    async for chunk in response.content.iter_chunked(
+                        self.download_chunk_size
+                    ):
+                        image_hash.update(chunk)
+                        await image_file.write(chunk)
+        except asyncio.CancelledError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        except BaseException:  # pylint: disable=W0718
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return ""
 
-    def _generate_image_path(self, image_idx: int) -> str:
-        return os.path.join(
-            self.path,
-            self._generate_today_folder_name(),
-            self._generate_image_filename(image_idx),
+        # the rename, the manifest and the index are written off the event loop
+        return await self._run_io(
+            self._commit_blob,
+            tmp_path,
+            image_hash.hexdigest(),
+            None,
+            f"{image_idx}.{self.extension}",
         )
 
-    def _save_image(self, image_idx: int, image_url: str) -> str:
-        image_path = self._generate_image_path(image_idx)
+    def _save_image_bytes(
+        self,
+        image_idx: int,
+        image: ImageBytes,
+        extension: Optional[str] = None,
+        day: Optional[str] = None,
+    ) -> str:
+        if len(image) == 0:
+            return ""
 
+        tmp_path = self._generate_tmp_path()
         try:
-            response = requests.get(image_url, timeout=10)
-            with open(image_path, "wb") as image_file:
-                image_file.write(response.content)
-        except BaseException:  # pylint: disable=W0718
+            with open(tmp_path, "wb") as image_file:
+                image_file.write(image)
+            return self._commit_blob(
+                tmp_path,
+                hashlib.sha256(image).hexdigest(),
+                extension,
+                f"{image_idx}.{extension or self.extension}",
+                day,
+            )
+        except BaseException as e:  # pylint: disable=W0718
+            LOGGER.log(f"Failed to save image {image_idx}: {e}", "Error")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             return ""
 
-        return image_path
+    def _commit_image(
+        self,
+        tmp_path: str,
+        image: ImageBytes,
+        extension: Optional[str],
+        image_idx: int,
+        day: Optional[str],
+    ) -> str:
+        return self._commit_blob(
+            tmp_path,
+            hashlib.sha256(image).hexdigest(),
+            extension,
+            f"{image_idx}.{extension or self.extension}",
+            day,
+        )
+
+    async def _run_io(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._io_executor, function, *args
+        )
 
-    def _save_image_b64(self, image_idx: int, image_b64_hash: bytes) -> str:
-        image_path = self._generate_image_path(image_idx)
+    async def _save_image_bytes_async(
+        self,
+        image_idx: int,
+        image: ImageBytes,
+        extension: Optional[str] = None,
+        day: Optional[str] = None,
+    ) -> str:
+        if len(image) == 0:
+            return ""
 
+        tmp_path = self._generate_tmp_path()
+        try:
+            async with aiofiles.open(tmp_path, "wb") as image_file:
+                await image_file.write(image)
+            # hashing and the atomic rename run off the event loop as well
+            return await self._run_io(
+                self._commit_image, tmp_path, image, extension, image_idx, day
+            )
+        except asyncio.CancelledError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        except BaseException as e:  # pylint: disable=W0718
+            LOGGER.log(f"Failed to save image {image_idx}: {e}", "Error")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return ""
+
+    async def _save_image_b64_async(
+        self, image_idx: int, image_b64_hash: Union[bytes, str]
+    ) -> str:
         if len(image_b64_hash) == 0:
             return ""
 
         try:
-            with open(image_path, "wb") as image_file:
-                image_file.write(base64.b64decode(image_b64_hash))
+            image = await self._run_io(base64.b64decode, image_b64_hash)
         except BaseException as e:  # pylint: disable=W0718
-            print(e)
+            LOGGER.log(f"Failed to decode image {image_idx}: {e}", "Error")
             return ""
 
-        return image_path
+        return await self._save_image_bytes_async(image_idx, image)
+
+    async def _save_batch_async(self, save, items: list, start_idx: int) -> list[str]:
+        semaphore = asyncio.Semaphore(self._write_concurrency)
+
+        async def save_one(idx: int, item) -> tuple[int, str]:
+            async with semaphore:
+                return idx, await save(idx + start_idx, item)
+
+        image_paths = [""] * len(items)
+        for future in LOGGER.get_tqdm(
+            asyncio.as_completed([save_one(i, item) for i, item in enumerate(items)]),
+            total=len(items),
+            desc="Saving images",
+        ):
+            idx, image_path = await future
+            image_paths[idx] = image_path
+
+        return image_paths
 
     def __init__(self, folder: str = "gallery", extension: str = "png") -> None:
         self.folder = folder
         self.extension = extension
         self.path = os.path.join(".", self.folder)
+        self.blobs_path = os.path.join(self.path, "blobs")
+        self.manifests_path = os.path.join(self.path, "manifests")
         Gallery._soft_mkdir(self.path)
+        Gallery._soft_mkdir(self.blobs_path)
+        Gallery._soft_mkdir(self.manifests_path)
+
+        self.index_path = os.path.join(self.path, "index.json")
+        self.index_journal_path = os.path.join(self.path, "index.journal")
+
+        self._lock = threading.Lock()
+        # day -> manifest of the days saved to since the last clean
+        self._manifests: dict[str, dict[str, list[str]]] = {}
+
+        # blob name -> {"size": bytes, "last_used": unix time}
+        self._index: dict[str, dict] = {}
+        # blobs touched and evicted since the last index save
+        self._dirty_blobs: set[str] = set()
+        self._evicted_blobs: set[str] = set()
+        self._index_saved_at = 0.0
+        self._index_save_period_seconds = 60
+        # a detached index is saved by another process
+        self._index_detached = False
+        self._load_index()
+
+        self.download_timeout = 30
+        self.download_chunk_size = 64 * 1024
+        self._download_concurrency = 5
+        self._write_concurrency = 4
+        self._io_executor = ThreadPoolExecutor(
+            max_workers=self._write_concurrency, thread_name_prefix="gallery-io"
+        )
 
     def is_image_exist(self, path: str) -> bool:
         """Checks existence of the image
@@ -83,43 +419,186 @@ class Gallery:
 
         return os.path.exists(path) and os.path.isfile(path)
 
-    def save_images(self, urls: list[str], start_idx: int = 0) -> list[str]:
-        """Saves images to the disk
+    async def save_image(
+        self, image_idx: int, image_url: str, session: aiohttp.ClientSession
+    ) -> str:
+        """Downloads single image to the disk
+
+        Args:
+            image_idx (int): index of the image
+            image_url (str): image url
+            session (aiohttp.ClientSession): session to download with
+
+        Returns:
+            str: path of saved image, empty if the image was not saved
+        """
+        return await self._save_image(image_idx, image_url, session)
+
+    async def save_images(
+        self,
+        urls: list[str],
+        start_idx: int = 0,
+        session: Optional[aiohttp.ClientSession] = None,
+    ) -> list[str]:
+        """Downloads images to the disk concurrently
 
         Args:
             urls (list[str]): list of images urls
             start_idx (int): index of the first image. Defaults to 0
+            session (Optional[aiohttp.ClientSession]): session to download with.
+            If not set, a temporary one is used. Defaults to None
 
         Returns:
             list[str]: paths of saved images
         """
-        self._create_today_folder()
-        image_paths = []
-        for i, image_url in LOGGER.get_tqdm(
-            enumerate(urls), total=len(urls), desc="Saving images"
+
+        if session is None:
+            async with aiohttp.ClientSession() as own_session:
+                return await self.save_images(urls, start_idx, own_session)
+
+        semaphore = asyncio.Semaphore(self._download_concurrency)
+
+        async def save(idx: int, image_url: str) -> tuple[int, str]:
+            async with semaphore:
+                return idx, await self._save_image(idx + start_idx, image_url, session)
+
+        image_paths = [""] * len(urls)
+        for future in LOGGER.get_tqdm(
+            asyncio.as_completed([save(i, url) for i, url in enumerate(urls)]),
+            total=len(urls),
+            desc="Saving images",
         ):
-            image_paths.append(self._save_image(i + start_idx, image_url))
+            idx, image_path = await future
+            image_paths[idx] = image_path
 
         return image_paths
 
-    def save_images_b64(self, b64_hashes: list[bytes], start_idx: int = 0) -> list[str]:
-        """Saves images to the disk
+    def save_image_bytes(
+        self,
+        image_idx: int,
+        image: ImageBytes,
+        extension: Optional[str] = None,
+        day: Optional[str] = None,
+    ) -> str:
+        """Saves single raw image to the disk
+
+        Args:
+            image_idx (int): index of the image
+            image (ImageBytes): raw image bytes or memoryview over them
+            extension (Optional[str]): image file extension, e.g. jpg for
+            transcoded images. If not set, the gallery extension is used.
+            Defaults to None
+            day (Optional[str]): dd-mm-yy day whose manifest references
+            the image. If not set, today is used. Defaults to None
+
+        Returns:
+            str: path of saved image, empty if the image was not saved
+        """
+        return self._save_image_bytes(image_idx, image, extension, day)
+
+    def save_original_image_bytes(
+        self, image_idx: int, image: ImageBytes, day: Optional[str] = None
+    ) -> str:
+        """Saves the untranscoded image referenced as <idx>.orig.png
+
+        Args:
+            image_idx (int): index of the image
+            image (ImageBytes): raw image bytes as generated
+            day (Optional[str]): dd-mm-yy day, today if not set. Defaults to None
+
+        Returns:
+            str: path of saved image, empty if the image was not saved
+        """
+        return self._save_image_bytes(image_idx, image, f"orig.{self.extension}", day)
+
+    async def save_image_bytes_async(
+        self,
+        image_idx: int,
+        image: ImageBytes,
+        extension: Optional[str] = None,
+        day: Optional[str] = None,
+    ) -> str:
+        """Saves single raw image to the disk without blocking the event loop
+
+        Args:
+            image_idx (int): index of the image
+            image (ImageBytes): raw image bytes or memoryview over them
+            extension (Optional[str]): image file extension. If not set,
+            the gallery extension is used. Defaults to None
+            day (Optional[str]): dd-mm-yy day, today if not set. Defaults to None
+
+        Returns:
+            str: path of saved image, empty if the image was not saved
+        """
+        return await self._save_image_bytes_async(image_idx, image, extension, day)
+
+    async def save_original_image_bytes_async(
+        self, image_idx: int, image: ImageBytes, day: Optional[str] = None
+    ) -> str:
+        """Saves the untranscoded image without blocking the event loop
+
+        Args:
+            image_idx (int): index of the image
+            image (ImageBytes): raw image bytes as generated
+            day (Optional[str]): dd-mm-yy day, today if not set. Defaults to None
+
+        Returns:
+            str: path of saved image, empty if the image was not saved
+        """
+        return await self._save_image_bytes_async(
+            image_idx, image, f"orig.{self.extension}", day
+        )
+
+    async def save_images_bytes_async(
+        self, images: list[ImageBytes], start_idx: int = 0
+    ) -> list[str]:
+        """Saves raw images to the disk in parallel batches
 
         Args:
-            b64_hashes (list[str]): list of images base64 hashes
+            images (list[ImageBytes]): list of raw images
             start_idx (int): index of the first image. Defaults to 0
 
         Returns:
             list[str]: paths of saved images
         """
-        self._create_today_folder()
-        image_paths = []
-        for i, image_b64_hash in LOGGER.get_tqdm(
-            enumerate(b64_hashes), total=len(b64_hashes), desc="Saving images"
-        ):
-            image_paths.append(self._save_image_b64(i + start_idx, image_b64_hash))
+        return await self._save_batch_async(
+            self._save_image_bytes_async, images, start_idx
+        )
 
-        return image_paths
+    async def save_images_b64_async(
+        self, b64_hashes: list[Union[bytes, str]], start_idx: int = 0
+    ) -> list[str]:
+        """Saves base64 images to the disk in parallel batches
+
+        Args:
+            b64_hashes (list[Union[bytes, str]]): list of images base64 hashes
+            start_idx (int): index of the first image. Defaults to 0
+
+        Returns:
+            list[str]: paths of saved images
+        """
+        return await self._save_batch_async(
+            self._save_image_b64_async, b64_hashes, start_idx
+        )
+
+    async def read_image_async(self, image_path: str) -> Optional[bytes]:
+        """Reads image from disk without blocking the event loop
+
+        Args:
+            image_path (str): path to image
+
+        Returns:
+            Image if it exists, otherwise None
+        """
+        try:
+            async with aiofiles.open(image_path, "rb") as image_file:
+                image = await image_file.read()
+        except FileNotFoundError:
+            return None
+
+        await self._run_io(self.touch_image, image_path)
+
+        return image
 
     def read_image(self, image_path: str):
         """Reads images from disk
@@ -137,35 +616,211 @@ class Gallery:
         with open(image_path, "rb") as image_file:
             image = image_file.read()
 
+        self.touch_image(image_path)
+
         return image
 
-    def read_images(self, image_paths: list[str]):
-        """Reads images from disk
+    def touch_image(self, image_path: str):
+        """Marks the image as recently used, so it is evicted later.
+        Posts and reuses of the image should call it
 
         Args:
+            image_path (str): path to image
+        """
+        with self._lock:
+            self._touch_blob(os.path.basename(image_path))
+
+    def detach_index(self):
+        """Stops saving the index in this process, e.g. in a scrap worker.
+        The changes are taken by take_index_changes and passed to the process
+        that owns the index instead"""
+        with self._lock:
+            self._index_detached = True
+
+    def take_index_changes(self) -> dict[str, dict]:
+        """Returns the index entries added or touched since the last call
+
+        Returns:
+            dict[str, dict]: blob name -> {"size": bytes, "last_used": unix time}
+        """
+        with self._lock:
+            changes = {
+                blob_name: dict(self._index[blob_name])
+                for blob_name in self._dirty_blobs
+                if blob_name in self._index
+            }
+            self._dirty_blobs.clear()
+            return changes
+
+    def merge_index_changes(self, changes: dict[str, dict]):
+        """Applies the index changes of another process, e.g. of a scrap worker.
+        New blobs are saved at once, the latest use time wins
+
+        Args:
+            changes (dict[str, dict]): blob name -> {"size": bytes,
+            "last_used": unix time}
+        """
+        with self._lock:
+            for blob_name, change in changes.items():
+                entry = self._index.get(blob_name, None)
+                if entry is None:
+                    self._index[blob_name] = dict(change)
+                    self._save_index_entry(blob_name)
+                elif change["last_used"] > entry["last_used"]:
+                    entry["last_used"] = change["last_used"]
+                    self._dirty_blobs.add(blob_name)
+
+            saved_ago = time.monotonic() - self._index_saved_at
+            if saved_ago > self._index_save_period_seconds:
+                self._save_index()
+
+    def reload_manifests(self):
+        """Drops the cached manifests, e.g. after a scrap worker saved images"""
+        with self._lock:
+            self._manifests.clear()
+
+    def get_reference_counts(self) -> dict[str, int]:
+        """Counts references to every blob over all the daily manifests
+
+        Returns:
+            dict[str, int]: blob name -> references number
+        """
+        reference_counts: dict[str, int] = {}
+        for filename in os.listdir(self.manifests_path):
+            day, extension = os.path.splitext(filename)
+            if extension != ".json":
+                continue
+            for blob_name, references in self._load_manifest(day).items():
+                reference_counts[blob_name] = reference_counts.get(blob_name, 0) + len(
+                    references
+                )
+        return reference_counts
+
+    def get_usage(self) -> dict:
+        """Returns the gallery disk usage according to the index
 
         Returns:
-            List of images. Not existing images are replaced with None
+            dict: stored blobs number, used and maximal bytes
         """
+        with self._lock:
+            return {
+                "blobs": len(self._index),
+                "used_bytes": sum(entry["size"] for entry in self._index.values()),
+                "max_bytes": SETTINGS_MANAGER.retention.gallery_max_megabytes
+                * 1024
+                * 1024,
+            }
+
+    def get_usage_report(self) -> str:
+        """Returns human readable gallery disk usage
 
-        images = []
+        Returns:
+            str: usage report
+        """
+        usage = self.get_usage()
+        return (
+            f"gallery: {usage['blobs']} images, "
+            f"{usage['used_bytes'] / 1024 / 1024:.1f} of "
+            f"{usage['max_bytes'] / 1024 / 1024:.0f} MB used"
+        )
 
-        for image_path in LOGGER.get_tqdm(image_paths, desc="Reading images"):
-            images.append(self.read_image(image_path))
+    def _evict_blobs(self, manifests: dict[str, dict[str, list[str]]]) -> int:
+        # images of today and of the coming days are still to be posted
+        protected: set[str] = set()
+        for day, manifest in manifests.items():
+            day_age = Gallery._get_day_age(day)
+            if day_age is not None and day_age <= 0:
+                protected.update(manifest)
+        referenced = set(
+            blob_name for manifest in manifests.values() for blob_name in manifest
+        )
+        max_bytes = SETTINGS_MANAGER.retention.gallery_max_megabytes * 1024 * 1024
+        used_bytes = sum(entry["size"] for entry in self._index.values())
 
-        return images
+        # unreferenced blobs go first, then the least recently used ones
+        candidates = sorted(
+            self._index.items(),
+            key=lambda item: (item[0] in referenced, item[1]["last_used"]),
+        )
+
+        freed_bytes = 0
+        evicted: set[str] = set()
+        for blob_name, entry in candidates:
+            if blob_name in protected:
+                continue
+            if blob_name in referenced and used_bytes <= max_bytes:
+                break
+            blob_path = self._generate_blob_path(blob_name)
+            if os.path.isfile(blob_path):
+                os.remove(blob_path)
+            used_bytes -= entry["size"]
+            freed_bytes += entry["size"]
+            evicted.add(blob_name)
+
+        for blob_name in evicted:
+            del self._index[blob_name]
+            self._dirty_blobs.discard(blob_name)
+        self._evicted_blobs.update(evicted)
+
+        # evicted images are not referenced by the manifests any more
+        for day, manifest in manifests.items():
+            if not evicted.intersection(manifest):
+                continue
+            for blob_name in evicted.intersection(manifest):
+                del manifest[blob_name]
+            if len(manifest) == 0:
+                os.remove(self._get_manifest_path(day))
+            else:
+                self._save_manifest(day, manifest)
 
-    def clean(self):
-        """Cleans all te data except today's ones"""
+        return freed_bytes
 
-        today_folder_name = self._generate_today_folder_name()
+    def clean(self) -> int:
+        """Applies the retention policy. Drops the manifests older than
+        retention.storage_max_days, deletes unreferenced blobs and evicts least
+        recently used ones until the gallery fits retention.gallery_max_megabytes.
+        Images of today's and the coming days' manifests are never evicted
 
+        Returns:
+            int: freed bytes
+        """
+        storage_max_days = SETTINGS_MANAGER.retention.storage_max_days
+
+        with self._lock:
+            manifests: dict[str, dict[str, list[str]]] = {}
+            for filename in os.listdir(self.manifests_path):
+                day, extension = os.path.splitext(filename)
+                if extension != ".json":
+                    continue
+                day_age = Gallery._get_day_age(day)
+                if day_age is not None and day_age > storage_max_days:
+                    os.remove(os.path.join(self.manifests_path, filename))
+                    continue
+                manifests[day] = self._load_manifest(day)
+
+            freed_bytes = self._evict_blobs(manifests)
+            self._manifests.clear()
+            self._save_index()
+
+            for filename in os.listdir(self.blobs_path):
+                tmp_path = os.path.join(self.blobs_path, filename)
+                # interrupted writes leave temporary files behind
+                if os.path.isfile(tmp_path) and (
+                    time.time() - os.path.getmtime(tmp_path) > 3600
+                ):
+                    os.remove(tmp_path)
+
+        # images saved before the blob store are kept in per day folders
         for filename in os.listdir(self.path):
-            if filename == today_folder_name:
+            day_age = Gallery._get_day_age(filename)
+            if day_age is None or day_age <= storage_max_days:
                 continue
             path_to_folder = os.path.join(self.path, filename)
             if os.path.isdir(path_to_folder):
                 shutil.rmtree(path_to_folder)
 
+        LOGGER.log(f"Gallery clean freed {freed_bytes} bytes")
+        return freed_bytes
+
 
 GALLERY = Gallery()
@@ -1,6 +1,7 @@
 """Contains Holiday class"""
 
 import random
+from typing import Optional
 
 from gallery import GALLERY
 
@@ -9,7 +10,10 @@ EMOJI_LIST = ["💝", "💛", "💯", "🎁", "🎈", "🎉", "🎊", "💐", "
 
 
 class Holiday:
-    """Holiday class instance"""
+    """Compact holiday record. The image is not held in memory,
+    its content is read from the gallery only when it is actually needed"""
+
+    __slots__ = ("title", "image_path", "emoji_title")
 
     def _construct_emoji_title(self):
         self.emoji_title = (
@@ -20,9 +24,25 @@ class Holiday:
     def __init__(self, title: str, image_path: str) -> None:
         self.title = title
         self.image_path = image_path
-        self.image = GALLERY.read_image(self.image_path)
         self._construct_emoji_title()
 
+    @property
+    def image(self) -> Optional[bytes]:
+        """Image content read from the disk on every access
+
+        Returns:
+            Optional[bytes]: image if it exists, otherwise None
+        """
+        return GALLERY.read_image(self.image_path)
+
+    def has_image(self) -> bool:
+        """Checks existence of the image without reading it
+
+        Returns:
+            bool: True if exists, otherwise False
+        """
+        return bool(self.image_path) and GALLERY.is_image_exist(self.image_path)
+
     def as_tuple(self) -> tuple[str, str]:
         """Represents the Holiday class instance as tuple (str, str)
 
@@ -1,12 +1,15 @@
+import asyncio
+import base64
 import json
 import random
-import time
 from typing import Optional
 import aiohttp
-import asyncio
 from deep_translator import GoogleTranslator
+from budget import BUDGET_MANAGER
 from logger import LOGGER
 
+from image_generator_model_based import ModelBasedImageGeneratorInterface
+from rate_limiter import get_provider_rate_limiter
 from settings import SETTINGS_MANAGER
 
 
@@ -36,28 +39,51 @@ class AsyncB64BasedImageGeneratorInterface:
         raise NotImplementedError
 
 
-class FusionBrainImageGenerator(AsyncB64BasedImageGeneratorInterface):
-    """Asynchronous image generator based on Fusion Brain"""
+class FusionBrainImageGenerator(
+    AsyncB64BasedImageGeneratorInterface, ModelBasedImageGeneratorInterface
+):
+    """Asynchronous image generator based on Fusion Brain.
+    Jobs are submitted as fast as the rate budget allows, and all the outstanding
+    jobs are polled concurrently through one shared session"""
 
-    async def _check_generation_status(self, result_uuid: str) -> Optional[dict]:
-        max_attempts: int = 9
-        sleep_period_seconds: float = 10
+    budget_name = "FUSIONBRAIN"
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
 
+    async def _check_generation_status(self, result_uuid: str) -> Optional[dict]:
         status_url = (
             f"https://api.fusionbrain.ai/web/api/v1/text2image/status/{result_uuid}"
         )
 
-        async with aiohttp.ClientSession() as session:
-            for _ in range(max_attempts):
-                try:
-                    async with session.get(status_url) as response:
-                        response_json = await response.json()
-                        if response_json["status"] == "DONE":
-                            return response_json
-                    await asyncio.sleep(sleep_period_seconds)
-
-                except BaseException:  # pylint: disable=W0718
-                    return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.status_timeout_seconds
+        poll_period_seconds = self.status_poll_initial_seconds
+
+        while loop.time() < deadline:
+            await asyncio.sleep(poll_period_seconds)
+            try:
+                async with self._get_session().get(status_url) as response:
+                    response_json = await response.json()
+                    if response_json["status"] == "DONE":
+                        return response_json
+                    if response_json["status"] == "FAIL":
+                        return None
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:  # pylint: disable=W0718
+                # the job has spent the budget, so a transient error does not end it
+                LOGGER.log(f"Failed to check status of {result_uuid}: {e}", "Warning")
+
+            poll_period_seconds = min(
+                poll_period_seconds * self.status_poll_backoff,
+                self.status_poll_max_seconds,
+            )
 
         return None
 
@@ -81,6 +107,8 @@ class FusionBrainImageGenerator(AsyncB64BasedImageGeneratorInterface):
             str: uuid of result
         """
 
+        await self.rate_limiter.acquire()
+
         try:
             form_data = aiohttp.FormData()
             form_data.add_field(
@@ -90,13 +118,10 @@ class FusionBrainImageGenerator(AsyncB64BasedImageGeneratorInterface):
                 content_type="application/json",
             )
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.url, headers=self.headers, data=form_data
-                ) as response:
-                    if not response.ok:
-                        return ""
-                    start_response_json = await response.json()
+            async with self._get_session().post(self.url, data=form_data) as response:
+                if not response.ok:
+                    return ""
+                start_response_json = await response.json()
 
             result_uuid = start_response_json.get("uuid", None)
             if result_uuid is None:
@@ -104,78 +129,81 @@ class FusionBrainImageGenerator(AsyncB64BasedImageGeneratorInterface):
                 return ""
             return result_uuid
 
+        except asyncio.CancelledError:
+            raise
         except BaseException:  # pylint: disable=W0718
             pass
         return ""
 
-    async def _api_wrapper(self, prompt: str) -> tuple[str, int]:
-        """Wraps request to Fusion Brain api
-
-        Args:
-            prompt (str): image prompt
-
-        Returns:
-            tuple[str, int]: (image_b64, number_of_requests_made)
-        """
-
-        style = self._get_image_style()
-
-        dumped_parameters = json.dumps(
+    def _dump_parameters(self, model_input: str, style: str) -> str:
+        return json.dumps(
             {
                 "type": "GENERATE",
-                "generateParams": {"query": self._prepare_prompt(prompt)},
+                "generateParams": {"query": model_input},
                 "width": self.image_width,
                 "height": self.image_height,
                 "style": style,
             }
         )
 
-        result_uuid = await self._api_request(dumped_parameters)
-        requests_number = 1
+    async def _generate(self, model_input: str, style: str) -> Optional[dict]:
+        if not await BUDGET_MANAGER.try_spend_async(self.budget_name):
+            return None
 
-        if result_uuid is None:
-            return ("", requests_number)
+        result_uuid = await self._api_request(self._dump_parameters(model_input, style))
 
-        result_dict = await self._check_generation_status(result_uuid)
+        if not result_uuid:
+            await BUDGET_MANAGER.record_failure_async(self.budget_name)
+            return None
 
+        result_dict = await self._check_generation_status(result_uuid)
         if result_dict is None:
-            return ("", requests_number)
+            await BUDGET_MANAGER.record_failure_async(self.budget_name)
+        return result_dict
 
-        if result_dict.get("censored", False) is False:
-            return (result_dict["images"][0], requests_number)
+    async def _api_wrapper(self, model_input: str) -> str:
+        """Wraps request to Fusion Brain api
 
-        soft_parameters = json.dumps(
-            {
-                "type": "GENERATE",
-                "generateParams": {
-                    "query": self._prepare_prompt(
-                        SETTINGS_MANAGER.image_generator.soft_prompt
-                    )
-                },
-                "width": self.image_width,
-                "height": self.image_height,
-                "style": style,
-            }
-        )
+        Args:
+            model_input (str): prepared image prompt
 
-        result_uuid = await self._api_request(soft_parameters)
-        requests_number += 1
+        Returns:
+            str: image_b64, empty if generation failed
+        """
 
-        if result_uuid is None:
-            return ("", requests_number)
+        style = self._get_image_style()
 
-        result_dict = await self._check_generation_status(result_uuid)
+        result_dict = await self._generate(model_input, style)
 
         if result_dict is None:
-            return ("", requests_number)
+            return ""
+
+        if result_dict.get("censored", False) is False:
+            return result_dict["images"][0]
+
+        soft_prompt = await asyncio.to_thread(
+            self._prepare_prompt, SETTINGS_MANAGER.image_generator.soft_prompt
+        )
+        result_dict = await self._generate(soft_prompt, style)
+
+        if result_dict is None or result_dict.get("censored", False):
+            return ""
 
-        return (result_dict["images"][0], requests_number)
+        return result_dict["images"][0]
 
     def __init__(self) -> None:
         super().__init__()
 
         self.max_rate_per_minute = 1.5
-        self.request_delay_seconds = (60 / self.max_rate_per_minute) + 1
+        self.rate_limiter = get_provider_rate_limiter(
+            self.budget_name, self.max_rate_per_minute
+        )
+
+        self.status_timeout_seconds = 90
+        self.status_poll_initial_seconds = 2
+        self.status_poll_backoff = 1.5
+        self.status_poll_max_seconds = 15
+        self.timeout = 60
 
         self.image_height = 512
         self.image_width = 512
@@ -188,28 +216,84 @@ class FusionBrainImageGenerator(AsyncB64BasedImageGeneratorInterface):
         }
         self.translator = GoogleTranslator(source="auto", target="en")
 
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def close(self):
+        """Closes the shared http session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def prepare_prompt(self, prompt: str) -> str:
+        """Prepares the holiday title to be used as model input
+
+        Args:
+            prompt (str): holiday title
+
+        Returns:
+            str: translated prompt
+        """
+        return self._prepare_prompt(prompt)
+
+    async def generate_image_b64_hash(self, model_input: str) -> str:
+        """Generates single image from the prepared model input
+
+        Args:
+            model_input (str): prepared (translated) prompt
+
+        Returns:
+            str: image b64 hash, empty if generation failed
+        """
+        return await self._api_wrapper(model_input)
+
+    async def generate_image_bytes(self, model_input: str) -> bytes:
+        """Generates single raw image from the prepared model input
+
+        Args:
+            model_input (str): prepared (translated) prompt
+
+        Returns:
+            bytes: raw image, empty if generation failed
+        """
+        b64_hash = await self._api_wrapper(model_input)
+        if not b64_hash:
+            return bytes([])
+        return base64.b64decode(b64_hash)
+
     async def get_image_b64_hash(self, prompt):
-        return await self._api_request(prompt)
+        model_input = await asyncio.to_thread(self._prepare_prompt, prompt)
+        return await self._api_wrapper(model_input)
 
     async def get_image_b64_hashes(self, prompts) -> list[str]:
-        b64_hashes: list[str] = []
-        total_prompts = len(prompts)
-        for i, prompt in LOGGER.get_tqdm(
-            enumerate(prompts),
+        async def generate(idx: int, prompt: str) -> tuple[int, str]:
+            try:
+                return idx, await self.get_image_b64_hash(prompt)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:  # pylint: disable=W0718
+                return idx, ""
+
+        b64_hashes: list[str] = [""] * len(prompts)
+        tasks = [generate(i, prompt) for i, prompt in enumerate(prompts)]
+
+        for future in LOGGER.get_tqdm(
+            asyncio.as_completed(tasks),
             total=len(prompts),
             desc="Generating images",
         ):
-            start_time = time.time()
-            b64_hash, requests_number = await self._api_wrapper(prompt)
-            b64_hashes.append(b64_hash)
-
-            if i != total_prompts - 1:
-                end_time = time.time()
-
-                delay = requests_number * self.request_delay_seconds - (
-                    end_time - start_time
-                )
-
-                await asyncio.sleep(max(0, delay))
+            idx, b64_hash = await future
+            b64_hashes[idx] = b64_hash
 
         return b64_hashes
+
+    async def get_image_bytes(self, prompt: str) -> bytes:
+        b64_hash = await self.get_image_b64_hash(prompt)
+        if not b64_hash:
+            return bytes([])
+        return base64.b64decode(b64_hash)
+
+    async def get_images_bytes(self, prompts: list[str]) -> list[bytes]:
+        return [
+            base64.b64decode(b64_hash) if b64_hash else bytes([])
+            for b64_hash in await self.get_image_b64_hashes(prompts)
+        ]
@@ -0,0 +1,229 @@
+"""Contains local procedural holiday card renderer"""
+
+import io
+import random
+from typing import Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+from holiday import EMOJI_LIST
+
+
+Color = tuple[int, int, int]
+Palette = tuple[Color, Color, Color, Color]
+
+CYRILLIC_TO_LATIN = str.maketrans(
+    {
+        **dict(zip("абвгдеёзийклмнопрстуфхцыэ", "abvgdeeziyklmnoprstufhcye")),
+        **dict(zip("АБВГДЕЁЗИЙКЛМНОПРСТУФХЦЫЭ", "ABVGDEEZIYKLMNOPRSTUFHCYE")),
+        "ж": "zh",
+        "ч": "ch",
+        "ш": "sh",
+        "щ": "sch",
+        "ю": "yu",
+        "я": "ya",
+        "ъ": "",
+        "ь": "",
+        "Ж": "Zh",
+        "Ч": "Ch",
+        "Ш": "Sh",
+        "Щ": "Sch",
+        "Ю": "Yu",
+        "Я": "Ya",
+        "Ъ": "",
+        "Ь": "",
+        "«": '"',
+        "»": '"',
+        "—": "-",
+        "–": "-",
+    }
+)
+
+
+class LocalCardImageGenerator:
+    """Renders holiday cards (gradient, confetti, emoji, title) on CPU.
+    Rendering is deterministic for the same (title, style) pair"""
+
+    # (top background, bottom background, accent, text)
+    palettes: dict[str, Palette] = {
+        "ANIME": ((255, 183, 213), (160, 196, 255), (255, 255, 255), (60, 20, 80)),
+        "CARTOON": ((255, 221, 87), (255, 120, 80), (40, 160, 255), (30, 30, 30)),
+        "PIXELART": ((36, 36, 72), (90, 40, 120), (0, 255, 170), (255, 255, 255)),
+        "INKPUNK": ((20, 20, 20), (120, 0, 60), (255, 210, 0), (255, 255, 255)),
+        "HORROR": ((10, 0, 0), (90, 0, 0), (200, 200, 200), (255, 230, 230)),
+        "RUSSIA": ((255, 255, 255), (0, 57, 166), (213, 43, 30), (20, 20, 60)),
+        "USSR": ((200, 16, 46), (120, 0, 0), (255, 215, 0), (255, 240, 200)),
+        "SPACE": ((5, 5, 30), (40, 20, 90), (255, 255, 200), (230, 230, 255)),
+        "FANTASY": ((70, 30, 120), (20, 120, 110), (255, 220, 120), (255, 255, 255)),
+        "CINEMA": ((15, 15, 15), (70, 60, 40), (230, 190, 90), (255, 250, 235)),
+        "SUPERHERO": ((0, 60, 180), (220, 20, 40), (255, 220, 0), (255, 255, 255)),
+        "DRAMA": ((40, 40, 60), (110, 90, 120), (220, 200, 230), (255, 255, 255)),
+        "ALIEN": ((10, 40, 20), (60, 200, 90), (200, 255, 0), (240, 255, 240)),
+        "IKEA": ((0, 81, 186), (0, 60, 140), (255, 218, 26), (255, 218, 26)),
+    }
+    default_palettes: list[Palette] = [
+        ((255, 94, 98), (255, 195, 113), (255, 255, 255), (50, 20, 20)),
+        ((86, 204, 242), (47, 128, 237), (255, 240, 120), (255, 255, 255)),
+        ((168, 230, 207), (255, 211, 182), (255, 139, 148), (40, 40, 40)),
+        ((238, 156, 167), (255, 221, 225), (255, 255, 255), (90, 20, 60)),
+    ]
+
+    font_candidates = [
+        "DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+        "arialbd.ttf",
+        "Arial Bold.ttf",
+    ]
+    emoji_font_candidates = [
+        "NotoColorEmoji.ttf",
+        "/usr/share/fonts/truetype/noto/NotoColorEmoji.ttf",
+        "/usr/share/fonts/noto/NotoColorEmoji.ttf",
+    ]
+    # color bitmap emoji fonts can only be loaded at their native size
+    emoji_font_size = 109
+
+    @staticmethod
+    def _load_font(candidates: list[str], size: int):
+        for candidate in candidates:
+            try:
+                return ImageFont.truetype(candidate, size)
+            except OSError:
+                continue
+        return None
+
+    def _get_font(self, size: int):
+        if size not in self._fonts:
+            font = LocalCardImageGenerator._load_font(self.font_candidates, size)
+            self._fonts[size] = font if font is not None else ImageFont.load_default()
+        return self._fonts[size]
+
+    @staticmethod
+    def _fit_title(title: str, font) -> str:
+        if not isinstance(font, ImageFont.ImageFont):
+            return title
+        # the default bitmap font has latin-1 glyphs only
+        return (
+            title.translate(CYRILLIC_TO_LATIN)
+            .encode("latin-1", errors="ignore")
+            .decode("latin-1")
+        )
+
+    def _get_palette(self, style: str, rng: random.Random) -> Palette:
+        palette = self.palettes.get(style, None)
+        if palette is None:
+            palette = rng.choice(self.default_palettes)
+        return palette
+
+    def _draw_background(self, palette: Palette) -> Image.Image:
+        top, bottom, _, _ = palette
+        mask = Image.linear_gradient("L").resize((self.width, self.height))
+        return Image.composite(
+            Image.new("RGB", (self.width, self.height), bottom),
+            Image.new("RGB", (self.width, self.height), top),
+            mask,
+        )
+
+    def _draw_confetti(self, draw: ImageDraw.ImageDraw, palette: Palette, rng):
+        _, _, accent, text_color = palette
+        for _ in range(self.confetti_number):
+            x, y = rng.randrange(self.width), rng.randrange(self.height)
+            radius = rng.randint(3, 12)
+            color = accent if rng.random() < 0.7 else text_color
+            if rng.random() < 0.5:
+                draw.ellipse((x - radius, y - radius, x + radius, y + radius), color)
+            else:
+                draw.rectangle((x - radius, y - radius // 2, x + radius, y), color)
+
+    def _draw_emoji(self, image: Image.Image, rng: random.Random):
+        if self._emoji_font is None:
+            return
+
+        emoji_layer = Image.new("RGBA", (160, 160), (0, 0, 0, 0))
+        ImageDraw.Draw(emoji_layer).text(
+            (10, 10), rng.choice(EMOJI_LIST), font=self._emoji_font, embedded_color=True
+        )
+        emoji_layer = emoji_layer.resize((96, 96))
+        for position in [(24, 24), (self.width - 120, self.height - 120)]:
+            image.paste(emoji_layer, position, emoji_layer)
+
+    @staticmethod
+    def _wrap(draw: ImageDraw.ImageDraw, text: str, font, max_width: float):
+        lines: list[str] = []
+        for word in text.split():
+            if lines and draw.textlength(f"{lines[-1]} {word}", font=font) <= max_width:
+                lines[-1] = f"{lines[-1]} {word}"
+            else:
+                lines.append(word)
+        return lines
+
+    def _draw_title(self, draw: ImageDraw.ImageDraw, title: str, palette: Palette):
+        _, _, _, text_color = palette
+        shadow_color = tuple(255 - channel for channel in text_color)
+        max_width = self.width * 0.88
+
+        for font_size in [56, 48, 40, 34, 28, 22]:
+            font = self._get_font(font_size)
+            lines = LocalCardImageGenerator._wrap(
+                draw, LocalCardImageGenerator._fit_title(title, font), font, max_width
+            )
+            line_height = int(font_size * 1.25)
+            fits_width = all(
+                draw.textlength(line, font=font) <= max_width for line in lines
+            )
+            if fits_width and len(lines) * line_height <= self.height * 0.7:
+                break
+
+        y = (self.height - len(lines) * line_height) // 2
+        for line in lines:
+            x = (self.width - draw.textlength(line, font=font)) // 2
+            draw.text((x + 2, y + 2), line, font=font, fill=shadow_color)
+            draw.text((x, y), line, font=font, fill=text_color)
+            y += line_height
+
+    def __init__(self, width: int = 512, height: int = 512) -> None:
+        self.width = width
+        self.height = height
+        self.confetti_number = 60
+
+        self._fonts: dict = {}
+        self._emoji_font = LocalCardImageGenerator._load_font(
+            self.emoji_font_candidates, self.emoji_font_size
+        )
+
+    def render(self, title: str, style: str = "") -> bytes:
+        """Renders the holiday card
+
+        Args:
+            title (str): holiday title drawn on the card
+            style (str, optional): image style used to choose the palette.
+            Defaults to "".
+
+        Returns:
+            bytes: PNG image
+        """
+        rng = random.Random(f"{title}|{style}")
+        palette = self._get_palette(style, rng)
+
+        image = self._draw_background(palette)
+        draw = ImageDraw.Draw(image)
+        self._draw_confetti(draw, palette, rng)
+        self._draw_emoji(image, rng)
+        self._draw_title(draw, title, palette)
+
+        buffer = io.BytesIO()
+        # fastest compression, the card is mostly flat colors anyway
+        image.save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+
+    def get_image_bytes(self, prompt: str, style: Optional[str] = None) -> bytes:
+        """Returns rendered card based on the prompt
+
+        Args:
+            prompt (str): holiday title
+            style (Optional[str], optional): image style. Defaults to None.
+
+        Returns:
+            bytes: PNG image
+        """
+        return self.render(prompt, style or "")
@@ -1,10 +1,11 @@
-import base64
-import json
+import asyncio
 import random
-import time
-import grequests
+import threading
+from typing import Optional
+import aiohttp
 from deep_translator import GoogleTranslator
-import requests
+from budget import BUDGET_MANAGER
+from image_quality import QUALITY_GATE
 from local_secrets import SECRETS_MANAGER
 from logger import LOGGER
 
@@ -15,135 +16,127 @@ from settings import SETTINGS_MANAGER
 class ModelBasedImageGeneratorInterface:
     """Asynchronous image generator Interface"""
 
-    async def get_image_b64_hash(self, prompt: str) -> bytes:
-        """Returns image base64 hash based on the prompt
+    async def get_image_bytes(self, prompt: str) -> bytes:
+        """Returns raw image bytes based on the prompt
 
         Args:
             prompt (str): image description
 
         Returns:
-            str: image b64 hash
+            bytes: raw image
         """
         raise NotImplementedError
 
-    async def get_image_b64_hashes(self, prompts: list[str]) -> list[bytes]:
-        """Returns image b64 hashes based on the prompts
+    async def get_images_bytes(self, prompts: list[str]) -> list[bytes]:
+        """Returns raw images bytes based on the prompts
 
         Args:
             prompts (list[str]): image descriptions
 
         Returns:
-            list[str]: image b64 hashes
+            list[bytes]: raw images
         """
         raise NotImplementedError
 
 
-class HuggingFaceImageGenerator(ModelBasedImageGeneratorInterface):
-    """Asynchronous image generator based on Fusion Brain"""
+class ModelStats:
+    """Outcomes of a single model"""
 
-    def _prepare_prompt(self, prompt: str) -> str:
-        fixed_prompt = prompt.replace("«", "'").replace("»", "'")
-        return self.translator.translate(fixed_prompt)
-
-    def _get_image_style(self) -> str:
-        return random.choice([*SETTINGS_MANAGER.image_generator.styles, ""])
-
-    def _api_request(self, url: str, prompt: str) -> bytes:
-        """Request to Hugging face api
+    def __init__(self) -> None:
+        self.successes = 0
+        self.failures = 0
+        self.rejections = 0
 
-        Args:
-            url (str): string
-            prompt (str): string
+    def get_score(self) -> float:
+        """Returns smoothed share of accepted images
 
         Returns:
-            str: uuid of result
+            float: score in (0, 1)
         """
+        total = self.successes + self.failures + self.rejections
+        return (self.successes + 1) / (total + 2)
 
-        parts = self.model_attempts - 1
-        for i in range(self.model_attempts):
-            try:
-                if i == parts:
-                    model_input = SETTINGS_MANAGER.get_image_soft_prompt()
-                else:
-                    model_input = self._prepare_prompt(prompt)
-                response = requests.post(
-                    url,
-                    headers=self.headers,
-                    json={
-                        "inputs": model_input,
-                    },
-                    timeout=self.timeout,
-                )
-                if response.ok:
-                    return base64.b64encode(response.content)
-
-                if i == parts:
-                    break
-                try:
-                    wait_time = (
-                        float(
-                            json.loads(
-                                response.content.decode("utf8").replace("'", '"')
-                            )["estimated_time"]
-                        )
-                        / parts
-                    )
-
-                    time.sleep(wait_time)
-                except BaseException:  # pylint: disable=W0718
-                    break
-
-            except BaseException:  # pylint: disable=W0718
-                pass
-        return bytes([])
-
-    def _api_wrapper(self, prompt: str, idx: int = 0) -> bytes:
-        """Wraps request to Fusion Brain api
-
-        Args:
-            prompt (str): image prompt
-            idx (int): image idx
+    def __str__(self) -> str:
+        return (
+            f"{self.successes} ok, {self.failures} failed, "
+            f"{self.rejections} rejected, score {self.get_score():.2f}"
+        )
 
-        Returns:
-            str, : image_b64
-        """
 
-        style = self._get_image_style()
+class HuggingFaceImageGenerator(ModelBasedImageGeneratorInterface):
+    """Asynchronous image generator based on Hugging Face inference api"""
 
-        model = self.models_dict.get(style, None)
+    budget_name = "HUGGINGFACE"
 
-        if model is None:
-            # model = self.basic_model
-            model = self.basic_models[idx % len(self.basic_models)]
+    def _prepare_prompt(self, prompt: str) -> str:
+        fixed_prompt = prompt.replace("«", "'").replace("»", "'")
+        return self.translator.translate(fixed_prompt)
 
-            if style != "":
-                prompt = f"{prompt} in style '{style}'"
+    def _get_image_style(self) -> str:
+        return random.choice([*SETTINGS_MANAGER.image_generator.styles, ""])
 
-        return self._api_request(self.api_url + model, prompt)
+    def _record_model_outcome(self, model: str, outcome: str):
+        with self._model_stats_lock:
+            stats = self.model_stats.setdefault(model, ModelStats())
+            setattr(stats, outcome, getattr(stats, outcome) + 1)
+
+    def _choose_basic_model(self, idx: int) -> str:
+        with self._model_stats_lock:
+            if len(self.model_stats) == 0:
+                return self.basic_models[idx % len(self.basic_models)]
+            # models that are often rejected or failing are chosen less often
+            weights = [
+                self.model_stats.get(model, ModelStats()).get_score()
+                for model in self.basic_models
+            ]
+        return random.choices(self.basic_models, weights=weights)[0]
 
-    def _build_request(self, prompt: str, idx: int = 0) -> tuple[str, str]:
+    def _build_model_request(self, model_input: str, idx: int = 0) -> tuple[str, str]:
         style = self._get_image_style()
 
         model = self.models_dict.get(style, None)
-        final_prompt = prompt
 
         if model is None:
-            model = self.basic_models[idx % len(self.basic_models)]
+            model = self._choose_basic_model(idx)
 
             if style != "":
-                final_prompt = f"{prompt} in style '{style}'"
+                model_input = f"{model_input} in style '{style}'"
 
-        return self.api_url + model, self._prepare_prompt(final_prompt)
+        return model, model_input
 
-    def _build_requests(self, prompts: list[str]) -> list[tuple[str, str]]:
-        return [self._build_request(prompt, i) for i, prompt in enumerate(prompts)]
+    async def _check_quality_async(self, model: str, image: bytes) -> bool:
+        if not image:
+            self._record_model_outcome(model, "failures")
+            return False
 
-    def _process_response(self, r: requests.Response) -> bytes:
-        if not r.ok:
-            return bytes([])
+        reason = await QUALITY_GATE.check_async(image)
+        if reason:
+            LOGGER.log(f"Image of {model} was rejected: {reason}", "Warning")
+            self._record_model_outcome(model, "rejections")
+            return False
+
+        self._record_model_outcome(model, "successes")
+        return True
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _post_async(self, model: str, model_input: str) -> bytes:
         try:
-            return base64.b64encode(r.content)
-        except:
+            async with self._get_session().post(
+                self.api_url + model, json={"inputs": model_input}
+            ) as response:
+                if not response.ok:
+                    return bytes([])
+                return await response.read()
+        except asyncio.CancelledError:
+            raise
+        except BaseException:  # pylint: disable=W0718
             return bytes([])
 
     def __init__(self) -> None:
@@ -179,60 +172,81 @@ class HuggingFaceImageGenerator(ModelBasedImageGeneratorInterface):
         self.translator = GoogleTranslator(source="auto", target="en")
 
         self.attempt_rounds = 10
-        self.model_attempts = 3
 
         self.delay_s = 5
 
-        self._requests_size = 10
+        self.model_stats: dict[str, ModelStats] = {}
+        self._model_stats_lock = threading.Lock()
 
-    def get_image_b64_hash(self, prompt):
-        return self._api_wrapper(prompt)
+        self._session: Optional[aiohttp.ClientSession] = None
 
-    def get_image_b64_hashes(self, prompts: list[str]) -> list[bytes]:
+    async def close(self):
+        """Closes the shared http session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
-        prompt_hash_dict: dict[str, bytes] = dict()
-        for prompt in prompts:
-            prompt_hash_dict[prompt] = bytes([])
+    def prepare_prompt(self, prompt: str) -> str:
+        """Prepares the holiday title to be used as model input
 
-        remain_prompts = prompts.copy()
+        Args:
+            prompt (str): holiday title
 
-        for k in range(self.attempt_rounds):
+        Returns:
+            str: translated prompt
+        """
+        return self._prepare_prompt(prompt)
 
-            if len(remain_prompts) == 0:
-                break
+    async def generate_image_bytes(self, model_input: str, idx: int = 0) -> bytes:
+        """Generates single image from the prepared model input.
+        Every failed round switches the style and the model.
+        Cancellation stops the rounds at once, so no more budget is spent
 
-            running_prompts = remain_prompts.copy()
-            remain_prompts = []
-
-            rs = [
-                grequests.post(
-                    url,
-                    headers=self.headers,
-                    json={
-                        "inputs": model_input,
-                    },
-                    timeout=self.timeout,
-                )
-                for (url, model_input) in self._build_requests(running_prompts)
-            ]
+        Args:
+            model_input (str): prepared (translated) prompt
+            idx (int): image idx used for the model choice. Defaults to 0
+
+        Returns:
+            bytes: raw image, empty if all the rounds failed
+        """
+        for k in range(self.attempt_rounds):
+            model, final_input = self._build_model_request(model_input, idx + k)
+            if not await BUDGET_MANAGER.try_spend_async(self.budget_name):
+                break
 
-            iterator = grequests.imap_enumerated(rs, size=self._requests_size)
+            image = await self._post_async(model, final_input)
+            if await self._check_quality_async(model, image):
+                return image
 
-            for idx, r in LOGGER.get_tqdm(
-                iterator,
-                total=len(running_prompts),
-                desc=f"Generating images (round {k+1})",
-            ):
-                if r is None:
-                    remain_prompts.append(running_prompts[idx])
-                    continue
-                b64_hash = self._process_response(r)
-                if not b64_hash:
-                    remain_prompts.append(running_prompts[idx])
-                    continue
+            await BUDGET_MANAGER.record_failure_async(self.budget_name)
+            await asyncio.sleep(self.delay_s)
 
-                prompt_hash_dict[running_prompts[idx]] = b64_hash
+        return bytes([])
 
-            time.sleep(self.delay_s)
+    def get_model_stats_report(self) -> str:
+        """Returns per-model outcomes used for the model choice
 
-        return [prompt_hash_dict[prompt] for prompt in prompts]
+        Returns:
+            str: one line per model
+        """
+        with self._model_stats_lock:
+            return "\n".join(
+                f"{model}: {stats}" for model, stats in self.model_stats.items()
+            )
+
+    async def get_image_bytes(self, prompt: str) -> bytes:
+        model_input = await asyncio.to_thread(self._prepare_prompt, prompt)
+        return await self.generate_image_bytes(model_input)
+
+    async def get_images_bytes(self, prompts: list[str]) -> list[bytes]:
+        model_inputs = await asyncio.gather(
+            *[asyncio.to_thread(self._prepare_prompt, prompt) for prompt in prompts]
+        )
+        return list(
+            await asyncio.gather(
+                *[
+                    self.generate_image_bytes(model_input, idx)
+                    for idx, model_input in enumerate(model_inputs)
+                ]
+            )
+        )
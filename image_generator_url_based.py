@@ -1,9 +1,12 @@
-import time
-import aiohttp
 import asyncio
+from typing import Optional
+import aiohttp
 from deep_translator import GoogleTranslator
+from budget import BUDGET_MANAGER
+from gallery import GALLERY
 from logger import LOGGER
 
+from rate_limiter import get_provider_rate_limiter
 from settings import SETTINGS_MANAGER
 
 
@@ -34,55 +37,79 @@ class AsyncURLBasedImageGeneratorInterface:
 
 
 class DALLeImageGenerator(AsyncURLBasedImageGeneratorInterface):
-    """Asynchronous image generator based on OpenAI DALL-E"""
+    """Asynchronous image generator based on OpenAI DALL-E.
+    All the requests share one session and one token bucket, so prompts are
+    processed concurrently up to the allowed rate"""
+
+    budget_name = "DALLE"
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
 
     def _prepare_prompt(self, prompt: str) -> str:
         fixed_prompt = prompt.replace("«", "'").replace("»", "'")
         return self.translator.translate(fixed_prompt)
 
-    async def _api_request(self, prompt: str) -> tuple[str, int]:
-        """Request to Open AI api
+    def _build_payload(self, model_input: str) -> dict:
+        return {
+            "prompt": model_input,
+            "n": 1,
+            "size": f"{self.image_size}x{self.image_size}",
+        }
+
+    async def _post(self, model_input: str) -> tuple[str, int]:
+        """Single rate-limited request to Open AI api
 
         Args:
-            prompt (str): image prompt
+            model_input (str): prepared image prompt
 
         Returns:
-            tuple[str, int]: (image_url, number_of_requests_made)
+            tuple[str, int]: (image_url, response_status)
         """
+        await self.rate_limiter.acquire()
 
-        requests_number = 0
-        try:
-            data = f'{{"prompt": "{self._prepare_prompt(prompt)}","n":1,"size":"{self.image_size}x{self.image_size}"}}'
-
-            response_status = 400
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.url, headers=self.headers, data=data
-                ) as response:
-                    requests_number += 1
-                    response_status = response.status
+        if not await BUDGET_MANAGER.try_spend_async(self.budget_name):
+            return ("", 429)
 
-                    if response.status == 200:
-                        response = await response.json()
+        async with self._get_session().post(
+            self.url, headers=self.headers, json=self._build_payload(model_input)
+        ) as response:
+            if response.status == 200:
+                response_json = await response.json()
+                return (response_json["data"][0]["url"], response.status)
+            await BUDGET_MANAGER.record_failure_async(self.budget_name)
+            return ("", response.status)
 
-                        return (response["data"][0]["url"], requests_number)
-
-                # 400 means that prompt is inappropriate
-                if response_status != 400:
-                    return ("", requests_number)
-
-                soft_data = f'{{"prompt": "{SETTINGS_MANAGER.image_generator.soft_prompt }","n":1,"size":"{self.image_size}x{self.image_size}"}}'
+    async def _api_request(self, model_input: str) -> tuple[str, int]:
+        """Request to Open AI api
 
-                await asyncio.sleep(self.request_delay_seconds)
+        Args:
+            model_input (str): prepared image prompt
 
-                async with session.post(
-                    self.url, headers=self.headers, data=soft_data
-                ) as response:
-                    requests_number += 1
-                    if response.status == 200:
-                        response = await response.json()
+        Returns:
+            tuple[str, int]: (image_url, number_of_requests_made)
+        """
 
-                        return (response["data"][0]["url"], requests_number)
+        requests_number = 0
+        try:
+            url, response_status = await self._post(model_input)
+            requests_number += 1
+            if url:
+                return (url, requests_number)
+
+            # 400 means that prompt is inappropriate
+            if response_status != 400:
+                return ("", requests_number)
+
+            url, _ = await self._post(SETTINGS_MANAGER.image_generator.soft_prompt)
+            requests_number += 1
+            return (url, requests_number)
+        except asyncio.CancelledError:
+            raise
         except BaseException:  # pylint: disable=W0718
             pass
         return ("", requests_number)
@@ -93,37 +120,118 @@ class DALLeImageGenerator(AsyncURLBasedImageGeneratorInterface):
         self.image_size = image_size
 
         self.max_rate_per_minute = 5
-        self.request_delay_seconds = (60 / self.max_rate_per_minute) + 1
+        self.rate_limiter = get_provider_rate_limiter(
+            self.budget_name, self.max_rate_per_minute
+        )
+        self.timeout = 60
 
         self.url = "https://api.openai.com/v1/images/generations"
         self.headers = {
-            "Content-Type": "application/json",
             "Authorization": f"Bearer {self.key}",
         }
         self.translator = GoogleTranslator(source="auto", target="en")
 
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def close(self):
+        """Closes the shared http session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def prepare_prompt(self, prompt: str) -> str:
+        """Prepares the holiday title to be used as model input
+
+        Args:
+            prompt (str): holiday title
+
+        Returns:
+            str: translated prompt
+        """
+        return self._prepare_prompt(prompt)
+
+    async def generate_image_url(self, model_input: str) -> str:
+        """Generates single image from the prepared model input
+
+        Args:
+            model_input (str): prepared (translated) prompt
+
+        Returns:
+            str: image url, empty if generation failed
+        """
+        url, _ = await self._api_request(model_input)
+        return url
+
+    async def download_image(self, url: str) -> bytes:
+        """Downloads generated image through the shared session
+
+        Args:
+            url (str): image url
+
+        Returns:
+            bytes: raw image, empty if download failed
+        """
+        async with self._get_session().get(url) as response:
+            if not response.ok:
+                return bytes([])
+            return await response.read()
+
     async def get_image_url(self, prompt):
-        return await self._api_request(prompt)
+        model_input = await asyncio.to_thread(self._prepare_prompt, prompt)
+        return await self.generate_image_url(model_input)
 
     async def get_image_urls(self, prompts) -> list[str]:
-        urls: list[str] = []
-        total_prompts = len(prompts)
-        for i, prompt in LOGGER.get_tqdm(
-            enumerate(prompts),
+        async def generate(idx: int, prompt: str) -> tuple[int, str]:
+            try:
+                return idx, await self.get_image_url(prompt)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:  # pylint: disable=W0718
+                return idx, ""
+
+        urls: list[str] = [""] * len(prompts)
+        for future in LOGGER.get_tqdm(
+            asyncio.as_completed([generate(i, p) for i, p in enumerate(prompts)]),
             total=len(prompts),
             desc="Generating images",
         ):
-            start_time = time.time()
-            url, requests_number = await self._api_request(prompt)
-            urls.append(url)
+            idx, url = await future
+            urls[idx] = url
 
-            if i != total_prompts - 1:
-                end_time = time.time()
+        return urls
 
-                delay = requests_number * self.request_delay_seconds - (
-                    end_time - start_time
-                )
+    async def get_image_paths(
+        self, prompts: list[str], start_idx: int = 0
+    ) -> list[str]:
+        """Generates images and streams each one to the gallery as soon as
+        its url is ready, so requests and downloads overlap
 
-                await asyncio.sleep(max(0, delay))
+        Args:
+            prompts (list[str]): image descriptions
+            start_idx (int): index of the first image. Defaults to 0
 
-        return urls
+        Returns:
+            list[str]: paths of saved images, empty for failed ones
+        """
+
+        async def generate(idx: int, prompt: str) -> tuple[int, str]:
+            try:
+                url = await self.get_image_url(prompt)
+                return idx, await GALLERY.save_image(
+                    idx + start_idx, url, self._get_session()
+                )
+            except asyncio.CancelledError:
+                raise
+            except BaseException:  # pylint: disable=W0718
+                return idx, ""
+
+        image_paths: list[str] = [""] * len(prompts)
+        for future in LOGGER.get_tqdm(
+            asyncio.as_completed([generate(i, p) for i, p in enumerate(prompts)]),
+            total=len(prompts),
+            desc="Generating images",
+        ):
+            idx, image_path = await future
+            image_paths[idx] = image_path
+
+        return image_paths
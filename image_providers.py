@@ -0,0 +1,436 @@
+"""Contains unified asynchronous image providers and the hedged composite generator"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from budget import BUDGET_MANAGER
+from image_quality import QUALITY_GATE
+from image_generator_b64_based import FusionBrainImageGenerator
+from image_generator_local_based import LocalCardImageGenerator
+from image_generator_model_based import HuggingFaceImageGenerator
+from image_generator_url_based import DALLeImageGenerator
+from local_secrets import SECRETS_MANAGER
+from logger import LOGGER
+from settings import SETTINGS_MANAGER
+
+
+class AsyncImageProviderInterface:
+    """Unified asynchronous image provider Interface"""
+
+    name = ""
+    # providers that validate images themselves are not checked twice
+    checks_quality = False
+
+    def prepare_prompt(self, prompt: str) -> str:
+        """Prepares the holiday title to be used as model input
+
+        Args:
+            prompt (str): holiday title
+
+        Returns:
+            str: prepared prompt
+        """
+        raise NotImplementedError
+
+    async def generate(self, model_input: str, idx: int = 0, title: str = "") -> bytes:
+        """Generates raw image bytes from the prepared model input
+
+        Args:
+            model_input (str): prepared prompt
+            idx (int): image idx. Defaults to 0
+            title (str): original holiday title. Defaults to ""
+
+        Returns:
+            bytes: raw image, empty if generation failed
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """Releases provider resources"""
+
+    def get_stats_report(self) -> str:
+        """Returns provider specific statistics
+
+        Returns:
+            str: statistics, empty if there are none
+        """
+        return ""
+
+
+class HuggingFaceProvider(AsyncImageProviderInterface):
+    """Hugging Face provider. Requests go through the shared session"""
+
+    name = HuggingFaceImageGenerator.budget_name
+    checks_quality = True
+
+    def __init__(self) -> None:
+        self.generator = HuggingFaceImageGenerator()
+
+    def prepare_prompt(self, prompt: str) -> str:
+        return self.generator.prepare_prompt(prompt)
+
+    def get_stats_report(self) -> str:
+        return self.generator.get_model_stats_report()
+
+    async def generate(self, model_input: str, idx: int = 0, title: str = "") -> bytes:
+        return await self.generator.generate_image_bytes(model_input, idx)
+
+    async def close(self):
+        await self.generator.close()
+
+
+class FusionBrainProvider(AsyncImageProviderInterface):
+    """Fusion Brain provider. Base64 is decoded right at the provider edge"""
+
+    name = FusionBrainImageGenerator.budget_name
+
+    def __init__(self) -> None:
+        self.generator = FusionBrainImageGenerator()
+
+    def prepare_prompt(self, prompt: str) -> str:
+        return self.generator.prepare_prompt(prompt)
+
+    async def generate(self, model_input: str, idx: int = 0, title: str = "") -> bytes:
+        return await self.generator.generate_image_bytes(model_input)
+
+    async def close(self):
+        await self.generator.close()
+
+
+class DALLeProvider(AsyncImageProviderInterface):
+    """OpenAI DALL-E provider. Generated url is downloaded through the shared session"""
+
+    name = DALLeImageGenerator.budget_name
+
+    def __init__(self) -> None:
+        self.generator = DALLeImageGenerator(SECRETS_MANAGER.get_open_ai_token())
+
+    def prepare_prompt(self, prompt: str) -> str:
+        return self.generator.prepare_prompt(prompt)
+
+    async def generate(self, model_input: str, idx: int = 0, title: str = "") -> bytes:
+        url = await self.generator.generate_image_url(model_input)
+        if not url:
+            return bytes([])
+        return await self.generator.download_image(url)
+
+    async def close(self):
+        await self.generator.close()
+
+
+class LocalCardProvider(AsyncImageProviderInterface):
+    """Offline provider rendering holiday cards on CPU. Never fails"""
+
+    name = "LOCAL"
+    checks_quality = True
+
+    def __init__(self) -> None:
+        self.generator = LocalCardImageGenerator()
+
+    def prepare_prompt(self, prompt: str) -> str:
+        return prompt
+
+    async def generate(self, model_input: str, idx: int = 0, title: str = "") -> bytes:
+        styles = SETTINGS_MANAGER.image_generator.styles
+        style = styles[idx % len(styles)] if len(styles) > 0 else ""
+        return await asyncio.to_thread(
+            self.generator.render, title or model_input, style
+        )
+
+
+PROVIDERS = {
+    HuggingFaceProvider.name: HuggingFaceProvider,
+    FusionBrainProvider.name: FusionBrainProvider,
+    DALLeProvider.name: DALLeProvider,
+    LocalCardProvider.name: LocalCardProvider,
+}
+
+
+class ProviderStats:
+    """Latency and outcome statistics of a single provider"""
+
+    def __init__(self, name: str, window: int = 100) -> None:
+        self.name = name
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.rejections = 0
+        self.cancellations = 0
+        self.refusals = 0
+
+    def record_success(self, latency: float):
+        """Records successful generation
+
+        Args:
+            latency (float): generation time in seconds
+        """
+        self.successes += 1
+        self.latencies.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Returns latency percentile of recent successful generations
+
+        Args:
+            percentile (float): percentile in [0, 1]
+
+        Returns:
+            Optional[float]: latency in seconds, None if there is no data yet
+        """
+        if len(self.latencies) == 0:
+            return None
+        ordered = sorted(self.latencies)
+        position = min(len(ordered) - 1, int(percentile * len(ordered)))
+        return ordered[position]
+
+    def __str__(self) -> str:
+        p50 = self.percentile(0.5)
+        p90 = self.percentile(0.9)
+        latency = "no data" if p50 is None else f"p50 {p50:.1f}s, p90 {p90:.1f}s"
+        return (
+            f"{self.name}: {self.successes} ok, {self.failures} failed, "
+            f"{self.rejections} rejected, "
+            f"{self.cancellations} cancelled, {self.refusals} out of budget, "
+            f"{latency}"
+        )
+
+
+class HedgedImageGenerator(AsyncImageProviderInterface):
+    """Composite generator: if the current provider is slower than its usual
+    latency percentile, the prompt is also sent to the next provider.
+    The first good result wins and the rest are cancelled.
+    If every provider fails or the deadline is passed, the fallback is used"""
+
+    name = "HEDGED"
+
+    def __init__(
+        self,
+        providers: list[AsyncImageProviderInterface],
+        hedge_percentile: float = 0.9,
+        min_samples: int = 5,
+        default_hedge_delay: float = 60,
+        fallback: Optional[AsyncImageProviderInterface] = None,
+        max_budget_wait_seconds: float = 0,
+    ) -> None:
+        """
+        Args:
+            providers (list[AsyncImageProviderInterface]): providers in priority order
+            hedge_percentile (float, optional): latency percentile after which
+            the next provider is started. Defaults to 0.9.
+            min_samples (int, optional): samples needed before the percentile is
+            trusted. Defaults to 5.
+            default_hedge_delay (float, optional): hedge delay in seconds used
+            before there is enough data. Defaults to 60.
+            fallback (Optional[AsyncImageProviderInterface], optional): provider
+            used when the others failed or the deadline is passed. Defaults to None.
+            max_budget_wait_seconds (float, optional): how long a provider with
+            exhausted hourly budget may wait for the next hour, not longer than
+            its hedge delay. Defaults to 0.
+        """
+        if len(providers) == 0:
+            raise ValueError("At least one provider is required")
+
+        self.providers = providers
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.default_hedge_delay = default_hedge_delay
+        self.fallback = fallback
+        self.max_budget_wait_seconds = max_budget_wait_seconds
+
+        self.stats = {
+            provider.name: ProviderStats(provider.name)
+            for provider in [*providers, *([fallback] if fallback else [])]
+        }
+        self.hedged_requests = 0
+        self.degraded_requests = 0
+
+        self._deadline: Optional[float] = None
+
+    def _get_hedge_delay(self, provider: AsyncImageProviderInterface) -> float:
+        stats = self.stats[provider.name]
+        if len(stats.latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return stats.percentile(self.hedge_percentile) or self.default_hedge_delay
+
+    def _get_time_left(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return self._deadline - time.monotonic()
+
+    async def _timed_generate(
+        self,
+        provider: AsyncImageProviderInterface,
+        model_input: str,
+        idx: int,
+        title: str,
+    ) -> bytes:
+        stats = self.stats[provider.name]
+
+        if BUDGET_MANAGER.is_limited(provider.name):
+            # the wait is not longer than the hedge, so the next provider is not
+            # held back by this one's budget
+            max_wait_seconds = min(
+                self.max_budget_wait_seconds, self._get_hedge_delay(provider)
+            )
+            time_left = self._get_time_left()
+            if time_left is not None:
+                max_wait_seconds = min(max_wait_seconds, max(0.0, time_left))
+            # out of budget providers either wait for the next hour or step aside
+            if not await BUDGET_MANAGER.wait_for_budget(
+                provider.name, max_wait_seconds
+            ):
+                stats.refusals += 1
+                return bytes([])
+
+        start_time = time.monotonic()
+        try:
+            image = await provider.generate(model_input, idx, title)
+        except asyncio.CancelledError:
+            stats.cancellations += 1
+            raise
+        except BaseException:  # pylint: disable=W0718
+            image = bytes([])
+
+        if not image:
+            stats.failures += 1
+            return image
+
+        if not provider.checks_quality:
+            reason = await QUALITY_GATE.check_async(image)
+            if reason:
+                LOGGER.log(
+                    f"Image of {provider.name} was rejected: {reason}", "Warning"
+                )
+                stats.rejections += 1
+                return bytes([])
+
+        stats.record_success(time.monotonic() - start_time)
+        return image
+
+    async def _generate_hedged(self, model_input: str, idx: int, title: str) -> bytes:
+        pending: set[asyncio.Task] = set()
+        next_provider = 0
+
+        def start_next():
+            nonlocal next_provider
+            provider = self.providers[next_provider]
+            next_provider += 1
+            pending.add(
+                asyncio.create_task(
+                    self._timed_generate(provider, model_input, idx, title)
+                )
+            )
+
+        start_next()
+        try:
+            while pending:
+                has_next = next_provider < len(self.providers)
+                timeout = (
+                    self._get_hedge_delay(self.providers[next_provider - 1])
+                    if has_next
+                    else None
+                )
+                time_left = self._get_time_left()
+                if time_left is not None:
+                    if time_left <= 0:
+                        break
+                    timeout = time_left if timeout is None else min(timeout, time_left)
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    image = task.result()
+                    if image:
+                        return image
+
+                if has_next:
+                    # either the provider is too slow (hedge) or it failed (failover)
+                    if not done:
+                        self.hedged_requests += 1
+                    start_next()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return bytes([])
+
+    def set_deadline(self, deadline: Optional[float]):
+        """Sets the moment after which only the fallback is used
+
+        Args:
+            deadline (Optional[float]): time.monotonic() based deadline,
+            None to disable degrading
+        """
+        self._deadline = deadline
+
+    def prepare_prompt(self, prompt: str) -> str:
+        return self.providers[0].prepare_prompt(prompt)
+
+    async def generate(self, model_input: str, idx: int = 0, title: str = "") -> bytes:
+        time_left = self._get_time_left()
+        if time_left is None or time_left > 0:
+            image = await self._generate_hedged(model_input, idx, title)
+            if image:
+                return image
+
+        if self.fallback is None:
+            return bytes([])
+
+        self.degraded_requests += 1
+        return await self._timed_generate(self.fallback, model_input, idx, title)
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.close()
+        if self.fallback is not None:
+            await self.fallback.close()
+
+    def get_stats_report(self) -> str:
+        """Returns per-provider statistics
+
+        Returns:
+            str: one line per provider
+        """
+        lines = [str(stats) for stats in self.stats.values()]
+        for provider in [*self.providers, *([self.fallback] if self.fallback else [])]:
+            provider_report = provider.get_stats_report()
+            if provider_report:
+                lines.append(f"{provider.name} models:\n{provider_report}")
+        lines.append(f"hedged requests: {self.hedged_requests}")
+        lines.append(f"degraded requests: {self.degraded_requests}")
+        return "\n".join(lines)
+
+
+def build_image_generator() -> HedgedImageGenerator:
+    """Builds hedged generator from the providers listed in settings
+
+    Returns:
+        HedgedImageGenerator
+    """
+    providers: list[AsyncImageProviderInterface] = []
+    for provider_name in SETTINGS_MANAGER.image_generator.providers:
+        provider_class = PROVIDERS.get(provider_name, None)
+        if provider_class is None:
+            LOGGER.log(f"Unknown image provider '{provider_name}'", "Warning")
+            continue
+        providers.append(provider_class())
+
+    if len(providers) == 0:
+        providers.append(HuggingFaceProvider())
+
+    fallback: Optional[AsyncImageProviderInterface] = None
+    fallback_class = PROVIDERS.get(SETTINGS_MANAGER.image_generator.fallback_provider)
+    if fallback_class is not None:
+        fallback = fallback_class()
+
+    return HedgedImageGenerator(
+        providers,
+        hedge_percentile=SETTINGS_MANAGER.image_generator.hedge_percentile,
+        fallback=fallback,
+        max_budget_wait_seconds=(
+            SETTINGS_MANAGER.image_generator.max_budget_wait_minutes * 60
+        ),
+    )
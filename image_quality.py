@@ -0,0 +1,89 @@
+"""Contains ImageQualityGate that rejects blank and broken generated images"""
+
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageStat
+
+
+class ImageQualityGate:
+    """Rejects NSFW-filtered (all black), flat and tiny error images.
+    Checks are based on payload size, image dimensions and pixel statistics
+    of a downscaled grayscale copy, and run in a worker pool"""
+
+    def __init__(
+        self,
+        min_bytes: int = 8 * 1024,
+        min_side: int = 256,
+        black_mean: float = 10,
+        flat_stddev: float = 4,
+        workers: int = 2,
+    ) -> None:
+        """
+        Args:
+            min_bytes (int, optional): minimal payload size. Defaults to 8 KiB.
+            min_side (int, optional): minimal image side in pixels. Defaults to 256.
+            black_mean (float, optional): mean brightness below which a flat image
+            is considered black. Defaults to 10.
+            flat_stddev (float, optional): brightness deviation below which
+            an image is considered flat. Defaults to 4.
+            workers (int, optional): worker pool size. Defaults to 2.
+        """
+        self.min_bytes = min_bytes
+        self.min_side = min_side
+        self.black_mean = black_mean
+        self.flat_stddev = flat_stddev
+        self.stats_size = (64, 64)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="image-quality"
+        )
+
+    def check(self, image: bytes) -> str:
+        """Checks the image
+
+        Args:
+            image (bytes): raw image
+
+        Returns:
+            str: rejection reason, empty if the image is fine
+        """
+        if len(image) < self.min_bytes:
+            return "too small payload"
+
+        try:
+            with Image.open(io.BytesIO(image)) as decoded:
+                width, height = decoded.size
+                if min(width, height) < self.min_side:
+                    return "too small image"
+
+                # decoding at a reduced scale is much cheaper for jpeg
+                decoded.draft("L", self.stats_size)
+                grayscale = decoded.convert("L")
+                grayscale.thumbnail(self.stats_size)
+        except BaseException:  # pylint: disable=W0718
+            return "undecodable image"
+
+        stat = ImageStat.Stat(grayscale)
+        mean, stddev = stat.mean[0], stat.stddev[0]
+        if stddev < self.flat_stddev:
+            return "blank image" if mean < self.black_mean else "flat image"
+
+        return ""
+
+    async def check_async(self, image: bytes) -> str:
+        """Checks the image in the worker pool without blocking the event loop
+
+        Args:
+            image (bytes): raw image
+
+        Returns:
+            str: rejection reason, empty if the image is fine
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.check, image
+        )
+
+
+QUALITY_GATE = ImageQualityGate()
@@ -0,0 +1,121 @@
+"""Contains ImageTranscoder that shrinks generated images before saving"""
+
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from PIL import Image
+
+from settings import SETTINGS_MANAGER
+
+
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+
+def _detect_extension(image: bytes) -> str:
+    try:
+        with Image.open(io.BytesIO(image)) as decoded:
+            return EXTENSIONS.get(decoded.format or "", "png")
+    except BaseException:  # pylint: disable=W0718
+        return "png"
+
+
+def transcode(
+    image: bytes, max_dimension: int, image_format: str, quality: int
+) -> tuple[bytes, str]:
+    """Resizes the image to fit max_dimension and re-encodes it.
+    Runs in worker threads, so it only depends on its arguments
+
+    Args:
+        image (bytes): raw image
+        max_dimension (int): maximal width and height
+        image_format (str): target format (JPEG, WEBP or PNG)
+        quality (int): lossy encoding quality
+
+    Returns:
+        tuple[bytes, str]: (image, file extension). The original image is returned
+        if it can not be decoded or the result is not smaller
+    """
+    try:
+        with Image.open(io.BytesIO(image)) as decoded:
+            decoded.draft("RGB", (max_dimension, max_dimension))
+            converted = decoded.convert("RGB")
+    except BaseException:  # pylint: disable=W0718
+        return image, "png"
+
+    converted.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if image_format == "WEBP":
+        converted.save(buffer, format="WEBP", quality=quality, method=4)
+    elif image_format == "PNG":
+        converted.save(buffer, format="PNG", optimize=True)
+    else:
+        image_format = "JPEG"
+        converted.save(
+            buffer, format="JPEG", quality=quality, optimize=True, progressive=True
+        )
+
+    result = buffer.getvalue()
+    if len(result) >= len(image):
+        return image, _detect_extension(image)
+    return result, EXTENSIONS[image_format]
+
+
+class ImageTranscoder:
+    """Transcodes images in a thread pool according to image_transcoding settings.
+    Pillow releases the GIL while decoding, resizing and encoding, so threads
+    run in parallel without a process pool re-importing the bot in every worker"""
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="image-transcoder"
+            )
+        return self._executor
+
+    def __init__(self, workers: int = 2) -> None:
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def is_enabled(self) -> bool:
+        """Whether images should be transcoded or saved as they are
+
+        Returns:
+            bool: should transcode or not
+        """
+        return SETTINGS_MANAGER.image_transcoding.enabled
+
+    async def transcode(self, image: bytes) -> tuple[bytes, str]:
+        """Transcodes the image without blocking the event loop
+
+        Args:
+            image (bytes): raw image
+
+        Returns:
+            tuple[bytes, str]: (image, file extension)
+        """
+        settings = SETTINGS_MANAGER.image_transcoding
+        if len(image) == 0:
+            return image, "png"
+        if not settings.enabled:
+            return image, _detect_extension(image)
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(),
+            transcode,
+            image,
+            settings.max_dimension,
+            settings.image_format,
+            settings.quality,
+        )
+
+    def shutdown(self):
+        """Stops the worker threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+TRANSCODER = ImageTranscoder()
@@ -0,0 +1,245 @@
+"""Contains JobManager that runs owner actions in the background"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from logger import LOGGER
+
+
+ProgressGetter = Callable[[], tuple[int, int]]
+
+
+class Job:
+    """Background job with its state and progress"""
+
+    def __init__(
+        self,
+        job_id: int,
+        name: str,
+        progress: Optional[ProgressGetter] = None,
+        on_cancel: Optional[Callable[[], Any]] = None,
+        cancellable: bool = True,
+    ) -> None:
+        self.job_id = job_id
+        self.name = name
+        self.state = "queued"
+        self.error = ""
+        self.result: Any = None
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+        self._progress = progress
+        self._on_cancel = on_cancel
+        self._cancellable = cancellable
+
+    def is_finished(self) -> bool:
+        """Checks whether the job is done, failed or cancelled
+
+        Returns:
+            bool: True if finished, otherwise False
+        """
+        return self.state in ("done", "failed", "cancelled")
+
+    def get_progress(self) -> Optional[tuple[int, int]]:
+        """Returns progress of the job
+
+        Returns:
+            Optional[tuple[int, int]]: (done, total) items, None if not tracked
+        """
+        if self._progress is None:
+            return None
+        try:
+            return self._progress()
+        except BaseException:  # pylint: disable=W0718
+            return None
+
+    def get_eta(self) -> Optional[float]:
+        """Estimates the time left based on the rate of done items
+
+        Returns:
+            Optional[float]: seconds left, None if can not be estimated
+        """
+        progress = self.get_progress()
+        if self.state != "running" or self.started_at is None or progress is None:
+            return None
+        done, total = progress
+        if done <= 0 or total <= done:
+            return None
+        return (time.monotonic() - self.started_at) / done * (total - done)
+
+    def can_cancel(self) -> bool:
+        """Checks whether the job can be cancelled. Work that runs in a thread
+        can not be stopped, so such jobs are cancellable only while queued
+
+        Returns:
+            bool: True if cancellable, otherwise False
+        """
+        if self.is_finished() or self.task is None:
+            return False
+        return self.state == "queued" or self._cancellable
+
+    def cancel(self) -> bool:
+        """Cancels the queued or running job
+
+        Returns:
+            bool: True if the job was cancelled, otherwise False
+        """
+        if not self.can_cancel():
+            return False
+
+        if self.state == "running" and self._on_cancel is not None:
+            self._on_cancel()
+        self.task.cancel()
+        return True
+
+    def get_status(self) -> str:
+        """Returns human readable status of the job
+
+        Returns:
+            str: status
+        """
+        status = f"#{self.job_id} {self.name}: {self.state}"
+
+        if self.started_at is not None:
+            finished_at = self.finished_at or time.monotonic()
+            status += f", {finished_at - self.started_at:.0f}s"
+
+        progress = self.get_progress()
+        if progress is not None and progress[1] > 0:
+            status += f", {progress[0]}/{progress[1]} items"
+
+        eta = self.get_eta()
+        if eta is not None:
+            status += f", ETA {eta:.0f}s"
+
+        if self.error:
+            status += f"\nerror: {self.error}"
+        return status
+
+
+class JobManager:
+    """Runs owner actions as background jobs.
+    Every submitted job gets an id at once, at most max_running jobs
+    run at the same time, the others wait in the queue"""
+
+    def __init__(self, max_running: int = 2, max_history: int = 20) -> None:
+        self.max_running = max_running
+        self.max_history = max_history
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs: OrderedDict[int, Job] = OrderedDict()
+        self._next_id = 1
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # created lazily to be bound to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_running)
+        return self._semaphore
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished()]
+        for job_id in finished[: max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
+
+    async def _run(
+        self,
+        job: Job,
+        action: Callable[[], Awaitable[Any]],
+        on_finish: Optional[Callable[[Job], Awaitable[Any]]],
+    ):
+        try:
+            async with self._get_semaphore():
+                job.state = "running"
+                job.started_at = time.monotonic()
+                job.result = await action()
+            job.state = "done"
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+        except BaseException as e:  # pylint: disable=W0718
+            job.state = "failed"
+            job.error = str(e) or type(e).__name__
+            LOGGER.log(f"Job {job.name} #{job.job_id} failed: {job.error}", "Error")
+        finally:
+            job.finished_at = time.monotonic()
+
+        if on_finish is not None:
+            try:
+                await on_finish(job)
+            except BaseException as e:  # pylint: disable=W0718
+                LOGGER.log(f"Job #{job.job_id} notification failed: {e}", "Error")
+
+    def submit(
+        self,
+        name: str,
+        action: Callable[[], Awaitable[Any]],
+        progress: Optional[ProgressGetter] = None,
+        on_finish: Optional[Callable[[Job], Awaitable[Any]]] = None,
+        on_cancel: Optional[Callable[[], Any]] = None,
+        cancellable: bool = True,
+    ) -> Job:
+        """Submits the action to run in the background
+
+        Args:
+            name (str): job name
+            action (Callable[[], Awaitable[Any]]): job coroutine factory
+            progress (Optional[ProgressGetter]): returns (done, total) items.
+            Defaults to None.
+            on_finish (Optional[Callable[[Job], Awaitable[Any]]]): called when
+            the job is finished, e.g. to notify the owner. Defaults to None.
+            on_cancel (Optional[Callable[[], Any]]): stops the work shared
+            with other callers on cancel. Defaults to None.
+            cancellable (bool, optional): whether the running job can be stopped.
+            Defaults to True.
+
+        Returns:
+            Job: submitted job
+        """
+        job = Job(self._next_id, name, progress, on_cancel, cancellable)
+        self._next_id += 1
+
+        job.task = asyncio.create_task(self._run(job, action, on_finish))
+        self._jobs[job.job_id] = job
+        self._forget_finished()
+        return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """Returns the job
+
+        Args:
+            job_id (int): job id
+
+        Returns:
+            Optional[Job]: job, None if there is no such job
+        """
+        return self._jobs.get(job_id, None)
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancels the queued or running job
+
+        Args:
+            job_id (int): job id
+
+        Returns:
+            bool: True if the job was cancelled, otherwise False
+        """
+        job = self._jobs.get(job_id, None)
+        if job is None:
+            return False
+        return job.cancel()
+
+    def get_report(self) -> str:
+        """Returns statuses of the recent jobs
+
+        Returns:
+            str: one block per job
+        """
+        if len(self._jobs) == 0:
+            return "No jobs yet"
+        return "\n\n".join(job.get_status() for job in self._jobs.values())
+
+
+JOB_MANAGER = JobManager()
@@ -19,6 +19,7 @@ def get_basic_markup(tg_id: int) -> types.ReplyKeyboardMarkup:
 
     if SETTINGS_MANAGER.is_subscribed(tg_id):
         commands.append("ОТПИСАТЬСЯ")
+        commands.append("ВРЕМЯ РАССЫЛКИ")
     else:
         commands.append("ПОДПИСАТЬСЯ")
 
@@ -63,6 +64,11 @@ def get_getters_markup(tg_id: int) -> types.ReplyKeyboardMarkup:
         "/should_translate_prompt",
         "/image_styles",
         "/available_image_styles",
+        "/image_providers",
+        "/budget",
+        "/gallery_usage",
+        "/broadcast",
+        "/day_queue",
     ]
 
     builder = ReplyKeyboardBuilder()
@@ -129,6 +135,8 @@ def get_actions_markup(tg_id: int) -> types.ReplyKeyboardMarkup:
         "/post",
         "/post_to_owner",
         "/clean",
+        "/jobs",
+        "/cancel_job",
     ]
 
     builder = ReplyKeyboardBuilder()
@@ -157,6 +165,7 @@ def get_dev_actions_markup(tg_id: int) -> types.ReplyKeyboardMarkup:
 
     commands = [
         "/scrap_n_post_sample",
+        "/scrap_metrics",
     ]
 
     builder = ReplyKeyboardBuilder()
@@ -0,0 +1,122 @@
+"""Contains LeaderLease that elects the bot replica running the timer jobs"""
+
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Optional
+
+
+class LeaderLease:
+    """Lease-based leader election over a SQLite row shared by the replicas.
+    The leader renews the lease well before it expires. When the leader dies,
+    its lease expires and a standby takes it over within lease_seconds.
+    A renewal that fails on a database error does not end the leadership,
+    the leader stays one until its own lease expires"""
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(
+                self.path,
+                timeout=self.lease_seconds / 2,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def __init__(
+        self,
+        name: str = "scheduler",
+        path: str = os.path.join(".", "storage", "leader.sqlite"),
+        lease_seconds: float = 30,
+    ) -> None:
+        self.name = name
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._connection: Optional[sqlite3.Connection] = None
+        # end of the lease held by this replica, no other one can take it before
+        self._expires_at = 0.0
+        self.last_error: Optional[str] = None
+
+    def get_renew_period(self) -> float:
+        """Returns how often the lease should be renewed
+
+        Returns:
+            float: seconds
+        """
+        return self.lease_seconds / 3
+
+    def try_acquire(self) -> bool:
+        """Takes the lease if it is free or expired, renews it if it is ours
+
+        Returns:
+            bool: True if this replica is the leader, otherwise False
+        """
+        now = time.time()
+        try:
+            connection = self._get_connection()
+            # the write lock is taken at once, so two replicas can not both win
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    "SELECT holder, expires_at FROM leases WHERE name = ?",
+                    (self.name,),
+                ).fetchall()
+                if rows and rows[0][0] != self.holder and rows[0][1] > now:
+                    connection.execute("ROLLBACK")
+                    self._expires_at = 0.0
+                    self.last_error = None
+                    return False
+                connection.execute(
+                    "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                    (self.name, self.holder, now + self.lease_seconds),
+                )
+                connection.execute("COMMIT")
+                self._expires_at = now + self.lease_seconds
+                self.last_error = None
+                return True
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self.last_error = str(e)
+            # no other replica can take the lease until it expires
+            return now < self._expires_at
+
+    def get_leader(self) -> Optional[str]:
+        """Returns the current lease holder
+
+        Returns:
+            Optional[str]: holder id, None if the lease is free or expired
+        """
+        try:
+            rows = (
+                self._get_connection()
+                .execute(
+                    "SELECT holder FROM leases WHERE name = ? AND expires_at > ?",
+                    (self.name, time.time()),
+                )
+                .fetchall()
+            )
+        except sqlite3.Error:
+            return None
+        return rows[0][0] if rows else None
+
+    def release(self):
+        """Gives the lease up, so a standby takes over at once"""
+        self._expires_at = 0.0
+        try:
+            self._get_connection().execute(
+                "DELETE FROM leases WHERE name = ? AND holder = ?",
+                (self.name, self.holder),
+            )
+        except sqlite3.Error:
+            pass
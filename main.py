@@ -2,6 +2,7 @@
 
 import grequests
 
+import argparse
 import asyncio
 import logging
 
@@ -18,8 +19,19 @@ bot = Bot(token=SECRETS_MANAGER.get_bot_token())
 dp = Dispatcher()
 
 
-async def main():
-    """Main function"""
+async def main(mode: str):
+    """Main function
+
+    Args:
+        mode (str): "all" runs the whole bot, "producer" only builds and publishes
+        day bundles, "delivery" receives them, posts and serves the commands
+    """
+    if mode == "producer":
+        SCHEDULER.start(bot, mode)
+        # nothing to poll, the timer jobs run until the service is stopped
+        await asyncio.Event().wait()
+        return
+
     dp.include_routers(
         setters.router,
         getters.router,
@@ -28,9 +40,16 @@ async def main():
         subscription.router,
         basic.router,
     )
-    SCHEDULER.start(bot)
+    SCHEDULER.start(bot, mode)
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mode",
+        choices=("all", "producer", "delivery"),
+        default="all",
+        help="run the whole bot or one of its services",
+    )
+    asyncio.run(main(parser.parse_args().mode))
@@ -0,0 +1,121 @@
+"""Migrates daily CSV files, the gallery index and subscribers into the SQLite
+database and enables it. Safe to run more than once
+
+Usage:
+    python migrate_to_sqlite.py
+"""
+
+import csv
+import json
+import os
+
+from database import DATABASE
+from logger import LOGGER
+from settings import SETTINGS_MANAGER
+
+
+def migrate_days(storage_path: str = os.path.join(".", "storage")) -> int:
+    """Copies dd-mm-yy.csv files into the days and holidays tables
+
+    Args:
+        storage_path (str, optional): storage folder. Defaults to ./storage.
+
+    Returns:
+        int: migrated days number
+    """
+    days = 0
+    for file in sorted(os.listdir(storage_path)):
+        day, file_extension = os.path.splitext(file)
+        # checkpoints of unfinished scraps are kept as files
+        if file_extension != ".csv" or "." in day:
+            continue
+        file_path = os.path.join(storage_path, file)
+        with open(file_path, "r", newline="", encoding="utf-8") as f:
+            rows = [row for row in csv.reader(f) if len(row) == 2]
+
+        with DATABASE.transaction() as connection:
+            connection.execute("DELETE FROM days WHERE day = ?", (day,))
+            connection.execute(
+                "INSERT INTO days VALUES (?, ?)", (day, os.path.getmtime(file_path))
+            )
+            connection.executemany(
+                "INSERT INTO holidays VALUES (?, ?, ?, ?)",
+                [
+                    (day, idx, title, image_path)
+                    for idx, (title, image_path) in enumerate(rows)
+                ],
+            )
+        days += 1
+    return days
+
+
+def migrate_images(
+    index_path: str = os.path.join(".", "gallery", "index.json"),
+    journal_path: str = os.path.join(".", "gallery", "index.journal"),
+) -> int:
+    """Copies the gallery index and its journal into the images table
+
+    Args:
+        index_path (str, optional): gallery index. Defaults to ./gallery/index.json.
+        journal_path (str, optional): blobs added after the last index save.
+        Defaults to ./gallery/index.journal.
+
+    Returns:
+        int: migrated images number
+    """
+    if not os.path.isfile(index_path):
+        return 0
+    with open(index_path, encoding="utf8") as index_file:
+        index: dict[str, dict] = json.load(index_file)
+    if os.path.isfile(journal_path):
+        with open(journal_path, encoding="utf8") as journal_file:
+            for line in journal_file:
+                try:
+                    index.update(json.loads(line))
+                except ValueError:
+                    continue
+
+    with DATABASE.transaction() as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?)",
+            [
+                (blob_name, entry["size"], entry["last_used"])
+                for blob_name, entry in index.items()
+            ],
+        )
+    return len(index)
+
+
+def migrate_subscribers() -> int:
+    """Copies subscribers from the settings into the subscribers table
+
+    Returns:
+        int: migrated subscribers number
+    """
+    with DATABASE.transaction() as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO subscribers VALUES (?, ?, ?, ?, ?)",
+            [subscriber.as_row() for subscriber in SETTINGS_MANAGER.subscribers],
+        )
+    return len(SETTINGS_MANAGER.subscribers)
+
+
+def main():
+    """Runs the migration"""
+    if SETTINGS_MANAGER.database.enabled:
+        LOGGER.log("Database is already enabled, nothing to migrate")
+        return
+
+    days = migrate_days()
+    images = migrate_images()
+    subscribers = migrate_subscribers()
+    SETTINGS_MANAGER.set_database_enabled(True)
+
+    LOGGER.log(
+        f"Migrated {days} days, {images} images and {subscribers} subscribers "
+        f"into {DATABASE.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Contains streaming Pipeline built from async worker pools and bounded queues"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from logger import LOGGER
+
+
+StageHandler = Callable[[Any], Awaitable[Any]]
+StageFallback = Callable[[Any], Any]
+
+
+class _StopSignal:
+    """Queue sentinel that tells a stage worker to exit"""
+
+
+_STOP = _StopSignal()
+
+
+class StageMetrics:
+    """Per-stage throughput and queue-depth metrics"""
+
+    def __init__(self, name: str, workers: int, queue_size: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self.processed = 0
+        self.failed = 0
+        self.degraded = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.queue_depth = 0
+
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def observe_queue_depth(self, depth: int):
+        """Updates the current and peak queue depth
+
+        Args:
+            depth (int): current queue size
+        """
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    @property
+    def elapsed_seconds(self) -> float:
+        """Wall time between the first taken item and the stage shutdown"""
+        if self.started_at is None:
+            return 0.0
+        finished_at = self.finished_at or time.monotonic()
+        return finished_at - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """Processed items per second of stage wall time"""
+        elapsed = self.elapsed_seconds
+        if elapsed <= 0:
+            return 0.0
+        return self.processed / elapsed
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "degraded": self.degraded,
+            "dropped": self.dropped,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "throughput": round(self.throughput, 3),
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_size": self.queue_size,
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.processed} done, {self.failed} failed, "
+            f"{self.degraded} degraded, "
+            f"{self.throughput:.2f} items/s, "
+            f"queue {self.queue_depth}/{self.queue_size} (max {self.max_queue_depth})"
+        )
+
+
+class Stage:
+    """Pipeline stage: a pool of workers applying the same handler"""
+
+    def __init__(
+        self,
+        name: str,
+        handler: StageHandler,
+        workers: int = 1,
+        queue_size: int = 0,
+        fallback: Optional[StageFallback] = None,
+    ) -> None:
+        """
+        Args:
+            name (str): stage name used in logs and metrics
+            handler (StageHandler): coroutine function transforming one item.
+            If it returns None, the item is dropped from the pipeline
+            workers (int, optional): number of concurrent workers. Defaults to 1.
+            queue_size (int, optional): input queue bound. If set to 0,
+            then 2 * workers is used. Defaults to 0.
+            fallback (Optional[StageFallback], optional): function making
+            a degraded item of the one the handler failed on, it is passed on
+            instead. If not set, the failed item is dropped. Defaults to None.
+        """
+        self.name = name
+        self.handler = handler
+        self.fallback = fallback
+        self.workers = max(1, workers)
+        self.queue_size = queue_size if queue_size > 0 else 2 * self.workers
+
+
+class Pipeline:
+    """Streams items through stages linked by bounded queues"""
+
+    def __init__(self, stages: list[Stage]) -> None:
+        self.stages = stages
+        self.metrics = [
+            StageMetrics(stage.name, stage.workers, stage.queue_size)
+            for stage in stages
+        ]
+
+    async def _put(self, stage_idx: int, queue: asyncio.Queue, item: Any):
+        await queue.put(item)
+        if item is not _STOP:
+            self.metrics[stage_idx].observe_queue_depth(queue.qsize())
+
+    async def _feed(self, items: Iterable, queue: asyncio.Queue):
+        for item in items:
+            await self._put(0, queue, item)
+        for _ in range(self.stages[0].workers):
+            await queue.put(_STOP)
+
+    async def _work(
+        self,
+        stage_idx: int,
+        input_queue: asyncio.Queue,
+        output_queue: Optional[asyncio.Queue],
+        results: list,
+    ):
+        stage = self.stages[stage_idx]
+        metrics = self.metrics[stage_idx]
+
+        while True:
+            item = await input_queue.get()
+            metrics.observe_queue_depth(input_queue.qsize())
+            if item is _STOP:
+                return
+
+            if metrics.started_at is None:
+                metrics.started_at = time.monotonic()
+
+            start_time = time.monotonic()
+            try:
+                result = await stage.handler(item)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:  # pylint: disable=W0718
+                LOGGER.log(f"Pipeline stage '{stage.name}' failed: {e}", "Error")
+                if stage.fallback is None:
+                    metrics.failed += 1
+                    continue
+                result = stage.fallback(item)
+                metrics.degraded += 1
+            else:
+                if result is None:
+                    metrics.dropped += 1
+                    continue
+                metrics.processed += 1
+            finally:
+                metrics.busy_seconds += time.monotonic() - start_time
+
+            if output_queue is None:
+                results.append(result)
+            else:
+                await self._put(stage_idx + 1, output_queue, result)
+
+    async def _run_stage(
+        self,
+        stage_idx: int,
+        input_queue: asyncio.Queue,
+        output_queue: Optional[asyncio.Queue],
+        results: list,
+    ):
+        await asyncio.gather(
+            *[
+                self._work(stage_idx, input_queue, output_queue, results)
+                for _ in range(self.stages[stage_idx].workers)
+            ]
+        )
+        self.metrics[stage_idx].finished_at = time.monotonic()
+
+        if output_queue is not None:
+            for _ in range(self.stages[stage_idx + 1].workers):
+                await output_queue.put(_STOP)
+
+    async def run(self, items: Iterable) -> list:
+        """Streams items through all the stages
+
+        Args:
+            items (Iterable): source items for the first stage
+
+        Returns:
+            list: outputs of the last stage in completion order
+        """
+        if len(self.stages) == 0:
+            return list(items)
+
+        queues: list[asyncio.Queue] = [
+            asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages
+        ]
+        results: list = []
+
+        tasks = [asyncio.create_task(self._feed(items, queues[0]))]
+        for i in range(len(self.stages)):
+            output_queue = queues[i + 1] if i + 1 < len(queues) else None
+            tasks.append(
+                asyncio.create_task(
+                    self._run_stage(i, queues[i], output_queue, results)
+                )
+            )
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        return results
+
+    def get_metrics(self) -> list[dict]:
+        """Returns metrics of every stage
+
+        Returns:
+            list[dict]: stage metrics in pipeline order
+        """
+        return [metrics.as_dict() for metrics in self.metrics]
+
+    def get_metrics_report(self) -> str:
+        """Returns human readable metrics of every stage
+
+        Returns:
+            str: one line per stage
+        """
+        return "\n".join(str(metrics) for metrics in self.metrics)
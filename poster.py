@@ -1,80 +1,180 @@
 """Contains Poster that posts holidays to the bot"""
 import asyncio
-from typing import List
+from typing import List, Optional, Union
 
 from aiogram import Bot
-from aiogram.types import BufferedInputFile
+from aiogram.types import FSInputFile, ReplyKeyboardMarkup
 
+from database import Database
+from gallery import GALLERY
 from holiday import Holiday
 from keyboards.basic import get_basic_markup
 from logger import LOGGER
+from rate_limiter import SharedTokenBucket, TokenBucket
 
 from settings import SETTINGS_MANAGER, PostReceivers
-from storage import STORAGE
+from storage import STORAGE, DayBundle
 
 
 class Poster:
-    """Posts holidays to subscribers"""
+    """Posts holidays to subscribers.
+    Deliveries are recorded in the bot database, or in delivery_database
+    if it is given, e.g. by broadcast workers that must not depend on it"""
 
-    def __init__(self, bot: Bot) -> None:
+    def __init__(
+        self,
+        bot: Bot,
+        rate_limiter: Optional[Union[TokenBucket, SharedTokenBucket]] = None,
+        delivery_database: Optional[Database] = None,
+    ) -> None:
         self._bot = bot
         self._send_messages_delay_seconds: float = 0.2
+        self._rate_limiter = rate_limiter
+        self._delivery_database = delivery_database
+
+        self.progress_done = 0
+        self.progress_total = 0
+
+    async def _send_holiday(
+        self,
+        receiver_id: int,
+        holiday: Holiday,
+        bundle: DayBundle,
+        markup: ReplyKeyboardMarkup,
+    ):
+        if not bundle.has_image(holiday):
+            await self._bot.send_message(
+                receiver_id,
+                holiday.emoji_title,
+                reply_markup=markup,
+            )
+            return
+
+        file_id = bundle.file_ids.get(holiday.image_path, None)
+        if file_id is not None:
+            await self._bot.send_photo(
+                receiver_id,
+                file_id,
+                caption=holiday.emoji_title,
+                reply_markup=markup,
+            )
+            return
+
+        # the image is streamed from the disk only for its first upload
+        message = await self._bot.send_photo(
+            receiver_id,
+            FSInputFile(holiday.image_path),
+            caption=holiday.emoji_title,
+            reply_markup=markup,
+        )
+        if message.photo:
+            bundle.file_ids[holiday.image_path] = message.photo[-1].file_id
+
+    async def _throttle(self):
+        if self._rate_limiter is None:
+            await asyncio.sleep(self._send_messages_delay_seconds)
+        else:
+            await self._rate_limiter.acquire()
 
     async def _post(
         self,
-        holidays: List[Holiday],
+        bundle: DayBundle,
         receivers: List[PostReceivers],
+        skip_delivered: bool = False,
     ):
         """Posts holidays to subscribers
 
         Args:
-            holidays (list[Holiday]): list of holidays to post
+            bundle (DayBundle): day data with holidays to post
             receivers (list[Subscriber]): list of receivers to post to
+            skip_delivered (bool, optional): do not post the holidays recorded
+            as delivered to the receiver. Defaults to False.
         """
+        holidays = bundle.holidays
+        for image_path in bundle.image_paths:
+            GALLERY.touch_image(image_path)
+
+        self.progress_done = 0
+        self.progress_total = len(receivers)
+
         for subscriber in receivers:
             subscriber_markup = get_basic_markup(subscriber.tg_id)
+            delivered = (
+                await asyncio.to_thread(
+                    STORAGE.get_delivered_titles,
+                    subscriber.tg_id,
+                    bundle.day,
+                    self._delivery_database,
+                )
+                if skip_delivered
+                else set()
+            )
             try:
                 for holiday in LOGGER.get_tqdm(
                     holidays,
                     total=len(holidays),
                     desc=f"Posting holidays to @{subscriber.tg_alias}",
                 ):
-                    if holiday.image is None:
-                        await self._bot.send_message(
-                            subscriber.tg_id,
-                            holiday.emoji_title,
-                            reply_markup=subscriber_markup,
-                        )
-                    else:
-                        await self._bot.send_photo(
-                            subscriber.tg_id,
-                            BufferedInputFile(
-                                holiday.image, filename=holiday.image_path
-                            ),
-                            caption=holiday.emoji_title,
-                            reply_markup=subscriber_markup,
-                        )
-
-                    await asyncio.sleep(self._send_messages_delay_seconds)
+                    if holiday.title in delivered:
+                        continue
+                    await self._send_holiday(
+                        subscriber.tg_id, holiday, bundle, subscriber_markup
+                    )
+                    await asyncio.to_thread(
+                        STORAGE.record_delivery,
+                        subscriber.tg_id,
+                        holiday,
+                        bundle.file_ids.get(holiday.image_path, ""),
+                        bundle.day,
+                        self._delivery_database,
+                    )
+
+                    await self._throttle()
+            except asyncio.CancelledError:
+                raise
             except BaseException:  # pylint: disable=W0718
                 continue
+            finally:
+                self.progress_done += 1
 
     async def post(self):
         """Posts holidays taken from storage to subscribers"""
 
-        if not STORAGE.is_today_file_exists():
+        if not await STORAGE.is_today_file_exists_async():
             raise FileNotFoundError()
 
         await self._post(
-            STORAGE.get_today_data(), SETTINGS_MANAGER.get_subscribers_as_receivers()
+            await STORAGE.get_today_bundle_async(),
+            SETTINGS_MANAGER.get_subscribers_as_receivers(),
         )
 
+    async def post_shard(self, bundle: DayBundle, receivers: List[PostReceivers]):
+        """Posts the day's holidays to the receivers of a broadcast shard.
+        Deliveries recorded by a worker that held the shard before are skipped
+
+        Args:
+            bundle (DayBundle): day data with holidays to post
+            receivers (List[PostReceivers]): receivers of the shard
+        """
+        await self._post(bundle, receivers, skip_delivered=True)
+
+    async def post_slot(self, bundle: DayBundle, receivers: List[PostReceivers]):
+        """Posts the day's holidays to the receivers of a delivery slot whose
+        local day it is. Holidays already delivered to a receiver are skipped
+
+        Args:
+            bundle (DayBundle): day data with holidays to post
+            receivers (List[PostReceivers]): receivers of the slot
+        """
+        await self._post(bundle, receivers, skip_delivered=True)
+
     async def post_to_owner(self):
         """Posts holidays taken from storage to subscribers"""
 
-        if not STORAGE.is_today_file_exists():
+        if not await STORAGE.is_today_file_exists_async():
             raise FileNotFoundError()
 
         await self._post(
-            STORAGE.get_today_data(), [SETTINGS_MANAGER.get_owner_as_receiver()]
+            await STORAGE.get_today_bundle_async(),
+            [SETTINGS_MANAGER.get_owner_as_receiver()],
         )
@@ -0,0 +1,26 @@
+"""Runs a poster worker that delivers broadcast shards claimed from the shared
+queue. Start several workers next to the bot to raise the broadcast rate
+
+Usage:
+    python poster_worker.py
+"""
+
+import asyncio
+
+from aiogram import Bot
+
+from broadcast import BroadcastWorker
+from local_secrets import SECRETS_MANAGER
+
+
+async def main():
+    """Main function"""
+    bot = Bot(token=SECRETS_MANAGER.get_bot_token())
+    try:
+        await BroadcastWorker(bot).run_forever()
+    finally:
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
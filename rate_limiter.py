@@ -0,0 +1,182 @@
+"""Contains asynchronous rate limiter implementations"""
+
+import asyncio
+import os
+import time
+
+from database import Database
+
+
+SHARED_BUCKETS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class TokenBucket:
+    """Asynchronous token bucket rate limiter"""
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def __init__(self, rate_per_second: float, capacity: float = 1) -> None:
+        """
+        Args:
+            rate_per_second (float): tokens added per second
+            capacity (float, optional): maximal burst size. Defaults to 1.
+        """
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, rate_per_minute: float, capacity: float = 1) -> "TokenBucket":
+        """Creates the bucket from the per-minute rate
+
+        Args:
+            rate_per_minute (float): tokens added per minute
+            capacity (float, optional): maximal burst size. Defaults to 1.
+
+        Returns:
+            TokenBucket
+        """
+        return cls(rate_per_minute / 60, capacity)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Takes tokens if they are available right now
+
+        Args:
+            tokens (float, optional): tokens to take. Defaults to 1.
+
+        Returns:
+            bool: True if tokens were taken, otherwise False
+        """
+        self._refill()
+        if self._lock.locked() or self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    async def acquire(self, tokens: float = 1):
+        """Waits until tokens are available and takes them.
+        Waiters are served in the arrival order
+
+        Args:
+            tokens (float, optional): tokens to take. Defaults to 1.
+        """
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class SharedTokenBucket:
+    """Token bucket kept in a SQLite file, so it limits the total rate
+    of all the processes using the same bucket, e.g. of poster workers"""
+
+    def __init__(
+        self,
+        database: Database,
+        name: str,
+        rate_per_second: float,
+        capacity: float = 1,
+    ) -> None:
+        """
+        Args:
+            database (Database): database with the buckets table
+            name (str): bucket name
+            rate_per_second (float): tokens added per second
+            capacity (float, optional): maximal burst size. Defaults to 1.
+        """
+        self.database = database
+        self.name = name
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+
+    def _take(self, tokens: float) -> tuple[bool, float]:
+        now = time.time()
+        with self.database.transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?)",
+                (self.name, self.capacity, now),
+            )
+            # single statement, so concurrent processes can not both take a token
+            taken = connection.execute(
+                "UPDATE buckets SET "
+                "tokens = MIN(:capacity, tokens + (:now - updated) * :rate) - :take, "
+                "updated = :now "
+                "WHERE name = :name "
+                "AND MIN(:capacity, tokens + (:now - updated) * :rate) >= :take",
+                {
+                    "capacity": self.capacity,
+                    "now": now,
+                    "rate": self.rate,
+                    "take": tokens,
+                    "name": self.name,
+                },
+            ).rowcount
+            if taken == 1:
+                return True, 0.0
+            row = connection.execute(
+                "SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+
+        available = min(self.capacity, row[0] + (now - row[1]) * self.rate)
+        return False, max(0.0, tokens - available) / self.rate
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Takes tokens if they are available right now
+
+        Args:
+            tokens (float, optional): tokens to take. Defaults to 1.
+
+        Returns:
+            bool: True if tokens were taken, otherwise False
+        """
+        return self._take(tokens)[0]
+
+    async def acquire(self, tokens: float = 1):
+        """Waits until tokens are available and takes them
+
+        Args:
+            tokens (float, optional): tokens to take. Defaults to 1.
+        """
+        while True:
+            taken, wait_seconds = await asyncio.to_thread(self._take, tokens)
+            if taken:
+                return
+            await asyncio.sleep(wait_seconds)
+
+
+# buckets of the image providers, shared by every generator of every process
+RATE_LIMITS_DATABASE = Database(
+    os.path.join(".", "storage", "rate_limits.db"), schema=SHARED_BUCKETS_SCHEMA
+)
+
+
+def get_provider_rate_limiter(name: str, rate_per_minute: float) -> SharedTokenBucket:
+    """Returns the rate limiter of the image provider. Generators of the scrap
+    and the lookahead, also in worker processes, take from the same bucket,
+    so together they stay within the provider rate
+
+    Args:
+        name (str): provider name
+        rate_per_minute (float): tokens added per minute
+
+    Returns:
+        SharedTokenBucket
+    """
+    return SharedTokenBucket(RATE_LIMITS_DATABASE, name, rate_per_minute / 60)
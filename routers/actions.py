@@ -1,17 +1,52 @@
 """Contains developer action handlers"""
 
-from aiogram import Bot, Router
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+from aiogram import Bot, F, Router
 from aiogram import types
 from aiogram.filters.command import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from keyboards.basic import get_actions_markup
 
-from scheduler import SCHEDULER
+from job_manager import JOB_MANAGER, Job, ProgressGetter
+from scheduler import SCHEDULER, SCRAP_REFUSED_MESSAGE
 from routers.utils import check_message_ownership
 
 
 router = Router()
 
 
+class CancelJob(StatesGroup):
+    """CancelJob FSA class"""
+
+    job_id = State()
+
+
+def _submit_job(
+    bot: Bot,
+    user_id: int,
+    name: str,
+    action: Callable[[], Awaitable[Any]],
+    progress: Optional[ProgressGetter] = None,
+    cancellable: bool = True,
+) -> Job:
+    async def notify(job: Job):
+        text = f"Job finished\n{job.get_status()}"
+        if isinstance(job.result, str) and job.result:
+            text += f"\n{job.result}"
+        await bot.send_message(user_id, text)
+
+    return JOB_MANAGER.submit(
+        name,
+        action,
+        progress=progress,
+        on_finish=notify,
+        on_cancel=lambda: SCHEDULER.cancel_job(name),
+        cancellable=cancellable,
+    )
+
+
 @router.message(Command("actions"))
 @check_message_ownership
 async def cmd_actions(message: types.Message, *args, **kwargs):  # pylint: disable=W0613
@@ -39,9 +74,19 @@ async def cmd_scrap(
 
     user_id: int = message.from_user.id  # type: ignore
 
-    await bot.send_message(user_id, "Start scrapping")
-    await SCHEDULER.scrap_wrapper()
-    await message.answer("Scrapping was successfully finished ")
+    if not SCHEDULER.can_scrap():
+        await message.answer(SCRAP_REFUSED_MESSAGE)
+        return
+
+    start_message = SCHEDULER.get_scrap_start_message()
+    job = _submit_job(
+        bot,
+        user_id,
+        "scrap",
+        SCHEDULER.scrap_wrapper,
+        SCHEDULER.get_scrap_progress,
+    )
+    await message.answer(f"{start_message}\nJob #{job.job_id}, see /jobs")
 
 
 @router.message(Command("scrap_force"))
@@ -57,9 +102,19 @@ async def cmd_scrap_force(
 
     user_id: int = message.from_user.id  # type: ignore
 
-    await bot.send_message(user_id, "Start force scrapping")
-    await SCHEDULER.scrap_wrapper(force=True)
-    await message.answer("Force scrapping was successfully finished ")
+    if not SCHEDULER.can_scrap():
+        await message.answer(SCRAP_REFUSED_MESSAGE)
+        return
+
+    start_message = SCHEDULER.get_scrap_start_message(force=True)
+    job = _submit_job(
+        bot,
+        user_id,
+        "scrap",
+        lambda: SCHEDULER.scrap_wrapper(force=True),
+        SCHEDULER.get_scrap_progress,
+    )
+    await message.answer(f"{start_message}\nJob #{job.job_id}, see /jobs")
 
 
 @router.message(Command("post"))
@@ -75,9 +130,15 @@ async def cmd_post(
 
     user_id: int = message.from_user.id  # type: ignore
 
-    await bot.send_message(user_id, "Start posting")
-    await SCHEDULER.post_wrapper()
-    await message.answer("Posting was successfully finished ")
+    start_message = await asyncio.to_thread(SCHEDULER.get_post_start_message)
+    job = _submit_job(
+        bot,
+        user_id,
+        "post",
+        SCHEDULER.post_wrapper,
+        SCHEDULER.get_post_progress,
+    )
+    await message.answer(f"{start_message}\nJob #{job.job_id}, see /jobs")
 
 
 @router.message(Command("post_to_owner"))
@@ -93,9 +154,15 @@ async def cmd_post_to_owner(
 
     user_id: int = message.from_user.id  # type: ignore
 
-    await bot.send_message(user_id, "Start posting")
-    await SCHEDULER.post_to_owner_wrapper()
-    await message.answer("Posting was successfully finished ")
+    start_message = SCHEDULER.get_start_message("post_to_owner", "Start posting")
+    job = _submit_job(
+        bot,
+        user_id,
+        "post_to_owner",
+        SCHEDULER.post_to_owner_wrapper,
+        SCHEDULER.get_post_progress,
+    )
+    await message.answer(f"{start_message}\nJob #{job.job_id}, see /jobs")
 
 
 @router.message(Command("clean"))
@@ -108,8 +175,79 @@ async def cmd_clean(
     Args:
         message (types.Mes sage): message object
     """
+
     user_id: int = message.from_user.id  # type: ignore
 
-    await bot.send_message(user_id, "Start cleaning")
-    SCHEDULER.clean_wrapper()
-    await message.answer("Cleaning was successfully finished ")
+    start_message = SCHEDULER.get_start_message("clean", "Start cleaning")
+    job = _submit_job(
+        bot,
+        user_id,
+        "clean",
+        lambda: asyncio.to_thread(SCHEDULER.clean_wrapper),
+        # the clean thread can not be stopped
+        cancellable=False,
+    )
+    await message.answer(f"{start_message}\nJob #{job.job_id}, see /jobs")
+
+
+@router.message(Command("jobs"))
+@check_message_ownership
+async def cmd_jobs(message: types.Message, *args, **kwargs):  # pylint: disable=W0613
+    """/jobs command handler
+
+    Args:
+        message (types.Message): message object
+    """
+
+    await message.answer(JOB_MANAGER.get_report())
+
+
+@router.message(Command("cancel_job"))
+@check_message_ownership
+async def cmd_cancel_job(
+    message: types.Message, state: FSMContext, *args, **kwargs
+):  # pylint: disable=W0613
+    """/cancel_job command handler
+
+    Args:
+        message (types.Message): message object
+        state (types.FSMContext): FSA state
+    """
+
+    await message.answer(
+        text=f"{JOB_MANAGER.get_report()}\n\nВведите id задачи для отмены"
+    )
+
+    await state.set_state(CancelJob.job_id)
+
+
+@router.message(CancelJob.job_id, F.text)
+@check_message_ownership
+async def cancel_job(
+    message: types.Message, state: FSMContext, *args, **kwargs
+):  # pylint: disable=W0613
+    """Final step of cancelling the job
+
+    Args:
+        message (types.Message): message object
+        state (types.FSMContext): FSA state
+    """
+
+    await state.clear()
+
+    try:
+        job_id = int(message.text.strip().lstrip("#"))  # type: ignore
+    except BaseException:  # pylint: disable=W0718
+        await message.answer(text="Error: input is unacceptable")
+        return
+
+    job = JOB_MANAGER.get(job_id)
+    if job is not None and not job.is_finished() and not job.can_cancel():
+        await message.answer(text=f"Job #{job_id} can not be cancelled while running")
+        return
+
+    if not JOB_MANAGER.cancel(job_id):
+        await message.answer(text=f"Job #{job_id} is not running")
+        return
+
+    await message.answer(text=f"Job #{job_id} was cancelled")
@@ -5,7 +5,7 @@ from aiogram import types
 from aiogram.filters.command import Command
 from keyboards.basic import get_actions_markup, get_dev_actions_markup
 
-from scheduler import SCHEDULER
+from scheduler import SCHEDULER, SCRAP_REFUSED_MESSAGE
 from routers.utils import check_message_ownership
 
 
@@ -43,10 +43,34 @@ async def cmd_scrap_n_post_sample(
 
     user_id: int = message.from_user.id  # type: ignore
 
-    await bot.send_message(user_id, "Start scrapping")
+    if not SCHEDULER.can_scrap():
+        await message.answer(SCRAP_REFUSED_MESSAGE)
+        return
+
+    await bot.send_message(
+        user_id, SCHEDULER.get_scrap_start_message(force=True, limit=1)
+    )
     await SCHEDULER.scrap_wrapper(force=True, limit=1)
     await message.answer("Scrapping was successfully finished ")
 
-    await bot.send_message(user_id, "Start posting")
+    await bot.send_message(
+        user_id, SCHEDULER.get_start_message("post_to_owner", "Start posting")
+    )
     await SCHEDULER.post_to_owner_wrapper()
     await message.answer("Posting was successfully finished ")
+
+
+@router.message(Command("scrap_metrics"))
+@check_message_ownership
+async def cmd_scrap_metrics(
+    message: types.Message, *args, **kwargs
+):  # pylint: disable=W0613
+    """/scrap_metrics command handler
+
+    Args:
+        message (types.Message): message object
+    """
+
+    report = SCHEDULER.get_scrap_metrics_report()
+
+    await message.answer(report if report else "No scrap runs yet")
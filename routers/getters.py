@@ -8,6 +8,10 @@ from keyboards.basic import get_getters_markup
 from routers.utils import check_message_ownership
 
 
+from budget import BUDGET_MANAGER
+from date import DATE_TIME_INFO
+from gallery import GALLERY
+from scheduler import SCHEDULER
 from settings import SETTINGS_MANAGER
 
 
@@ -46,7 +50,9 @@ async def cmd_subscribers(
     for subscriber in subscribers:
         await bot.send_message(
             user_id,
-            f"{subscriber.tg_id}\n@{subscriber.tg_alias}\n{subscriber.subscribe_date}",
+            f"{subscriber.tg_id}\n@{subscriber.tg_alias}\n{subscriber.subscribe_date}\n"
+            f"{subscriber.timezone or DATE_TIME_INFO.timezone_region}, "
+            f"{SETTINGS_MANAGER.get_delivery_hour(subscriber)}:00",
         )
         await asyncio.sleep(0.5)
 
@@ -140,3 +146,76 @@ async def cmd_available_image_styles(
     """
 
     await message.answer(", ".join(SETTINGS_MANAGER.image_generator.available_styles))
+
+
+@router.message(Command("image_providers"))
+@check_message_ownership
+async def cmd_image_providers(
+    message: types.Message, *args, **kwargs
+):  # pylint: disable=W0613
+    """/image_providers command handler
+
+    Args:
+        message (types.Message): message object
+    """
+
+    image_generator = SETTINGS_MANAGER.image_generator
+
+    await message.answer(
+        f"{', '.join(image_generator.providers)}\n"
+        f"hedge_percentile -- {image_generator.hedge_percentile}"
+    )
+
+
+@router.message(Command("budget"))
+@check_message_ownership
+async def cmd_budget(message: types.Message, *args, **kwargs):  # pylint: disable=W0613
+    """/budget command handler
+
+    Args:
+        message (types.Message): message object
+    """
+
+    await message.answer(BUDGET_MANAGER.get_report())
+
+
+@router.message(Command("gallery_usage"))
+@check_message_ownership
+async def cmd_gallery_usage(
+    message: types.Message, *args, **kwargs
+):  # pylint: disable=W0613
+    """/gallery_usage command handler
+
+    Args:
+        message (types.Message): message object
+    """
+
+    await message.answer(GALLERY.get_usage_report())
+
+
+@router.message(Command("broadcast"))
+@check_message_ownership
+async def cmd_broadcast(
+    message: types.Message, *args, **kwargs
+):  # pylint: disable=W0613
+    """/broadcast command handler
+
+    Args:
+        message (types.Message): message object
+    """
+
+    await message.answer(await asyncio.to_thread(SCHEDULER.get_broadcast_report))
+
+
+@router.message(Command("day_queue"))
+@check_message_ownership
+async def cmd_day_queue(
+    message: types.Message, *args, **kwargs
+):  # pylint: disable=W0613
+    """/day_queue command handler
+
+    Args:
+        message (types.Message): message object
+    """
+
+    await message.answer(await asyncio.to_thread(SCHEDULER.get_day_queue_report))
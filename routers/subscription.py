@@ -1,12 +1,16 @@
 """Contains subscription handlers"""
 
 # pylint: disable=import-error
-from aiogram import Router
+from aiogram import F, Router
 from aiogram.filters import Text
 from aiogram import types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 
 # pylint: enable=import-error
 
+import pytz
+
 from keyboards.basic import get_basic_markup
 from settings import SETTINGS_MANAGER
 
@@ -14,6 +18,13 @@ from settings import SETTINGS_MANAGER
 router = Router()
 
 
+class UpdateDeliveryTime(StatesGroup):
+    """UpdateDeliveryTime FSA class"""
+
+    update_timezone = State()
+    update_hour = State()
+
+
 @router.message(Text("ПОДПИСАТЬСЯ"))
 async def handle_subscribe(message: types.Message):
     """Text subscription handler
@@ -44,3 +55,80 @@ async def handle_unsubscribe(message: types.Message):
     SETTINGS_MANAGER.unsubscribe_user(tg_id)
 
     await message.answer("Вы успешно отписались!", reply_markup=get_basic_markup(tg_id))
+
+
+@router.message(Text("ВРЕМЯ РАССЫЛКИ"))
+async def handle_delivery_time(message: types.Message, state: FSMContext):
+    """Text delivery time handler
+
+    Args:
+        message (types.Message): message object
+        state (types.FSMContext): FSA state
+    """
+    tg_id = message.from_user.id  # type: ignore
+
+    if not SETTINGS_MANAGER.is_subscribed(tg_id):
+        await message.answer(
+            "Сначала подпишитесь", reply_markup=get_basic_markup(tg_id)
+        )
+        return
+
+    await message.answer(
+        "Введите часовой пояс, например Europe/Moscow или Asia/Yekaterinburg"
+    )
+    await state.set_state(UpdateDeliveryTime.update_timezone)
+
+
+@router.message(UpdateDeliveryTime.update_timezone, F.text)
+async def delivery_time_hour(message: types.Message, state: FSMContext):
+    """Second step of updating delivery time
+
+    Args:
+        message (types.Message): message object
+        state (types.FSMContext): FSA state
+    """
+    tg_id = message.from_user.id  # type: ignore
+
+    timezone = message.text.strip()  # type: ignore
+    if timezone not in pytz.all_timezones_set:
+        await message.answer(
+            "Неизвестный часовой пояс", reply_markup=get_basic_markup(tg_id)
+        )
+        await state.clear()
+        return
+
+    await state.update_data(timezone=timezone)
+    await message.answer("Введите час, когда присылать праздники (0-23)")
+    await state.set_state(UpdateDeliveryTime.update_hour)
+
+
+@router.message(UpdateDeliveryTime.update_hour, F.text)
+async def update_delivery_time(message: types.Message, state: FSMContext):
+    """Final step of updating delivery time
+
+    Args:
+        message (types.Message): message object
+        state (types.FSMContext): FSA state
+    """
+    tg_id = message.from_user.id  # type: ignore
+
+    try:
+        hour = int(message.text.strip())  # type: ignore
+        assert 0 <= hour <= 23
+    except BaseException:  # pylint: disable=W0718
+        await message.answer(
+            "Час должен быть числом от 0 до 23", reply_markup=get_basic_markup(tg_id)
+        )
+        await state.clear()
+        return
+
+    user_data = await state.get_data()
+    timezone = user_data["timezone"]
+
+    SETTINGS_MANAGER.set_subscriber_delivery_time(tg_id, timezone, hour)
+
+    await message.answer(
+        f"Праздники будут приходить в {hour}:00 ({timezone})",
+        reply_markup=get_basic_markup(tg_id),
+    )
+    await state.clear()
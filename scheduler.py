@@ -1,25 +1,98 @@
 """Contains Scheduler for timer jobs management"""
 
+import asyncio
+import atexit
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from apscheduler.events import (
+    EVENT_JOB_MISSED,
+    EVENT_JOB_SUBMITTED,
+    JobExecutionEvent,
+    JobSubmissionEvent,
+)
+from apscheduler.job import Job
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.base import BaseTrigger
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
 from aiogram import Bot
 
+from broadcast import BROADCAST_QUEUE, BroadcastWorker
+from day_queue import DAY_QUEUE
+from leader_election import LeaderLease
 from poster import Poster
+from scrap_worker import ScrapWorker
 from scrapper import Scrapper
-from settings import SETTINGS_MANAGER
-from storage import STORAGE
+from settings import SETTINGS_MANAGER, PostReceivers
+from single_flight import SingleFlight
+from storage import STORAGE, DayBundle
 from date import DATE_TIME_INFO
 from gallery import GALLERY
+from holiday import Holiday
+from logger import LOGGER
+
+
+SCRAP_REFUSED_MESSAGE = "Scrapping runs in the producer service, not in delivery"
+
+
+async def scrap_job():
+    """Scrap timer job. Jobs are module functions, so the job store can persist them"""
+    await SCHEDULER.scrap_wrapper()
+
+
+async def post_job():
+    """Post timer job. With delivery slots it runs hourly and posts to the slot"""
+    if SETTINGS_MANAGER.delivery_slots.enabled:
+        await SCHEDULER.post_slot_wrapper()
+    else:
+        await SCHEDULER.post_wrapper()
+
+
+async def lookahead_job():
+    """Lookahead timer job"""
+    await SCHEDULER.lookahead_wrapper()
+
+
+def clean_job():
+    """Clean timer job"""
+    SCHEDULER.clean_wrapper()
+
+
+async def consume_job():
+    """Consume timer job of the delivery service"""
+    await SCHEDULER.consume_wrapper()
 
 
 class Scheduler:
-    """Scheduler for timer jobs management"""
+    """Scheduler for timer jobs management.
+    Scrap and post jobs are single-flight: timer jobs and commands that run
+    a job while it is running join the in-flight run and get its result.
+    Timer jobs are kept in a SQLite job store, so runs missed while the bot
+    was down are caught up once after the restart.
+    Of several bot replicas only the holder of the leader lease runs timer
+    jobs, a standby takes over when the leader's lease expires.
+    The scheduler runs in one of the modes: "all" runs every job, "producer"
+    only builds day bundles and publishes them to the day queue, "delivery"
+    consumes them from the queue and posts"""
+
+    def _schedule_job(self, job_id: str, func, trigger: BaseTrigger) -> Job:
+        job = self.scheduler.get_job(job_id)
+        if job is not None and str(job.trigger) == str(trigger):
+            # keeping the stored next run time lets a missed run be caught up
+            return job
+        return self.scheduler.add_job(
+            func, trigger, id=job_id, name=job_id, replace_existing=True
+        )
 
     def _add_scrap_job(self):
-        self.scrap_job = self.scheduler.add_job(
-            self.scrap_wrapper,
+        self.scrap_job = self._schedule_job(
+            "scrap",
+            scrap_job,
             CronTrigger(
                 hour=SETTINGS_MANAGER.scrap_timer.hours,
                 minute=SETTINGS_MANAGER.scrap_timer.minutes,
@@ -28,84 +101,596 @@ class Scheduler:
         )
 
     def _add_post_job(self):
-        self.post_job = self.scheduler.add_job(
-            self.post_wrapper,
+        self.post_job = self._schedule_job(
+            "post",
+            post_job,
             CronTrigger(
-                hour=SETTINGS_MANAGER.post_timer.hours,
+                # every hour is a delivery slot
+                hour="*"
+                if SETTINGS_MANAGER.delivery_slots.enabled
+                else SETTINGS_MANAGER.post_timer.hours,
                 minute=SETTINGS_MANAGER.post_timer.minutes,
                 timezone=self._tz,
             ),
         )
+        if self._slots_from is None and self.post_job.next_run_time is not None:
+            # a stored run time in the past is the first slot missed while down
+            self._slots_from = self.post_job.next_run_time
+
+    def _add_lookahead_job(self):
+        self.lookahead_job = self._schedule_job(
+            "lookahead",
+            lookahead_job,
+            CronTrigger(
+                hour=SETTINGS_MANAGER.lookahead.hours,
+                minute=SETTINGS_MANAGER.lookahead.minutes,
+                timezone=self._tz,
+            ),
+        )
+
+    def _add_consume_job(self):
+        self.consume_job = self._schedule_job(
+            "consume",
+            consume_job,
+            IntervalTrigger(seconds=self.consume_period_seconds, timezone=self._tz),
+        )
 
     def _add_clean_job(self):
-        self.clean_job = self.scheduler.add_job(
-            self.clean_wrapper,
+        self.clean_job = self._schedule_job(
+            "clean",
+            clean_job,
             IntervalTrigger(
                 days=SETTINGS_MANAGER.clean_timer.days,
                 timezone=self._tz,
             ),
         )
 
-    def __init__(self) -> None:
+    def _on_job_submitted(self, event: JobSubmissionEvent):
+        now = datetime.now(self._tz)
+        delay = max(
+            (now - run_time).total_seconds() for run_time in event.scheduled_run_times
+        )
+        if delay >= self.catch_up_log_seconds:
+            LOGGER.log(
+                f"Catching up {event.job_id} job scheduled at "
+                f"{event.scheduled_run_times[-1]}, {delay:.0f}s late",
+                "Warning",
+            )
+
+    def _on_job_missed(self, event: JobExecutionEvent):
+        LOGGER.log(
+            f"Skipped {event.job_id} job scheduled at {event.scheduled_run_time}, "
+            f"more than {self.misfire_grace_seconds}s late",
+            "Warning",
+        )
+
+    def __init__(
+        self,
+        jobs_path: str = os.path.join(STORAGE.path, "jobs.sqlite"),
+        misfire_grace_seconds: int = 3 * 60 * 60,
+        catch_up_log_seconds: int = 60,
+        consume_period_seconds: int = 60,
+        delivery_wait_seconds: int = 60 * 60,
+    ) -> None:
         self._tz = DATE_TIME_INFO.tz
+        self.single_flight = SingleFlight()
+        self.jobs_path = jobs_path
+        self.misfire_grace_seconds = misfire_grace_seconds
+        self.catch_up_log_seconds = catch_up_log_seconds
+        self.consume_period_seconds = consume_period_seconds
+        # (force, limit) of the running or the last scrap
+        self._scrap_params = (False, 0)
+        self.delivery_wait_seconds = delivery_wait_seconds
+        self.mode = "all"
 
+        # the job store is added on start, when the mode is known
         self.scheduler = AsyncIOScheduler(
             timezone=self._tz,
+            job_defaults={
+                # several missed runs are caught up with a single one
+                "coalesce": True,
+                "misfire_grace_time": misfire_grace_seconds,
+                "max_instances": 1,
+            },
+        )
+        self.scheduler.add_listener(self._on_job_submitted, EVENT_JOB_SUBMITTED)
+        self.scheduler.add_listener(self._on_job_missed, EVENT_JOB_MISSED)
+
+        self.lease = LeaderLease(
+            lease_seconds=SETTINGS_MANAGER.leader_election.lease_seconds
+        )
+        self.is_leader = False
+        self._election_task: Optional[asyncio.Task] = None
+        # the first delivery slot not posted yet
+        self._slots_from: Optional[datetime] = None
+        # local day -> slot receivers whose day's bundle is not saved yet
+        self._waiting_slot_receivers: dict[str, dict[int, PostReceivers]] = {}
+
+    def _start_jobs(self):
+        if self.scheduler.running:
+            self.scheduler.resume()
+            return
+
+        # stored jobs are loaded on start, due ones run after resume
+        self.scheduler.start(paused=True)
+        if self._is_producer():
+            self._add_scrap_job()
+            self._add_lookahead_job()
+            self._add_clean_job()
+        if self._is_delivery():
+            self._add_post_job()
+        if self.mode == "delivery":
+            self._add_consume_job()
+        self.scheduler.resume()
+
+    def _stop_jobs(self):
+        self.scheduler.pause()
+        # the new leader runs them, so they must not run twice
+        for key in ("scrap", "lookahead", "post", "consume"):
+            self.single_flight.cancel(key)
+
+    async def _keep_leadership(self):
+        while True:
+            is_leader = await asyncio.to_thread(self.lease.try_acquire)
+            if is_leader and self.lease.last_error is not None:
+                LOGGER.log(
+                    f"{self.lease.holder} failed to renew the leader lease: "
+                    f"{self.lease.last_error}",
+                    "Warning",
+                )
+            if is_leader and not self.is_leader:
+                LOGGER.log(f"{self.lease.holder} is the leader, running timer jobs")
+                self._start_jobs()
+            elif not is_leader and self.is_leader:
+                # another replica holds the lease or ours has expired
+                LOGGER.log(
+                    f"{self.lease.holder} lost the leader lease, "
+                    "timer jobs are stopped",
+                    "Warning",
+                )
+                self._stop_jobs()
+            self.is_leader = is_leader
+            await asyncio.sleep(self.lease.get_renew_period())
+
+    def _is_producer(self) -> bool:
+        return self.mode in ("all", "producer")
+
+    def _is_delivery(self) -> bool:
+        return self.mode in ("all", "delivery")
+
+    async def _publish_days(self, days: list[str]):
+        if self.mode != "producer":
+            return
+        for day in days:
+            holidays = await STORAGE.get_day_data_async(day)
+            await asyncio.to_thread(DAY_QUEUE.publish, day, holidays)
+        if days:
+            LOGGER.log(f"Published day bundles: {', '.join(days)}")
+
+    def _is_scrap_follow_up(self, force: bool, limit: int) -> bool:
+        # a forced scrap is not satisfied by a running scrap of other parameters
+        return (
+            force
+            and self.single_flight.is_running("scrap")
+            and self._scrap_params != (force, limit)
         )
 
-        self._add_scrap_job()
-        self._add_post_job()
-        self._add_clean_job()
+    def _start_scrap(self, force: bool, limit: int):
+        # set when the run is created, so callers right after it join it
+        self._scrap_params = (force, limit)
+        return self._scrap(force, limit)
+
+    async def _scrap(self, force: bool, limit: int):
+        holidays = await self.scrapper.scrap(force=force, limit=limit)
+        await self._publish_days([DATE_TIME_INFO.get_day_name()])
+        return holidays
+
+    async def _scrap_ahead(self, days_number: int) -> list[str]:
+        days = await self.lookahead_scrapper.scrap_ahead(days_number)
+        await self._publish_days(days)
+        return days
+
+    @staticmethod
+    async def _receive_images(day: str, rows: list[tuple[str, str]]) -> list[Holiday]:
+        holidays = []
+        for idx, (title, blob_name) in enumerate(rows):
+            image_path = ""
+            image = (
+                await asyncio.to_thread(DAY_QUEUE.get_image, day, blob_name)
+                if blob_name
+                else None
+            )
+            if image is not None:
+                # saved to this service gallery, the producer's one is not shared
+                image_path = await GALLERY.save_image_bytes_async(
+                    idx, image, os.path.splitext(blob_name)[1][1:], day
+                )
+            holidays.append(Holiday(title, image_path))
+        return holidays
+
+    async def _consume(self) -> list[str]:
+        days = []
+        for day, rows, published_at in await asyncio.to_thread(DAY_QUEUE.get_pending):
+            holidays = await Scheduler._receive_images(day, rows)
+            await STORAGE.save_day_data_async(day, holidays)
+            # acknowledged once stored, so a crash in between only repeats the import
+            await asyncio.to_thread(DAY_QUEUE.ack, day, published_at)
+            days.append(day)
+        if days:
+            LOGGER.log(f"Received day bundles: {', '.join(days)}")
+        return days
+
+    async def consume_wrapper(self) -> list[str]:
+        """Stores the day bundles published by the producer service
+
+        Returns:
+            list[str]: received days
+        """
+        return await self.single_flight.run("consume", self._consume)
+
+    async def _wait_for_today(self):
+        # the producer may still be building today's bundle
+        deadline = time.monotonic() + self.delivery_wait_seconds
+        while True:
+            await self.consume_wrapper()
+            if await STORAGE.is_today_file_exists_async():
+                return
+            if time.monotonic() >= deadline:
+                raise FileNotFoundError(
+                    f"Bundle of {DATE_TIME_INFO.get_day_name()} "
+                    "is not published by the producer"
+                )
+            await asyncio.sleep(self.consume_period_seconds)
+
+    async def _prepare_today(self):
+        if await STORAGE.is_today_file_exists_async():
+            return
+        if self.mode == "delivery":
+            await self._wait_for_today()
+        else:
+            await self.scrap_wrapper()
 
     async def scrap_wrapper(self, force: bool = False, limit: int = 0):
         """Wrapper over Scrapper function
 
         Args:
             force (bool, optional): Scrap even if the data is already scrapped. Defaults to False.
+            limit (int, optional): Limit scrap data number. Defaults to 0.
+
+        Returns:
+            list[Holiday]: scrapped holidays, of the in-flight scrap if joined
+        """
+        if not self.can_scrap():
+            raise RuntimeError(SCRAP_REFUSED_MESSAGE)
+        while self._is_scrap_follow_up(force, limit):
+            await self.single_flight.wait("scrap")
+        return await self.single_flight.run(
+            "scrap",
+            lambda: self._start_scrap(force, limit),
+            f"force={force}, limit={limit}",
+        )
+
+    async def lookahead_wrapper(self) -> list[str]:
+        """Wrapper over Scrapper function scrap_ahead. Runs off-peak with its own
+        Scrapper, so the progress of today's scrap is not mixed with it
+
+        Returns:
+            list[str]: days scrapped in advance
         """
-        await self.scrapper.scrap(force=force, limit=limit)
+        if not SETTINGS_MANAGER.lookahead.enabled:
+            return []
+        return await self.single_flight.run(
+            "lookahead",
+            lambda: self._scrap_ahead(SETTINGS_MANAGER.lookahead.days),
+            f"days={SETTINGS_MANAGER.lookahead.days}",
+        )
+
+    def get_job_status(self, key: str) -> Optional[str]:
+        """Returns status of the running scrap, lookahead, post or post_to_owner job
+
+        Args:
+            key (str): job name
+
+        Returns:
+            Optional[str]: status, None if the job is not running
+        """
+        status = self.single_flight.get_status(key)
+        if status is not None and key == "scrap":
+            status += f", {self.scrapper.get_progress()}"
+        elif status is not None and key == "lookahead":
+            status += f", {self.lookahead_scrapper.get_progress()}"
+        return status
+
+    def cancel_job(self, key: str) -> bool:
+        """Cancels the running scrap, post or post_to_owner job for all its callers
+
+        Args:
+            key (str): job name
+
+        Returns:
+            bool: True if the job was cancelled, otherwise False
+        """
+        return self.single_flight.cancel(key)
+
+    def get_scrap_progress(self) -> tuple[int, int]:
+        """Returns progress of the current scrap
+
+        Returns:
+            tuple[int, int]: (ready, total) holidays
+        """
+        return self.scrapper.progress_done, self.scrapper.progress_total
+
+    def get_post_progress(self) -> tuple[int, int]:
+        """Returns progress of the current post, over all the shards
+        if the broadcast is sharded
+
+        Returns:
+            tuple[int, int]: (done, total) receivers
+        """
+        if SETTINGS_MANAGER.broadcast.enabled:
+            return BROADCAST_QUEUE.get_progress(DATE_TIME_INFO.get_day_name())
+        return self.poster.progress_done, self.poster.progress_total
+
+    def get_post_start_message(self) -> str:
+        """Returns message for the caller of the post. A re-post of the day
+        already broadcast is told that only the missing deliveries are made
+
+        Returns:
+            str: message
+        """
+        if SETTINGS_MANAGER.broadcast.enabled and BROADCAST_QUEUE.is_published(
+            DATE_TIME_INFO.get_day_name()
+        ):
+            return self.get_start_message(
+                "post",
+                "Today's broadcast is already published, "
+                "posting to the receivers that have not got it yet",
+            )
+        return self.get_start_message("post", "Start posting")
+
+    def get_broadcast_report(self) -> str:
+        """Returns per-shard progress of today's broadcast
+
+        Returns:
+            str: one line per shard
+        """
+        return BROADCAST_QUEUE.get_report(DATE_TIME_INFO.get_day_name())
+
+    def get_start_message(self, key: str, start_message: str) -> str:
+        """Returns message for the caller of the job. Late callers
+        are told they joined the running job and what its status is
+
+        Args:
+            key (str): job name
+            start_message (str): message if the job is not running
+
+        Returns:
+            str: message
+        """
+        status = self.get_job_status(key)
+        if status is None:
+            return start_message
+        return f"Joining the running job: {status}"
+
+    def can_scrap(self) -> bool:
+        """Checks that this service builds day bundles. The delivery service
+        receives them from the producer and does not scrap
+
+        Returns:
+            bool: True if scraps may run here, otherwise False
+        """
+        return self._is_producer()
+
+    def get_scrap_start_message(self, force: bool = False, limit: int = 0) -> str:
+        """Returns message for the caller of the scrap. A forced scrap requested
+        while another scrap is running is told it runs after that one
+
+        Args:
+            force (bool, optional): the scrap is forced. Defaults to False.
+            limit (int, optional): limit of the scrap. Defaults to 0.
+
+        Returns:
+            str: message
+        """
+        if self._is_scrap_follow_up(force, limit):
+            return (
+                "Forced scrap will start after the running one: "
+                f"{self.get_job_status('scrap')}"
+            )
+        return self.get_start_message(
+            "scrap", "Start force scrapping" if force else "Start scrapping"
+        )
+
+    def get_scrap_metrics_report(self) -> str:
+        """Returns per-stage metrics of the last scrap run
+
+        Returns:
+            str: metrics report
+        """
+        return self.scrapper.get_metrics_report()
+
+    async def _post(self):
+        await self._prepare_today()
+
+        if not SETTINGS_MANAGER.broadcast.enabled:
+            await self.poster.post()
+            return
+
+        # poster workers deliver the shards along with this process
+        today = DATE_TIME_INFO.get_day_name()
+        republished = await asyncio.to_thread(
+            BROADCAST_QUEUE.publish, today, SETTINGS_MANAGER.broadcast.shards
+        )
+        if republished:
+            LOGGER.log(
+                f"Broadcast of {today} is published again, "
+                "delivered holidays are skipped"
+            )
+        await self.broadcast_worker.deliver(today)
+
+    def _get_pending_slots(self, now: datetime) -> list[datetime]:
+        # hourly slots from the first not posted one up to the current one
+        current = now.astimezone(timezone.utc).replace(
+            minute=0, second=0, microsecond=0
+        )
+        first = current
+        if self._slots_from is not None:
+            first = min(
+                self._slots_from.astimezone(timezone.utc).replace(
+                    minute=0, second=0, microsecond=0
+                ),
+                current,
+            )
+        # a day of slots at most, so every subscriber's hour comes once
+        first = max(first, current - timedelta(hours=23))
+        hours = int((current - first).total_seconds() // 3600)
+        return [first + timedelta(hours=hour) for hour in range(hours + 1)]
+
+    async def _get_slot_bundle(self, day: str) -> Optional[DayBundle]:
+        if day == DATE_TIME_INFO.get_day_name():
+            await self._prepare_today()
+            return await STORAGE.get_today_bundle_async()
+
+        if (
+            day == DATE_TIME_INFO.get_day_name(1)
+            and self._is_producer()
+            and not await STORAGE.is_day_saved_async(day)
+        ):
+            # subscribers east of the bot are already in the coming day
+            await self.single_flight.run(
+                "lookahead", lambda: self._scrap_ahead(1), "days=1"
+            )
+        if await STORAGE.is_day_saved_async(day):
+            return await STORAGE.get_day_bundle_async(day)
+        return None
+
+    async def _post_slot(self):
+        slots = self._get_pending_slots(DATE_TIME_INFO.get_datetime_now())
+        if len(slots) > 1:
+            LOGGER.log(
+                f"Catching up {len(slots)} delivery slots since {slots[0]}", "Warning"
+            )
+
+        # receivers of each local day, a receiver of several slots is posted once
+        receivers_by_day = self._waiting_slot_receivers
+        self._waiting_slot_receivers = {}
+        for slot in slots:
+            for day, receivers in SETTINGS_MANAGER.get_slot_receivers(slot).items():
+                receivers_by_day.setdefault(day, {}).update(
+                    (receiver.tg_id, receiver) for receiver in receivers
+                )
+
+        self._slots_from = slots[-1] + timedelta(hours=1)
+
+        # a local day is at most one day away from the bot's one
+        recent_days = [DATE_TIME_INFO.get_day_name(days) for days in (-1, 0, 1)]
+        for day, receivers in receivers_by_day.items():
+            bundle = await self._get_slot_bundle(day)
+            if bundle is None:
+                if day in recent_days:
+                    # the receivers wait for the day's bundle in the next slots
+                    self._waiting_slot_receivers[day] = receivers
+                LOGGER.log(
+                    f"Bundle of {day} is not saved, its {len(receivers)} slot "
+                    "receivers are "
+                    + ("left for the next slot" if day in recent_days else "skipped"),
+                    "Warning",
+                )
+                continue
+            LOGGER.log(f"Posting {bundle.day} to {len(receivers)} slot receivers")
+            await self.poster.post_slot(bundle, list(receivers.values()))
+
+    async def _post_to_owner(self):
+        await self._prepare_today()
+
+        await self.poster.post_to_owner()
 
     async def post_wrapper(self):
         """Wrapper over Poster function post"""
-        if not STORAGE.is_today_file_exists():
-            await self.scrap_wrapper()
+        await self.single_flight.run("post", self._post)
 
-        await self.poster.post()
+    async def post_slot_wrapper(self):
+        """Wrapper over Poster function post_slot for the current hour and
+        the slots missed since the last run"""
+        await self.single_flight.run("post", self._post_slot, "slot")
 
     async def post_to_owner_wrapper(self):
         """Wrapper over Poster function post_to_owner"""
-        if not STORAGE.is_today_file_exists():
-            await self.scrap_wrapper()
+        await self.single_flight.run("post_to_owner", self._post_to_owner)
 
-        await self.poster.post_to_owner()
+    def clean_wrapper(self) -> str:
+        """Wrapper over clean() functions
+
+        Returns:
+            str: freed bytes and current usage report
+        """
+        freed_bytes = STORAGE.clean() + GALLERY.clean()
+        report = (
+            f"freed {freed_bytes / 1024 / 1024:.1f} MB\n{GALLERY.get_usage_report()}"
+        )
+        LOGGER.log(f"Clean {report}")
+        return report
+
+    def get_day_queue_report(self) -> str:
+        """Returns the day bundles passed from the producer to the delivery service
 
-    def clean_wrapper(self):
-        """Wrapper over clean() functions"""
-        STORAGE.clean()
-        GALLERY.clean()
+        Returns:
+            str: one line per day
+        """
+        return DAY_QUEUE.get_report()
 
     def restart_scrap_job(self):
-        """Restarts scrap job"""
-        self.scheduler.remove_job(self.scrap_job.id)
-        self._add_scrap_job()
+        """Reschedules scrap job if its timer is changed"""
+        if self._is_producer():
+            self._add_scrap_job()
 
     def restart_post_job(self):
-        """Restarts post job"""
-        self.scheduler.remove_job(self.post_job.id)
-        self._add_post_job()
+        """Reschedules post job if its timer is changed"""
+        if self._is_delivery():
+            self._add_post_job()
 
     def restart_clean_job(self):
-        """Restarts clean job"""
-        self.scheduler.remove_job(self.clean_job.id)
-        self._add_clean_job()
+        """Reschedules clean job if its timer is changed"""
+        if self._is_producer():
+            self._add_clean_job()
+
+    def start(self, bot: Bot, mode: str = "all"):
+        """Starts the scheduler
 
-    def start(self, bot: Bot):
-        """Starts the scheduler"""
+        Args:
+            bot (Bot): bot to post with
+            mode (str, optional): "all", "producer" or "delivery". Defaults to "all".
+        """
         self._bot = bot
+        self.mode = mode
+
+        jobs_path = self.jobs_path
+        if mode != "all":
+            # each service has its own jobs and elects its own leader
+            root, ext = os.path.splitext(self.jobs_path)
+            jobs_path = f"{root}-{mode}{ext}"
+            self.lease.name = f"scheduler-{mode}"
+        self.scheduler.add_jobstore(
+            SQLAlchemyJobStore(url=f"sqlite:///{jobs_path}"), "default"
+        )
 
-        self.scrapper = Scrapper()
+        # the worker process keeps generation away from the dispatcher
+        scrapper_class = (
+            ScrapWorker if SETTINGS_MANAGER.scrap_worker.enabled else Scrapper
+        )
+        self.scrapper = scrapper_class()
+        self.lookahead_scrapper = scrapper_class()
         self.poster = Poster(bot=self._bot)
-        self.scheduler.start()
+        self.broadcast_worker = BroadcastWorker(self._bot)
+
+        if not SETTINGS_MANAGER.leader_election.enabled:
+            self.is_leader = True
+            self._start_jobs()
+            return
+
+        # a standby takes over at once if the bot is stopped gracefully
+        atexit.register(self.lease.release)
+        self._election_task = asyncio.create_task(self._keep_leadership())
 
 
 SCHEDULER = Scheduler()
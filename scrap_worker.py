@@ -0,0 +1,189 @@
+"""Contains ScrapWorker that runs Scrapper in a separate process"""
+
+import asyncio
+import multiprocessing
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+from gallery import GALLERY
+from holiday import Holiday
+from scrapper import Scrapper
+from storage import STORAGE
+
+
+def _send_index_changes(connection: Connection):
+    changes = GALLERY.take_index_changes()
+    if len(changes) > 0:
+        connection.send(("index", changes))
+
+
+async def _serve(connection: Connection, method: str, kwargs: dict, period: float):
+    # the bot process owns the index, the worker only reports its changes
+    GALLERY.detach_index()
+    scrapper = Scrapper()
+    task = asyncio.ensure_future(getattr(scrapper, method)(**kwargs))
+    while not task.done():
+        connection.send(("progress", scrapper.progress_done, scrapper.progress_total))
+        _send_index_changes(connection)
+        if connection.poll() and connection.recv() == "cancel":
+            task.cancel()
+        await asyncio.wait({task}, timeout=period)
+
+    connection.send(("progress", scrapper.progress_done, scrapper.progress_total))
+    connection.send(("metrics", scrapper.get_metrics_report()))
+    _send_index_changes(connection)
+
+    try:
+        result = task.result()
+    except asyncio.CancelledError:
+        connection.send(("cancelled",))
+        return
+    except BaseException as e:  # pylint: disable=W0718
+        connection.send(("error", str(e) or type(e).__name__))
+        return
+
+    if method == "scrap":
+        result = [holiday.as_tuple() for holiday in result]
+    connection.send(("result", result))
+
+
+def _worker_main(connection: Connection, method: str, kwargs: dict, period: float):
+    """Entry point of the worker process. Runs the Scrapper method and reports
+    ("progress", done, total), ("metrics", report), ("index", changes) and finally
+    ("result", value),
+    ("error", message) or ("cancelled",). A "cancel" message stops the run"""
+    try:
+        asyncio.run(_serve(connection, method, kwargs, period))
+    finally:
+        connection.close()
+
+
+class ScrapWorker:
+    """Scrapper replacement that runs every scrap in a spawned worker process.
+    Parsing, generation and image decoding do not share the GIL with
+    the dispatcher, and a crash of the worker fails the scrap only.
+    Progress, metrics, gallery index changes, results and cancellation
+    go over a pipe. Budget counters are shared through their SQLite file"""
+
+    def __init__(
+        self, progress_period_seconds: float = 1.0, stop_timeout_seconds: float = 10.0
+    ) -> None:
+        self.progress_period_seconds = progress_period_seconds
+        self.stop_timeout_seconds = stop_timeout_seconds
+
+        self.progress_done = 0
+        self.progress_total = 0
+        self._last_metrics_report = ""
+
+    def _stop(self, connection: Connection, process: BaseProcess):
+        try:
+            connection.send("cancel")
+        except OSError:
+            pass
+        # the worker checkpoints finished holidays, so it is given time to stop
+        process.join(self.stop_timeout_seconds)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    async def _receive(self, connection: Connection, process: BaseProcess) -> Any:
+        while True:
+            has_message = await asyncio.to_thread(
+                connection.poll, self.progress_period_seconds
+            )
+            if not has_message:
+                if not process.is_alive():
+                    raise RuntimeError(
+                        f"Scrap worker exited with code {process.exitcode}"
+                    )
+                continue
+
+            try:
+                message = connection.recv()
+            except EOFError as e:
+                await asyncio.to_thread(process.join)
+                raise RuntimeError(
+                    f"Scrap worker exited with code {process.exitcode}"
+                ) from e
+
+            if message[0] == "progress":
+                self.progress_done, self.progress_total = message[1], message[2]
+            elif message[0] == "metrics":
+                self._last_metrics_report = message[1]
+            elif message[0] == "index":
+                await asyncio.to_thread(GALLERY.merge_index_changes, message[1])
+            elif message[0] == "result":
+                return message[1]
+            elif message[0] == "error":
+                raise RuntimeError(f"Scrap worker failed: {message[1]}")
+            elif message[0] == "cancelled":
+                raise asyncio.CancelledError
+
+    async def _run(self, method: str, **kwargs) -> Any:
+        connection, worker_connection = multiprocessing.Pipe()
+        # not a daemon, so the bot exit waits for the worker instead of killing it
+        process = multiprocessing.get_context("spawn").Process(
+            target=_worker_main,
+            args=(worker_connection, method, kwargs, self.progress_period_seconds),
+            name=f"scrap-worker-{method}",
+        )
+        process.start()
+        worker_connection.close()
+
+        try:
+            result = await self._receive(connection, process)
+            await asyncio.to_thread(process.join)
+            return result
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self._stop, connection, process)
+            raise
+        finally:
+            connection.close()
+            GALLERY.reload_manifests()
+            STORAGE.invalidate_today_bundle()
+
+    def get_progress(self) -> str:
+        """Returns progress of the current (or the last) scrap
+
+        Returns:
+            str: ready and total holidays numbers
+        """
+        return f"{self.progress_done}/{self.progress_total} holidays ready"
+
+    def get_metrics_report(self) -> str:
+        """Returns per-stage metrics of the last scrap run in the worker
+
+        Returns:
+            str: metrics report, empty if there were no runs yet
+        """
+        return self._last_metrics_report
+
+    async def scrap(
+        self, force: bool = False, limit: int = 0, days_ahead: int = 0
+    ) -> list[Holiday]:
+        """Runs Scrapper.scrap in the worker process
+
+        Args:
+            force (bool, optional): Scrap even if the data is already scrapped.
+            Defaults to False.
+            limit (int, optional): Limit scrap data number. Defaults to 0.
+            days_ahead (int, optional): Scrap the day coming after this number
+            of days instead of today. Defaults to 0.
+
+        Returns:
+            list[Holiday]: List of Holiday objects
+        """
+        rows = await self._run("scrap", force=force, limit=limit, days_ahead=days_ahead)
+        return [Holiday(*row) for row in rows]
+
+    async def scrap_ahead(self, days: int) -> list[str]:
+        """Runs Scrapper.scrap_ahead in the worker process
+
+        Args:
+            days (int): number of the coming days
+
+        Returns:
+            list[str]: dd-mm-yy days scrapped by this call
+        """
+        return await self._run("scrap_ahead", days=days)
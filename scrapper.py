@@ -1,49 +1,304 @@
 """Contains Scrapper that scraps holidays"""
 
+import asyncio
+import time
+from typing import Optional
+
+from budget import BUDGET_MANAGER
+from date import DATE_TIME_INFO
 from gallery import GALLERY
 
 from holiday import Holiday
 from holiday_scrapper import HolidayScrapper
-from image_generator_model_based import HuggingFaceImageGenerator
+from image_providers import build_image_generator
+from image_transcoder import TRANSCODER
+from logger import LOGGER
+from pipeline import Pipeline, Stage
+from settings import SETTINGS_MANAGER
 
 from storage import STORAGE
 
 
+class ScrapItem:
+    """Holiday passing through the scrap pipeline"""
+
+    def __init__(self, idx: int, title: str, day: str) -> None:
+        self.idx = idx
+        self.title = title
+        self.day = day
+        self.model_input = title
+        self.image = bytes([])
+        self.extension = GALLERY.extension
+        self.image_path = ""
+
+    def as_tuple(self) -> tuple[str, str]:
+        """Represents the item as (holiday, image path) pair
+
+        Returns:
+            tuple[str, str]
+        """
+        return (self.title, self.image_path)
+
+
 class Scrapper:
     """Scraps holidays"""
 
     def __init__(self) -> None:
-        self.image_generator = HuggingFaceImageGenerator()
+        self.image_generator = build_image_generator()
         self.holiday_scrapper = HolidayScrapper()
 
-    async def scrap(self, force: bool = False, limit: int = 0) -> list[Holiday]:
-        """Scraps holiday titles and combines them with images
+        self._translate_workers = 4
+        self._generate_workers = 10
+        self._transcode_workers = TRANSCODER.workers
+        self._save_workers = 2
+
+        self.last_metrics: list[dict] = []
+        self._last_metrics_report = ""
+
+        self.progress_done = 0
+        self.progress_total = 0
+
+    @staticmethod
+    def _degrade(item: ScrapItem) -> ScrapItem:
+        # a holiday whose image failed is still posted as a text
+        item.image = bytes([])
+        return item
+
+    async def _translate(self, item: ScrapItem) -> ScrapItem:
+        try:
+            item.model_input = await asyncio.to_thread(
+                self.image_generator.prepare_prompt, item.title
+            )
+        except BaseException:  # pylint: disable=W0718
+            LOGGER.log(f"Failed to translate '{item.title}'", "Warning")
+        return item
+
+    async def _generate(self, item: ScrapItem) -> ScrapItem:
+        item.image = await self.image_generator.generate(
+            item.model_input, item.idx, item.title
+        )
+        return item
+
+    async def _transcode(self, item: ScrapItem) -> ScrapItem:
+        if len(item.image) == 0:
+            return item
+
+        if SETTINGS_MANAGER.image_transcoding.keep_original:
+            await GALLERY.save_original_image_bytes_async(
+                item.idx, item.image, item.day
+            )
+
+        try:
+            item.image, item.extension = await TRANSCODER.transcode(item.image)
+        except BaseException as e:  # pylint: disable=W0718
+            LOGGER.log(f"Failed to transcode image {item.idx}: {e}", "Warning")
+        return item
+
+    async def _save(self, item: ScrapItem) -> ScrapItem:
+        item.image_path = await GALLERY.save_image_bytes_async(
+            item.idx, item.image, item.extension, item.day
+        )
+        # the image is on the disk now, do not keep it in memory
+        item.image = bytes([])
+        return item
+
+    async def _persist(self, item: ScrapItem) -> ScrapItem:
+        await asyncio.to_thread(
+            STORAGE.append_checkpoint, item.day, item.idx, item.as_tuple()
+        )
+        self.progress_done += 1
+        return item
+
+    def _load_checkpoint(self, day: str, holiday_titles: list[str]) -> list[ScrapItem]:
+        items: list[ScrapItem] = []
+        for idx, (title, image_path) in STORAGE.get_checkpoint(day).items():
+            if idx >= len(holiday_titles) or holiday_titles[idx] != title:
+                continue
+            # holidays without an image are generated once again
+            if not image_path or not GALLERY.is_image_exist(image_path):
+                continue
+            item = ScrapItem(idx, title, day)
+            item.image_path = image_path
+            items.append(item)
+        return items
+
+    def _build_pipeline(self) -> Pipeline:
+        return Pipeline(
+            [
+                Stage(
+                    "translate",
+                    self._translate,
+                    workers=self._translate_workers,
+                    fallback=Scrapper._degrade,
+                ),
+                Stage(
+                    "generate",
+                    self._generate,
+                    workers=self._generate_workers,
+                    fallback=Scrapper._degrade,
+                ),
+                Stage(
+                    "transcode",
+                    self._transcode,
+                    workers=self._transcode_workers,
+                    fallback=Scrapper._degrade,
+                ),
+                Stage(
+                    "save",
+                    self._save,
+                    workers=self._save_workers,
+                    fallback=Scrapper._degrade,
+                ),
+                Stage("persist", self._persist, fallback=Scrapper._degrade),
+            ]
+        )
+
+    def _get_degrade_deadline(self) -> Optional[float]:
+        now = DATE_TIME_INFO.get_datetime_now()
+        post_time = now.replace(
+            hour=SETTINGS_MANAGER.post_timer.hours,
+            minute=SETTINGS_MANAGER.post_timer.minutes,
+            second=0,
+            microsecond=0,
+        )
+        if post_time <= now:
+            return None
+
+        seconds_left = (post_time - now).total_seconds() - (
+            SETTINGS_MANAGER.image_generator.degrade_minutes_before_post * 60
+        )
+        return time.monotonic() + max(0.0, seconds_left)
+
+    @staticmethod
+    def _has_budget(images: int) -> bool:
+        day_left = sum(
+            BUDGET_MANAGER.get_remaining(provider)["day_left"]
+            for provider in SETTINGS_MANAGER.image_generator.providers
+        )
+        return day_left >= images
+
+    def get_progress(self) -> str:
+        """Returns progress of the current (or the last) scrap
+
+        Returns:
+            str: ready and total holidays numbers
+        """
+        return f"{self.progress_done}/{self.progress_total} holidays ready"
+
+    def get_metrics_report(self) -> str:
+        """Returns per-stage metrics of the last scrap pipeline run
+
+        Returns:
+            str: metrics report, empty if there were no runs yet
+        """
+        if not self._last_metrics_report:
+            return ""
+        return (
+            f"{self._last_metrics_report}\n\n{self.image_generator.get_stats_report()}"
+        )
+
+    async def scrap(
+        self, force: bool = False, limit: int = 0, days_ahead: int = 0
+    ) -> list[Holiday]:
+        """Scraps holiday titles and combines them with images.
+        Titles are streamed through translate -> generate -> transcode -> save ->
+        persist stages, and every finished holiday is checkpointed as soon as its
+        image is ready, so an interrupted scrap is resumed by the next non-forced call
 
         Args:
             force (bool, optional): Scrap even if the data is already scrapped. Defaults to False.
             limit (int, optional): Limit scrap data number. If set to0, then scrap all data.
             Defaults to 0.
+            days_ahead (int, optional): Scrap the day coming after this number
+            of days instead of today. Defaults to 0.
 
         Returns:
             list[Holiday]: List of Holiday objects
         """
+        day = DATE_TIME_INFO.get_day_name(days_ahead)
 
-        if not force and STORAGE.is_today_file_exists():
-            return STORAGE.get_today_data()
-
-        holidays: list[Holiday] = []
+        if not force and await STORAGE.is_day_saved_async(day):
+            return await STORAGE.get_day_data_async(day)
 
-        holiday_titles = self.holiday_scrapper.get_holidays(force=force)
+        holiday_titles = await asyncio.to_thread(
+            self.holiday_scrapper.get_holidays,
+            force=force,
+            date=DATE_TIME_INFO.get_datetime_after_days(days_ahead),
+        )
         if limit > 0:
             holiday_titles = holiday_titles[:limit]
 
-        holiday_image_hashes = self.image_generator.get_image_b64_hashes(holiday_titles)
+        if force:
+            await asyncio.to_thread(STORAGE.remove_checkpoint, day)
 
-        holiday_image_paths = GALLERY.save_images_b64(holiday_image_hashes)
+        finished_items = await asyncio.to_thread(
+            self._load_checkpoint, day, holiday_titles
+        )
+        finished_idxs = set(item.idx for item in finished_items)
+        self.progress_done = len(finished_items)
+        self.progress_total = len(holiday_titles)
+        if len(finished_items) > 0:
+            LOGGER.log(f"Resuming scrap: {len(finished_items)} holidays are ready")
 
-        for title, image_path in zip(holiday_titles, holiday_image_paths):
-            holidays.append(Holiday(title=title, image_path=image_path))
+        # switch to the local fallback if generation runs into the post time,
+        # the coming days have time to wait for the providers
+        self.image_generator.set_deadline(
+            self._get_degrade_deadline() if days_ahead == 0 else None
+        )
 
-        STORAGE.save_today_data(holidays)
+        pipeline = self._build_pipeline()
+        try:
+            items: list[ScrapItem] = await pipeline.run(
+                ScrapItem(i, title, day)
+                for i, title in enumerate(holiday_titles)
+                if i not in finished_idxs
+            )
+        finally:
+            self.last_metrics = pipeline.get_metrics()
+            self._last_metrics_report = pipeline.get_metrics_report()
+            LOGGER.log(f"Scrap pipeline metrics:\n{self._last_metrics_report}")
+
+        items += finished_items
+        items.sort(key=lambda item: item.idx)
+        holidays = [Holiday(*item.as_tuple()) for item in items]
+
+        # rewrite the day's file keeping the original holidays order
+        await STORAGE.save_day_data_async(day, holidays)
+        await asyncio.to_thread(STORAGE.remove_checkpoint, day)
 
         return holidays
+
+    async def scrap_ahead(self, days: int) -> list[str]:
+        """Builds complete data of the coming days in advance, so their posts
+        only read it. Days that are already saved are skipped, and the lookahead
+        stops at the first day the providers' daily budget can not cover
+
+        Args:
+            days (int): number of the coming days
+
+        Returns:
+            list[str]: dd-mm-yy days scrapped by this call
+        """
+        scrapped_days: list[str] = []
+        for days_ahead in range(1, days + 1):
+            day = DATE_TIME_INFO.get_day_name(days_ahead)
+            if await STORAGE.is_day_saved_async(day):
+                continue
+
+            holiday_titles = await asyncio.to_thread(
+                self.holiday_scrapper.get_holidays,
+                date=DATE_TIME_INFO.get_datetime_after_days(days_ahead),
+            )
+            if not Scrapper._has_budget(len(holiday_titles)):
+                LOGGER.log(
+                    f"Lookahead stopped at {day}: image budget is not enough "
+                    f"for {len(holiday_titles)} holidays",
+                    "Warning",
+                )
+                break
+
+            LOGGER.log(f"Lookahead scrap of {day}")
+            await self.scrap(days_ahead=days_ahead)
+            scrapped_days.append(day)
+
+        return scrapped_days
@@ -1,10 +1,14 @@
 """Contains the SettingsManager class instances"""
 
+from datetime import datetime
 from typing import List, Optional
 import os
 import json
+import zlib
 
+import pytz
 
+from database import DATABASE
 from date import DATE_TIME_INFO
 
 
@@ -33,15 +37,20 @@ class Owner(PostReceivers):
 
 
 class Subscriber(Owner):
-    """Bot subscriber"""
+    """Bot subscriber. Timezone and preferred hour are None
+    until the subscriber chooses the delivery time"""
 
     def __init__(
         self,
         tg_id: int,  # pylint: disable=C0103
         tg_alias: str,
         subscribe_date: Optional[str] = None,
+        timezone: Optional[str] = None,
+        preferred_hour: Optional[int] = None,
     ) -> None:
         super().__init__(tg_id, tg_alias)
+        self.timezone = timezone
+        self.preferred_hour = preferred_hour
 
         if subscribe_date is None:
             self.subscribe_date = DATE_TIME_INFO.get_datetime_now_formatted(
@@ -52,9 +61,29 @@ class Subscriber(Owner):
 
     def as_dict(self) -> dict:
         supper_dict = super().as_dict()
-        supper_dict.update({"subscribe_date": self.subscribe_date})
+        supper_dict.update(
+            {
+                "subscribe_date": self.subscribe_date,
+                "timezone": self.timezone,
+                "preferred_hour": self.preferred_hour,
+            }
+        )
         return supper_dict
 
+    def as_row(self) -> tuple:
+        """Represents the class instance as a subscribers table row
+
+        Returns:
+            tuple
+        """
+        return (
+            self.tg_id,
+            self.tg_alias,
+            self.subscribe_date,
+            self.timezone,
+            self.preferred_hour,
+        )
+
 
 class CronTimer:
     """Cron timer information"""
@@ -96,11 +125,23 @@ class ImageGenerator:
         should_translate_prompt: bool,
         styles: List[str],
         available_styles: List[str],
+        providers: List[str],
+        hedge_percentile: float,
+        fallback_provider: str,
+        degrade_minutes_before_post: int,
+        budgets: dict,
+        max_budget_wait_minutes: int,
     ) -> None:
         self.soft_prompt = soft_prompt
         self.should_translate_prompt = should_translate_prompt
         self.styles = styles
         self.available_styles = available_styles
+        self.providers = providers
+        self.hedge_percentile = hedge_percentile
+        self.fallback_provider = fallback_provider
+        self.degrade_minutes_before_post = degrade_minutes_before_post
+        self.budgets = budgets
+        self.max_budget_wait_minutes = max_budget_wait_minutes
 
     def as_dict(self) -> dict:
         """Represents the class instance as dict
@@ -113,9 +154,180 @@ class ImageGenerator:
             "should_translate_prompt": self.should_translate_prompt,
             "styles": self.styles,
             "available_styles": self.available_styles,
+            "providers": self.providers,
+            "hedge_percentile": self.hedge_percentile,
+            "fallback_provider": self.fallback_provider,
+            "degrade_minutes_before_post": self.degrade_minutes_before_post,
+            "budgets": self.budgets,
+            "max_budget_wait_minutes": self.max_budget_wait_minutes,
+        }
+
+
+class ImageTranscoding:
+    """Image transcoding settings"""
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_dimension: int,
+        image_format: str,
+        quality: int,
+        keep_original: bool,
+    ) -> None:
+        self.enabled = enabled
+        self.max_dimension = max_dimension
+        self.image_format = image_format
+        self.quality = quality
+        self.keep_original = keep_original
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {
+            "enabled": self.enabled,
+            "max_dimension": self.max_dimension,
+            "image_format": self.image_format,
+            "quality": self.quality,
+            "keep_original": self.keep_original,
         }
 
 
+class Retention:
+    """Gallery and storage retention settings"""
+
+    def __init__(self, gallery_max_megabytes: int, storage_max_days: int) -> None:
+        self.gallery_max_megabytes = gallery_max_megabytes
+        self.storage_max_days = storage_max_days
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {
+            "gallery_max_megabytes": self.gallery_max_megabytes,
+            "storage_max_days": self.storage_max_days,
+        }
+
+
+class Lookahead:
+    """Settings of building the coming days in advance"""
+
+    def __init__(self, enabled: bool, days: int, hours: int, minutes: int) -> None:
+        self.enabled = enabled
+        self.days = days
+        self.hours = hours
+        self.minutes = minutes
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {
+            "enabled": self.enabled,
+            "days": self.days,
+            "hours": self.hours,
+            "minutes": self.minutes,
+        }
+
+
+class DatabaseSettings:
+    """SQLite database settings"""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {"enabled": self.enabled}
+
+
+class DeliverySlots:
+    """Hourly delivery slots settings. Subscribers without a preferred hour
+    are spread over default_spread_hours starting at the post timer hour"""
+
+    def __init__(self, enabled: bool, default_spread_hours: int) -> None:
+        self.enabled = enabled
+        self.default_spread_hours = default_spread_hours
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {
+            "enabled": self.enabled,
+            "default_spread_hours": self.default_spread_hours,
+        }
+
+
+class Broadcast:
+    """Sharded broadcast settings"""
+
+    def __init__(
+        self, enabled: bool, shards: int, messages_per_second: float, lease_seconds: int
+    ) -> None:
+        self.enabled = enabled
+        self.shards = shards
+        self.messages_per_second = messages_per_second
+        self.lease_seconds = lease_seconds
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {
+            "enabled": self.enabled,
+            "shards": self.shards,
+            "messages_per_second": self.messages_per_second,
+            "lease_seconds": self.lease_seconds,
+        }
+
+
+class LeaderElection:
+    """Leader election settings of the bot replicas"""
+
+    def __init__(self, enabled: bool, lease_seconds: int) -> None:
+        self.enabled = enabled
+        self.lease_seconds = lease_seconds
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {"enabled": self.enabled, "lease_seconds": self.lease_seconds}
+
+
+class ScrapWorkerSettings:
+    """Scrap worker process settings"""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+
+    def as_dict(self) -> dict:
+        """Represents the class instance as dict
+
+        Returns:
+            dict
+        """
+        return {"enabled": self.enabled}
+
+
 class LoggerSettings:
     """Logger settings"""
 
@@ -170,17 +382,50 @@ class SettingsManager:
             "owner": self.owner.as_dict(),
         }
 
+    def _pack_database(self):
+        self.database = DatabaseSettings(
+            enabled=self._settings.get("database", {}).get("enabled", False)
+        )
+
+    def _unpack_database(self) -> dict:
+        return {
+            "database": self.database.as_dict(),
+        }
+
     def _pack_subscribers(self):
+        if self.database.enabled:
+            self.subscribers = [
+                Subscriber(
+                    tg_id=tg_id,
+                    tg_alias=tg_alias,
+                    subscribe_date=subscribe_date,
+                    timezone=timezone,
+                    preferred_hour=preferred_hour,
+                )
+                for tg_id, tg_alias, subscribe_date, timezone, preferred_hour in (
+                    DATABASE.execute(
+                        "SELECT tg_id, tg_alias, subscribe_date, timezone, "
+                        "preferred_hour FROM subscribers"
+                    )
+                )
+            ]
+            return
+
         self.subscribers = [
             Subscriber(
                 tg_id=subscriber["tg_id"],
                 tg_alias=subscriber["tg_alias"],
                 subscribe_date=subscriber["subscribe_date"],
+                timezone=subscriber.get("timezone", None),
+                preferred_hour=subscriber.get("preferred_hour", None),
             )
             for subscriber in self._settings["subscribers"]
         ]
 
     def _unpack_subscribers(self) -> dict:
+        # the database keeps subscribers itself
+        if self.database.enabled:
+            return {}
         return {
             "subscribers": [subscriber.as_dict() for subscriber in self.subscribers],
         }
@@ -192,6 +437,18 @@ class SettingsManager:
             should_translate_prompt=image_generator_dict["should_translate_prompt"],
             styles=image_generator_dict["styles"],
             available_styles=image_generator_dict["available_styles"],
+            providers=image_generator_dict.get(
+                "providers", ["HUGGINGFACE", "FUSIONBRAIN"]
+            ),
+            hedge_percentile=image_generator_dict.get("hedge_percentile", 0.9),
+            fallback_provider=image_generator_dict.get("fallback_provider", "LOCAL"),
+            degrade_minutes_before_post=image_generator_dict.get(
+                "degrade_minutes_before_post", 10
+            ),
+            budgets=image_generator_dict.get("budgets", {}),
+            max_budget_wait_minutes=image_generator_dict.get(
+                "max_budget_wait_minutes", 60
+            ),
         )
 
     def _unpack_image_generator(self) -> dict:
@@ -199,6 +456,95 @@ class SettingsManager:
             "image_generator": self.image_generator.as_dict(),
         }
 
+    def _pack_image_transcoding(self):
+        image_transcoding_dict: dict = self._settings.get("image_transcoding", {})
+        self.image_transcoding = ImageTranscoding(
+            enabled=image_transcoding_dict.get("enabled", True),
+            max_dimension=image_transcoding_dict.get("max_dimension", 1024),
+            image_format=image_transcoding_dict.get("image_format", "JPEG"),
+            quality=image_transcoding_dict.get("quality", 85),
+            keep_original=image_transcoding_dict.get("keep_original", False),
+        )
+
+    def _unpack_image_transcoding(self) -> dict:
+        return {
+            "image_transcoding": self.image_transcoding.as_dict(),
+        }
+
+    def _pack_retention(self):
+        retention_dict: dict = self._settings.get("retention", {})
+        self.retention = Retention(
+            gallery_max_megabytes=retention_dict.get("gallery_max_megabytes", 1024),
+            storage_max_days=retention_dict.get("storage_max_days", 30),
+        )
+
+    def _unpack_retention(self) -> dict:
+        return {
+            "retention": self.retention.as_dict(),
+        }
+
+    def _pack_lookahead(self):
+        lookahead_dict: dict = self._settings.get("lookahead", {})
+        self.lookahead = Lookahead(
+            enabled=lookahead_dict.get("enabled", False),
+            days=lookahead_dict.get("days", 2),
+            hours=lookahead_dict.get("hours", 3),
+            minutes=lookahead_dict.get("minutes", 0),
+        )
+
+    def _unpack_lookahead(self) -> dict:
+        return {
+            "lookahead": self.lookahead.as_dict(),
+        }
+
+    def _pack_scrap_worker(self):
+        self.scrap_worker = ScrapWorkerSettings(
+            enabled=self._settings.get("scrap_worker", {}).get("enabled", False)
+        )
+
+    def _unpack_scrap_worker(self) -> dict:
+        return {
+            "scrap_worker": self.scrap_worker.as_dict(),
+        }
+
+    def _pack_leader_election(self):
+        leader_election_dict: dict = self._settings.get("leader_election", {})
+        self.leader_election = LeaderElection(
+            enabled=leader_election_dict.get("enabled", False),
+            lease_seconds=leader_election_dict.get("lease_seconds", 30),
+        )
+
+    def _unpack_leader_election(self) -> dict:
+        return {
+            "leader_election": self.leader_election.as_dict(),
+        }
+
+    def _pack_broadcast(self):
+        broadcast_dict: dict = self._settings.get("broadcast", {})
+        self.broadcast = Broadcast(
+            enabled=broadcast_dict.get("enabled", False),
+            shards=broadcast_dict.get("shards", 8),
+            messages_per_second=broadcast_dict.get("messages_per_second", 25),
+            lease_seconds=broadcast_dict.get("lease_seconds", 60),
+        )
+
+    def _unpack_broadcast(self) -> dict:
+        return {
+            "broadcast": self.broadcast.as_dict(),
+        }
+
+    def _pack_delivery_slots(self):
+        delivery_slots_dict: dict = self._settings.get("delivery_slots", {})
+        self.delivery_slots = DeliverySlots(
+            enabled=delivery_slots_dict.get("enabled", False),
+            default_spread_hours=delivery_slots_dict.get("default_spread_hours", 1),
+        )
+
+    def _unpack_delivery_slots(self) -> dict:
+        return {
+            "delivery_slots": self.delivery_slots.as_dict(),
+        }
+
     def _pack_logger_settings(self):
         self.logger_settings = LoggerSettings(self._settings)
 
@@ -209,8 +555,16 @@ class SettingsManager:
         total_unpack = {}
         total_unpack.update(self._unpack_timers())
         total_unpack.update(self._unpack_owner())
+        total_unpack.update(self._unpack_database())
         total_unpack.update(self._unpack_subscribers())
         total_unpack.update(self._unpack_image_generator())
+        total_unpack.update(self._unpack_image_transcoding())
+        total_unpack.update(self._unpack_retention())
+        total_unpack.update(self._unpack_lookahead())
+        total_unpack.update(self._unpack_scrap_worker())
+        total_unpack.update(self._unpack_leader_election())
+        total_unpack.update(self._unpack_broadcast())
+        total_unpack.update(self._unpack_delivery_slots())
         total_unpack.update(self._unpack_logger_settings())
         return total_unpack
 
@@ -235,16 +589,32 @@ class SettingsManager:
     def __repr__(self) -> str:
         return str(list(self._settings.items()))
 
-    def __init__(self, path: str = os.path.join(".", "settings.json")) -> None:
-        self._path = path
-        self._load_settings()
-
+    def _pack_all(self):
         self._pack_timers()
         self._pack_owner()
+        self._pack_database()
         self._pack_subscribers()
         self._pack_image_generator()
+        self._pack_image_transcoding()
+        self._pack_retention()
+        self._pack_lookahead()
+        self._pack_scrap_worker()
+        self._pack_leader_election()
+        self._pack_broadcast()
+        self._pack_delivery_slots()
         self._pack_logger_settings()
 
+    def __init__(self, path: str = os.path.join(".", "settings.json")) -> None:
+        self._path = path
+        self._load_settings()
+        self._pack_all()
+
+    def reload(self):
+        """Re-reads the settings and subscribers changed by another process,
+        e.g. by the bot for a poster worker"""
+        self._load_settings()
+        self._pack_all()
+
     def get_image_soft_prompt(self) -> str:
         """Gets image soft prompt
 
@@ -268,6 +638,48 @@ class SettingsManager:
             for subscriber in self.subscribers
         ]
 
+    def get_delivery_hour(self, subscriber: Subscriber) -> int:
+        """Returns the local hour to post to the subscriber at
+
+        Args:
+            subscriber (Subscriber): subscriber
+
+        Returns:
+            int: preferred hour, or a post timer based hour stable for the subscriber
+        """
+        if subscriber.preferred_hour is not None:
+            return subscriber.preferred_hour
+        spread_hours = max(self.delivery_slots.default_spread_hours, 1)
+        # crc32 is the same in every process, unlike hash()
+        offset = zlib.crc32(str(subscriber.tg_id).encode()) % spread_hours
+        return (self.post_timer.hours + offset) % 24
+
+    def get_slot_receivers(self, now: datetime) -> dict[str, List[PostReceivers]]:
+        """Represents subscribers whose local delivery hour has come as PostReceivers,
+        grouped by their local day
+
+        Args:
+            now (datetime): time of the slot, timezone aware
+
+        Returns:
+            dict[str, List[PostReceivers]]: dd-mm-yy local day -> post receivers
+            of the slot
+        """
+        receivers: dict[str, List[PostReceivers]] = {}
+        for subscriber in self.subscribers:
+            local_now = now.astimezone(
+                pytz.timezone(subscriber.timezone or DATE_TIME_INFO.timezone_region)
+            )
+            if local_now.hour != self.get_delivery_hour(subscriber):
+                continue
+            receivers.setdefault(local_now.strftime("%d-%m-%y"), []).append(
+                PostReceivers(
+                    tg_id=subscriber.tg_id,
+                    tg_alias=subscriber.tg_alias,
+                )
+            )
+        return receivers
+
     def get_owner_as_receiver(self) -> PostReceivers:
         """Represents owner as PostReceiver
 
@@ -309,7 +721,13 @@ class SettingsManager:
         if self.is_subscribed(tg_id):
             return
 
-        self.subscribers.append(Subscriber(tg_id=tg_id, tg_alias=tg_alias))
+        subscriber = Subscriber(tg_id=tg_id, tg_alias=tg_alias)
+        self.subscribers.append(subscriber)
+        if self.database.enabled:
+            DATABASE.execute(
+                "INSERT OR REPLACE INTO subscribers VALUES (?, ?, ?, ?, ?)",
+                subscriber.as_row(),
+            )
         self._save_settings()
 
     def unsubscribe_user(self, tg_id: int):
@@ -329,6 +747,31 @@ class SettingsManager:
             rest_subscribers.append(subscriber)
 
         self.subscribers = rest_subscribers  # pylint: disable=W0201
+        if self.database.enabled:
+            DATABASE.execute("DELETE FROM subscribers WHERE tg_id = ?", (tg_id,))
+        self._save_settings()
+
+    def set_subscriber_delivery_time(
+        self, tg_id: int, timezone: str, preferred_hour: int
+    ):
+        """Sets the subscriber's timezone and local hour to post at
+
+        Args:
+            tg_id (int): user telegram id
+            timezone (str): tz database name, e.g. Europe/Berlin
+            preferred_hour (int): local hour (0-23)
+        """
+        for subscriber in self.subscribers:
+            if subscriber.tg_id != tg_id:
+                continue
+            subscriber.timezone = timezone
+            subscriber.preferred_hour = preferred_hour
+            if self.database.enabled:
+                DATABASE.execute(
+                    "UPDATE subscribers SET timezone = ?, preferred_hour = ? "
+                    "WHERE tg_id = ?",
+                    (timezone, preferred_hour, tg_id),
+                )
         self._save_settings()
 
     def is_owner(self, tg_id: int) -> bool:
@@ -352,6 +795,15 @@ class SettingsManager:
         self.owner.tg_alias = tg_alias
         self._save_settings()
 
+    def set_database_enabled(self, enabled: bool):
+        """Switches Storage, Gallery and subscribers to the SQLite database
+
+        Args:
+            enabled (bool): should use the database or not
+        """
+        self.database.enabled = enabled
+        self._save_settings()
+
     def set_scrap_timer(self, hours: int, minutes: int):
         """Sets new scrap timer settings
 
@@ -0,0 +1,131 @@
+"""Contains SingleFlight that deduplicates concurrent runs of the same job"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+class Flight:
+    """Single in-flight run of a job"""
+
+    def __init__(self, key: str, task: asyncio.Future, description: str) -> None:
+        self.key = key
+        self.task = task
+        self.description = description
+        self.started_at = time.monotonic()
+        self.joined = 0
+
+    def get_status(self) -> str:
+        """Returns human readable status of the run
+
+        Returns:
+            str: status
+        """
+        status = f"{self.key} is running for {time.monotonic() - self.started_at:.0f}s"
+        if self.description:
+            status += f" ({self.description})"
+        if self.joined > 0:
+            status += f", {self.joined} callers joined"
+        return status
+
+
+class SingleFlight:
+    """Runs at most one instance of every job at a time.
+    Callers of a job that is already running join the in-flight run
+    and get its result instead of starting another one"""
+
+    def __init__(self) -> None:
+        self._flights: dict[str, Flight] = {}
+
+    def _forget(self, flight: Flight):
+        if self._flights.get(flight.key, None) is flight:
+            del self._flights[flight.key]
+
+    async def run(
+        self,
+        key: str,
+        job: Callable[[], Awaitable[Any]],
+        description: str = "",
+    ) -> Any:
+        """Runs the job or joins its in-flight run
+
+        Args:
+            key (str): job name
+            job (Callable[[], Awaitable[Any]]): job factory, called only
+            if the job is not running
+            description (str, optional): run parameters shown in the status.
+            Defaults to "".
+
+        Returns:
+            Any: result of the run
+        """
+        flight = self._flights.get(key, None)
+        if flight is None:
+            flight = Flight(key, asyncio.ensure_future(job()), description)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(flight))
+        else:
+            flight.joined += 1
+
+        # a cancelled caller must not cancel the run the others are waiting for
+        return await asyncio.shield(flight.task)
+
+    async def wait(self, key: str):
+        """Waits until the in-flight run of the job is finished, if any.
+        The run result and errors are left to its callers
+
+        Args:
+            key (str): job name
+        """
+        flight = self._flights.get(key, None)
+        if flight is not None:
+            await asyncio.wait({flight.task})
+
+    def cancel(self, key: str) -> bool:
+        """Cancels the in-flight run of the job for all its callers
+
+        Args:
+            key (str): job name
+
+        Returns:
+            bool: True if the run was cancelled, otherwise False
+        """
+        flight = self._flights.get(key, None)
+        if flight is None:
+            return False
+        return flight.task.cancel()
+
+    def is_running(self, key: str) -> bool:
+        """Checks whether the job is running
+
+        Args:
+            key (str): job name
+
+        Returns:
+            bool: True if running, otherwise False
+        """
+        return key in self._flights
+
+    def get_status(self, key: str) -> Optional[str]:
+        """Returns status of the in-flight run of the job
+
+        Args:
+            key (str): job name
+
+        Returns:
+            Optional[str]: status, None if the job is not running
+        """
+        flight = self._flights.get(key, None)
+        if flight is None:
+            return None
+        return flight.get_status()
+
+    def get_status_report(self) -> str:
+        """Returns statuses of all the in-flight runs
+
+        Returns:
+            str: one line per run
+        """
+        if len(self._flights) == 0:
+            return "No jobs are running"
+        return "\n".join(flight.get_status() for flight in self._flights.values())
@@ -1,19 +1,72 @@
 """Contains storage implementations"""
+import asyncio
 import os
 import csv
+import threading
+import time
+from datetime import datetime
+from typing import Optional
 
+from database import DATABASE, Database
 from holiday import Holiday
 from date import DATE_TIME_INFO
+from settings import SETTINGS_MANAGER
+
+
+class DayBundle:
+    """Parsed data of a single day shared by all the readers.
+    Holidays carry rendered captions and image references, existing images
+    and Telegram file ids of uploaded images are remembered along them"""
+
+    __slots__ = ("day", "holidays", "image_paths", "file_ids", "mtime", "checked_at")
+
+    def __init__(self, day: str, holidays: list[Holiday], mtime: float) -> None:
+        self.day = day
+        self.holidays = holidays
+        self.image_paths = set(
+            holiday.image_path for holiday in holidays if holiday.has_image()
+        )
+        self.file_ids: dict[str, str] = {}
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+
+    def has_image(self, holiday: Holiday) -> bool:
+        """Checks existence of the holiday image as of the bundle build
+
+        Args:
+            holiday (Holiday): holiday of the bundle
+
+        Returns:
+            bool: True if exists, otherwise False
+        """
+        return holiday.image_path in self.image_paths
 
 
 class Storage:
-    """Persistent storage implementation"""
+    """Persistent storage implementation.
+    Days are kept as dd-mm-yy.csv files, or in the days and holidays tables
+    of the SQLite database if it is enabled.
+    Days are addressed by dd-mm-yy names, so the data of the coming days can be
+    saved in advance.
+    Today's data is cached as a DayBundle that is rebuilt on explicit saves,
+    or when the file modification (database save) time changes. The time is
+    checked at most once per _bundle_check_period_seconds"""
+
+    @staticmethod
+    def _use_database() -> bool:
+        return SETTINGS_MANAGER.database.enabled
 
     def _generate_today_filename(self) -> str:
-        return DATE_TIME_INFO.get_datetime_now_formatted("%d-%m-%y")
+        return DATE_TIME_INFO.get_day_name()
+
+    def _get_day_file_path(self, day: str) -> str:
+        return f"{os.path.join(self.path, day)}.csv"
 
     def _get_today_file_path(self) -> str:
-        return f"{os.path.join(self.path, self._generate_today_filename())}.csv"
+        return self._get_day_file_path(self._generate_today_filename())
+
+    def _get_checkpoint_path(self, day: str) -> str:
+        return f"{os.path.join(self.path, day)}.part.csv"
 
     def __init__(self, folder: str = "storage") -> None:
         self.folder = folder
@@ -24,19 +77,133 @@ class Storage:
         if not (os.path.exists(self.path) and os.path.isdir(self.path)):
             os.mkdir(self.path)
 
+        self._bundle: Optional[DayBundle] = None
+        self._bundle_lock = threading.Lock()
+        self._bundle_check_period_seconds = 30
+
+    def _read_day(self, day: str) -> list[Holiday]:
+        if Storage._use_database():
+            return [
+                Holiday(title, image_path)
+                for title, image_path in DATABASE.execute(
+                    "SELECT title, image_path FROM holidays WHERE day = ? ORDER BY idx",
+                    (day,),
+                )
+            ]
+
+        data: list[Holiday] = []
+        with open(
+            self._get_day_file_path(day), "r", newline="", encoding="utf-8"
+        ) as f:  # pylint: disable=C0103
+            reader = csv.reader(f, delimiter=self.csv_delimiter)
+            for row in reader:
+                if len(row) == 0:
+                    continue
+                data.append(Holiday(*row))
+        return data
+
+    def _read_today_file(self) -> list[Holiday]:
+        return self._read_day(self._generate_today_filename())
+
+    def _get_day_mtime(self, day: str) -> Optional[float]:
+        if Storage._use_database():
+            rows = DATABASE.execute("SELECT saved_at FROM days WHERE day = ?", (day,))
+            return rows[0][0] if rows else None
+
+        try:
+            return os.stat(self._get_day_file_path(day)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _get_today_mtime(self) -> Optional[float]:
+        return self._get_day_mtime(self._generate_today_filename())
+
+    def _save_day_rows(self, day: str, data: list[Holiday]) -> float:
+        if Storage._use_database():
+            saved_at = time.time()
+            with DATABASE.transaction() as connection:
+                connection.execute("DELETE FROM days WHERE day = ?", (day,))
+                connection.execute("INSERT INTO days VALUES (?, ?)", (day, saved_at))
+                connection.executemany(
+                    "INSERT INTO holidays VALUES (?, ?, ?, ?)",
+                    [
+                        (day, idx, *holiday.as_tuple())
+                        for idx, holiday in enumerate(data)
+                    ],
+                )
+            return saved_at
+
+        # write aside and rename, so readers never see a half-written file
+        file_path = self._get_day_file_path(day)
+        tmp_path = f"{file_path}.tmp"
+        with open(
+            tmp_path, "w", newline="", encoding="utf-8"
+        ) as f:  # pylint: disable=C0103
+            csv.writer(f, delimiter=self.csv_delimiter).writerows(
+                [holiday.as_tuple() for holiday in data]
+            )
+        os.replace(tmp_path, file_path)
+        return os.stat(file_path).st_mtime
+
+    def _get_today_bundle(self) -> Optional[DayBundle]:
+        today = self._generate_today_filename()
+        with self._bundle_lock:
+            bundle = self._bundle
+            if (
+                bundle is not None
+                and bundle.day == today
+                and time.monotonic() - bundle.checked_at
+                < self._bundle_check_period_seconds
+            ):
+                return bundle
+
+            mtime = self._get_today_mtime()
+            if mtime is None:
+                self._bundle = None
+                return None
+
+            if bundle is not None and bundle.day == today and bundle.mtime == mtime:
+                bundle.checked_at = time.monotonic()
+                return bundle
+
+            self._bundle = DayBundle(today, self._read_today_file(), mtime)
+            return self._bundle
+
     def is_today_file_exists(self) -> bool:
         """Checks if the file for today exists or not
 
         Returns:
             bool: True is exists, otherwise False
         """
-        today_file_path = self._get_today_file_path()
-        return os.path.exists(today_file_path) and os.path.isfile(today_file_path)
+        return self._get_today_bundle() is not None
 
     def remove_today_file(self):
         """Removes file corresponded to today"""
-        if self.is_today_file_exists():
-            os.remove(self._get_today_file_path())
+        with self._bundle_lock:
+            self._bundle = None
+            if Storage._use_database():
+                DATABASE.execute(
+                    "DELETE FROM days WHERE day = ?", (self._generate_today_filename(),)
+                )
+            elif os.path.isfile(self._get_today_file_path()):
+                os.remove(self._get_today_file_path())
+
+    def invalidate_today_bundle(self):
+        """Drops the cached today's data, so the next read sees the data
+        saved by another process, e.g. by a scrap worker"""
+        with self._bundle_lock:
+            self._bundle = None
+
+    def get_today_bundle(self) -> DayBundle:
+        """Returns cached data of today shared by all the readers
+
+        Returns:
+            DayBundle: today's holidays with images information
+        """
+        bundle = self._get_today_bundle()
+        if bundle is None:
+            raise FileNotFoundError
+        return bundle
 
     def get_today_data(self) -> list[Holiday]:
         """Reads file corresponding to today
@@ -44,19 +211,201 @@ class Storage:
         Returns:
             list[Holiday]: List of (holiday, image path) pairs
         """
-        data: list[Holiday] = []
-        if not self.is_today_file_exists():
+        return list(self.get_today_bundle().holidays)
+
+    def get_day_bundle(self, day: str) -> DayBundle:
+        """Returns data of the day as a bundle. Today's one is the shared cached
+        bundle, the other days are read
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            DayBundle: the day's holidays with images information
+        """
+        if day == self._generate_today_filename():
+            return self.get_today_bundle()
+        mtime = self._get_day_mtime(day)
+        if mtime is None:
             raise FileNotFoundError
-        with open(
-            self._get_today_file_path(), "r", newline="", encoding="utf-8"
-        ) as f:  # pylint: disable=C0103
-            reader = csv.reader(f, delimiter=self.csv_delimiter)
-            for row in reader:
-                if len(row) == 0:
-                    continue
-                data.append(Holiday(*row))
+        return DayBundle(day, self._read_day(day), mtime)
 
-        return data
+    async def get_day_bundle_async(self, day: str) -> DayBundle:
+        """Returns data of the day as a bundle without blocking the event loop
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            DayBundle: the day's holidays with images information
+        """
+        return await asyncio.to_thread(self.get_day_bundle, day)
+
+    async def is_today_file_exists_async(self) -> bool:
+        """Checks if the file for today exists without blocking the event loop
+
+        Returns:
+            bool: True is exists, otherwise False
+        """
+        return await asyncio.to_thread(self.is_today_file_exists)
+
+    async def get_today_bundle_async(self) -> DayBundle:
+        """Returns cached data of today without blocking the event loop
+        when the bundle has to be (re)built
+
+        Returns:
+            DayBundle: today's holidays with images information
+        """
+        return await asyncio.to_thread(self.get_today_bundle)
+
+    async def get_today_data_async(self) -> list[Holiday]:
+        """Reads file corresponding to today without blocking the event loop
+
+        Returns:
+            list[Holiday]: List of (holiday, image path) pairs
+        """
+        return list((await self.get_today_bundle_async()).holidays)
+
+    def is_day_saved(self, day: str) -> bool:
+        """Checks if the data of the day is saved, e.g. by a lookahead scrap
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            bool: True is saved, otherwise False
+        """
+        if day == self._generate_today_filename():
+            return self.is_today_file_exists()
+        return self._get_day_mtime(day) is not None
+
+    async def is_day_saved_async(self, day: str) -> bool:
+        """Checks if the data of the day is saved without blocking the event loop
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            bool: True is saved, otherwise False
+        """
+        return await asyncio.to_thread(self.is_day_saved, day)
+
+    async def get_day_data_async(self, day: str) -> list[Holiday]:
+        """Reads data of the day without blocking the event loop
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            list[Holiday]: List of (holiday, image path) pairs, empty if not saved
+        """
+        if day == self._generate_today_filename():
+            return await self.get_today_data_async()
+        return await asyncio.to_thread(self.get_day_data, day)
+
+    def get_day_data(self, day: str) -> list[Holiday]:
+        """Reads data of the day
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            list[Holiday]: List of (holiday, image path) pairs, empty if not saved
+        """
+        try:
+            return self._read_day(day)
+        except FileNotFoundError:
+            return []
+
+    def find_holiday_days(self, title: str) -> list[str]:
+        """Finds the days the holiday was saved for
+
+        Args:
+            title (str): holiday title
+
+        Returns:
+            list[str]: days in dd-mm-yy format
+        """
+        if Storage._use_database():
+            return [
+                day
+                for (day,) in DATABASE.execute(
+                    "SELECT day FROM holidays WHERE title = ?", (title,)
+                )
+            ]
+
+        days = []
+        for file in sorted(os.listdir(self.path)):
+            day, file_extension = os.path.splitext(file)
+            if file_extension != ".csv" or "." in day:
+                continue
+            if any(holiday.title == title for holiday in self.get_day_data(day)):
+                days.append(day)
+        return days
+
+    def record_delivery(
+        self,
+        tg_id: int,
+        holiday: Holiday,
+        file_id: str = "",
+        day: Optional[str] = None,
+        database: Optional[Database] = None,
+    ):
+        """Records the holiday delivery to the receiver.
+        Deliveries are kept in the database only
+
+        Args:
+            tg_id (int): receiver telegram id
+            holiday (Holiday): delivered holiday
+            file_id (str, optional): telegram file id of the image. Defaults to "".
+            day (Optional[str], optional): dd-mm-yy day of the holiday.
+            Defaults to today.
+            database (Optional[Database], optional): database to keep the delivery
+            in instead of the bot one, e.g. the broadcast database. Defaults to None.
+        """
+        if database is None:
+            if not Storage._use_database():
+                return
+            database = DATABASE
+        database.execute(
+            "INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?, ?, ?)",
+            (
+                day or self._generate_today_filename(),
+                tg_id,
+                holiday.title,
+                file_id,
+                time.time(),
+            ),
+        )
+
+    def get_delivered_titles(
+        self,
+        tg_id: int,
+        day: Optional[str] = None,
+        database: Optional[Database] = None,
+    ) -> set[str]:
+        """Returns titles of the day's holidays delivered to the receiver
+
+        Args:
+            tg_id (int): receiver telegram id
+            day (Optional[str], optional): dd-mm-yy day. Defaults to today.
+            database (Optional[Database], optional): database the deliveries
+            are kept in instead of the bot one. Defaults to None.
+
+        Returns:
+            set[str]: delivered holiday titles, empty if the database is disabled
+        """
+        if database is None:
+            if not Storage._use_database():
+                return set()
+            database = DATABASE
+        return set(
+            title
+            for (title,) in database.execute(
+                "SELECT title FROM deliveries WHERE tg_id = ? AND day = ?",
+                (tg_id, day or self._generate_today_filename()),
+            )
+        )
 
     def save_today_data(self, data: list[Holiday], rewrite: bool = True):
         """Saves data corresponding to today
@@ -65,28 +414,144 @@ class Storage:
             rewrite (bool, optional): Should rewrite file if exists. Defaults to True.
             data (list[Holiday]): List of (holiday, image path) pairs
         """
-        if self.is_today_file_exists() and rewrite:
-            self.remove_today_file()
+        if self.is_today_file_exists() and not rewrite:
+            return
+
+        today = self._generate_today_filename()
+        with self._bundle_lock:
+            self._bundle = DayBundle(
+                today, list(data), self._save_day_rows(today, data)
+            )
+
+    async def save_today_data_async(self, data: list[Holiday], rewrite: bool = True):
+        """Saves data corresponding to today without blocking the event loop.
+        The file is written aside and atomically renamed
+
+        Args:
+            rewrite (bool, optional): Should rewrite file if exists. Defaults to True.
+            data (list[Holiday]): List of (holiday, image path) pairs
+        """
+        await asyncio.to_thread(self.save_today_data, data, rewrite)
+
+    def save_day_data(self, day: str, data: list[Holiday], rewrite: bool = True):
+        """Saves data of the day, e.g. of the coming day scrapped in advance
+
+        Args:
+            day (str): day in dd-mm-yy format
+            data (list[Holiday]): List of (holiday, image path) pairs
+            rewrite (bool, optional): Should rewrite file if exists. Defaults to True.
+        """
+        if day == self._generate_today_filename():
+            self.save_today_data(data, rewrite)
+            return
+        if self.is_day_saved(day) and not rewrite:
+            return
+        self._save_day_rows(day, data)
+
+    async def save_day_data_async(
+        self, day: str, data: list[Holiday], rewrite: bool = True
+    ):
+        """Saves data of the day without blocking the event loop
+
+        Args:
+            day (str): day in dd-mm-yy format
+            data (list[Holiday]): List of (holiday, image path) pairs
+            rewrite (bool, optional): Should rewrite file if exists. Defaults to True.
+        """
+        await asyncio.to_thread(self.save_day_data, day, data, rewrite)
+
+    def get_checkpoint(self, day: str) -> dict[int, tuple[str, str]]:
+        """Reads the checkpoint of the day's unfinished scrap
+
+        Args:
+            day (str): day in dd-mm-yy format
+
+        Returns:
+            dict[int, tuple[str, str]]: holiday index -> (holiday, image path) pair
+        """
+        checkpoint: dict[int, tuple[str, str]] = {}
+        checkpoint_path = self._get_checkpoint_path(day)
+        if not os.path.isfile(checkpoint_path):
+            return checkpoint
 
         with open(
-            self._get_today_file_path(), "w", newline="", encoding="utf-8"
+            checkpoint_path, "r", newline="", encoding="utf-8"
         ) as f:  # pylint: disable=C0103
-            csv.writer(f, delimiter=self.csv_delimiter).writerows(
-                [holiday.as_tuple() for holiday in data]
-            )
+            for row in csv.reader(f, delimiter=self.csv_delimiter):
+                # the last row may be torn by a crash
+                if len(row) != 3:
+                    continue
+                try:
+                    checkpoint[int(row[0])] = (row[1], row[2])
+                except ValueError:
+                    continue
+
+        return checkpoint
+
+    def append_checkpoint(self, day: str, idx: int, entry: tuple[str, str]):
+        """Durably appends single finished (holiday, image path) pair
+        to the checkpoint of the day's scrap
 
-    def clean(self):
-        """Cleans all te data except today's one"""
+        Args:
+            day (str): day in dd-mm-yy format
+            idx (int): holiday index
+            entry (tuple[str, str]): (holiday, image path) pair
+        """
+        with open(
+            self._get_checkpoint_path(day), "a", newline="", encoding="utf-8"
+        ) as f:  # pylint: disable=C0103
+            csv.writer(f, delimiter=self.csv_delimiter).writerow((idx, *entry))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove_checkpoint(self, day: str):
+        """Removes the checkpoint of the day's scrap
+
+        Args:
+            day (str): day in dd-mm-yy format
+        """
+        if os.path.isfile(self._get_checkpoint_path(day)):
+            os.remove(self._get_checkpoint_path(day))
 
-        today_filename = self._generate_today_filename()
+    def clean(self) -> int:
+        """Cleans the data older than retention.storage_max_days.
+        Data of the coming days is kept
 
+        Returns:
+            int: freed bytes
+        """
+
+        today = DATE_TIME_INFO.get_datetime_now().date()
+        storage_max_days = SETTINGS_MANAGER.retention.storage_max_days
+
+        if Storage._use_database():
+            old_days = [
+                (day,)
+                for (day,) in DATABASE.execute("SELECT day FROM days")
+                if (today - datetime.strptime(day, "%d-%m-%y").date()).days
+                > storage_max_days
+            ]
+            with DATABASE.transaction() as connection:
+                connection.executemany("DELETE FROM days WHERE day = ?", old_days)
+                connection.executemany("DELETE FROM deliveries WHERE day = ?", old_days)
+
+        freed_bytes = 0
         for file in os.listdir(self.path):
             file_name, file_extension = os.path.splitext(file)
-            if file_name == today_filename:
-                continue
             path_to_file = os.path.join(self.path, file)
-            if file_extension == ".csv" and os.path.isfile(path_to_file):
-                os.remove(path_to_file)
+            if file_extension != ".csv" or not os.path.isfile(path_to_file):
+                continue
+            # checkpoints are named <day>.part.csv
+            try:
+                file_date = datetime.strptime(file_name.split(".")[0], "%d-%m-%y")
+            except ValueError:
+                continue
+            if (today - file_date.date()).days <= storage_max_days:
+                continue
+            freed_bytes += os.path.getsize(path_to_file)
+            os.remove(path_to_file)
+
+        return freed_bytes
 
 
 STORAGE = Storage()